@@ -3,15 +3,51 @@ import re
 import sqlite3
 from contextlib import contextmanager
 
+from desc_attr_v2 import backfill_desc_attr
+
 try:
     import psycopg2
+    from psycopg2 import extras as _pg_extras
     PG_AVAILABLE = True
 except Exception:
     PG_AVAILABLE = False
 
 
-SCHEMA_VERSION = 2
+SCHEMA_VERSION = 3
 _AUTO_BACKEND: str | None = None
+
+# Índices das consultas quentes de gravação/descotejo (depara por par/NRBRM,
+# conciliados por PAR_ID, família contábil e sugestões diretas por NRBRM). Mesma DDL nos dois backends.
+PAIR_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_depara_fc ON depara(ID_FISICO, ID_CONTABIL);",
+    "CREATE INDEX IF NOT EXISTS idx_depara_nf ON depara(NRBRM, ID_FISICO);",
+    "CREATE INDEX IF NOT EXISTS idx_conc_par ON conciliados(PAR_ID);",
+    "CREATE INDEX IF NOT EXISTS idx_ctb_nrbrm_inc ON contabil(NRBRM, INC);",
+    # incorporados (INC≠0) por NRBRM já na ordem de ID: cobre find_children_ctb_ids(_bulk) sem ler a tabela
+    "CREATE INDEX IF NOT EXISTS idx_ctb_children ON contabil(NRBRM, ID, INC) WHERE COALESCE(INC,0) <> 0;",
+    "CREATE INDEX IF NOT EXISTS idx_fis_nrbrm ON fisico(NRBRM);",
+]
+
+# Automático (02): só a regra 3 (MODELO_NORM igual) usa índice, no JOIN de load_pairs_auto02.
+# As regras "contém" (LIKE '%x%') não usam b-tree; os índices que existiam para elas saem do banco.
+AUTO02_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_ctb_modelo_norm ON contabil(MODELO_NORM);",
+    "DROP INDEX IF EXISTS idx_fis_serie_norm;",
+    "DROP INDEX IF EXISTS idx_fis_modelo_norm;",
+    "DROP INDEX IF EXISTS idx_fis_tag_norm;",
+    "DROP INDEX IF EXISTS idx_ctb_serie_norm;",
+    "DROP INDEX IF EXISTS idx_ctb_desc_norm;",
+]
+
+# Colunas das listas de filtro (get_distinct_values): o scan sai do índice, sem ler a tabela.
+FILTER_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS idx_{alias}_{col.lower()} ON {table}({col}) WHERE {col} IS NOT NULL;"
+    for table, alias, cols in (
+        ("fisico", "fis", ("FILIAL", "CCUSTO", "LOCAL", "CONDIC")),
+        ("contabil", "ctb", ("FILIAL", "CCUSTO", "LOCAL", "DT_AQUISICAO")),
+    )
+    for col in cols
+]
 _AUTO_PG_DSN: str | None = None
 
 
@@ -130,7 +166,8 @@ class CompatCursor:
     def executemany(self, sql, seq_of_params):
         self._rows_override = None
         self._row_idx = 0
-        self._raw.executemany(self._conn._rewrite_sql(sql), seq_of_params)
+        # executemany do psycopg2 faz uma ida ao servidor por linha; execute_batch manda páginas
+        _pg_extras.execute_batch(self._raw, self._conn._rewrite_sql(sql), seq_of_params, page_size=1000)
         return self
 
     def fetchone(self):
@@ -162,6 +199,10 @@ class CompatCursor:
     def close(self):
         return self._raw.close()
 
+    def __iter__(self):
+        # mesmo contrato do sqlite3.Cursor: `for row in cur.execute(...)` sem fetchall()
+        return iter(self.fetchone, None)
+
     def __enter__(self):
         return self
 
@@ -337,6 +378,23 @@ def connect(db_path: str):
     return sqlite3.connect(db_path)
 
 
+def connect_tuned(db_path: str):
+    """connect() com os PRAGMAs de desempenho do SQLite (tela Manual e Automático); no PostgreSQL é o connect()."""
+    conn = connect(db_path)
+    if isinstance(conn, sqlite3.Connection):
+        try:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            conn.execute("PRAGMA temp_store=MEMORY;")
+            conn.execute("PRAGMA cache_size=-65536;")
+            conn.execute("PRAGMA busy_timeout=5000;")
+            # checkpoint automático menos frequente; os saves grandes pedem um PASSIVE ao final
+            conn.execute("PRAGMA wal_autocheckpoint=10000;")
+        except Exception:
+            pass
+    return conn
+
+
 def init_db(conn):
     cur = conn.cursor()
 
@@ -372,7 +430,8 @@ def init_db(conn):
             MODELO_NORM TEXT,
             SERIE_NORM TEXT,
             TAG_NORM TEXT,
-            BEM_ANT_NORM TEXT
+            BEM_ANT_NORM TEXT,
+            DESC_ATTR TEXT
         );
         """)
 
@@ -409,7 +468,8 @@ def init_db(conn):
             MODELO_NORM TEXT,
             SERIE_NORM TEXT,
             TAG_NORM TEXT,
-            BEM_ANT_NORM TEXT
+            BEM_ANT_NORM TEXT,
+            DESC_ATTR TEXT
         );
         """)
 
@@ -443,6 +503,9 @@ def init_db(conn):
         ALTER TABLE conciliados
         ADD COLUMN IF NOT EXISTS id BIGINT;
         """)
+        # v3: atributos da descrição (regra 6 do Automático 02), gravados na importação
+        cur.execute("ALTER TABLE fisico ADD COLUMN IF NOT EXISTS DESC_ATTR TEXT;")
+        cur.execute("ALTER TABLE contabil ADD COLUMN IF NOT EXISTS DESC_ATTR TEXT;")
         cur.execute("""
         DO $$
         BEGIN
@@ -498,7 +561,10 @@ def init_db(conn):
         cur.execute("""
         CREATE INDEX IF NOT EXISTS idx_depara_ctb ON depara(id_contabil);
         """)
+        for sql in PAIR_INDEXES + AUTO02_INDEXES + FILTER_INDEXES:
+            cur.execute(sql)
 
+        prev_version = _stored_schema_version(cur)
         cur.execute("""
         INSERT INTO meta(k, v)
         VALUES ('schema_version', %s)
@@ -537,7 +603,8 @@ def init_db(conn):
             MODELO_NORM TEXT,
             SERIE_NORM TEXT,
             TAG_NORM TEXT,
-            BEM_ANT_NORM TEXT
+            BEM_ANT_NORM TEXT,
+            DESC_ATTR TEXT
         );
         """)
 
@@ -574,7 +641,8 @@ def init_db(conn):
             MODELO_NORM TEXT,
             SERIE_NORM TEXT,
             TAG_NORM TEXT,
-            BEM_ANT_NORM TEXT
+            BEM_ANT_NORM TEXT,
+            DESC_ATTR TEXT
         );
         """)
 
@@ -605,6 +673,12 @@ def init_db(conn):
         );
         """)
 
+        # v3: atributos da descrição (regra 6 do Automático 02), gravados na importação
+        for table in ("fisico", "contabil"):
+            cols = {r[1].upper() for r in cur.execute(f"PRAGMA table_info({table});").fetchall()}
+            if "DESC_ATTR" not in cols:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN DESC_ATTR TEXT;")
+
         cur.execute("""
         CREATE INDEX IF NOT EXISTS idx_conc_base_id
         ON conciliados(BASE, ID);
@@ -613,15 +687,31 @@ def init_db(conn):
         cur.execute("CREATE INDEX IF NOT EXISTS idx_ctb_id ON contabil(ID);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_depara_fis ON depara(ID_FISICO);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_depara_ctb ON depara(ID_CONTABIL);")
+        for sql in PAIR_INDEXES + AUTO02_INDEXES + FILTER_INDEXES:
+            cur.execute(sql)
 
+        prev_version = _stored_schema_version(cur)
         cur.execute("""
         INSERT OR REPLACE INTO meta(k, v)
         VALUES ('schema_version', ?);
         """, (str(SCHEMA_VERSION),))
 
+    if prev_version is not None and prev_version < 3:
+        # v3: banco importado antes da DESC_ATTR — preenche uma vez, na mesma transação
+        backfill_desc_attr(conn)
+
     conn.commit()
 
 
+def _stored_schema_version(cur) -> int | None:
+    """schema_version gravada no meta (None em banco novo)."""
+    row = cur.execute("SELECT v FROM meta WHERE k = 'schema_version';").fetchone()
+    try:
+        return int(row[0]) if row else None
+    except (TypeError, ValueError):
+        return None
+
+
 def fetchone(conn, sql, params=None):
     cur = conn.cursor()
     cur.execute(sql, params or ())
@@ -0,0 +1,109 @@
+# desc_attr_v2.py
+# Atributos da descrição (regra 6 do Automático 02): usados na importação (DESC_ATTR),
+# na migração v3 do init_db e na tela Manual. Sem dependência dos outros módulos do app.
+from __future__ import annotations
+
+import re
+
+import pandas as pd
+
+
+# --- Regra 6 (Auto02): Similaridade por descrição (>=2 atributos) ---
+_STOP_LABELS = {"MCA", "MOD", "SERIE", "CAP", "CAPACIDADE", "TAG"}
+# remove blocos rotulados (não-guloso até próximo rótulo ou fim)
+_NOISE_RE = re.compile(
+    r"\b(MCA|MOD|SERIE|CAP|CAPACIDADE|TAG)\s*[:=]\s*.*?(?=\b(MCA|MOD|SERIE|CAP|CAPACIDADE|TAG)\b\s*[:=]|$)",
+    re.IGNORECASE,
+)
+_TOKEN_RE = re.compile(r"[A-Z0-9]+")
+
+def _strip_noise_fields(desc: str) -> str:
+    """Remove segmentos do tipo 'MCA: ...', 'MOD: ...', 'SERIE: ...', 'CAP: ...', 'CAPACIDADE: ...', 'TAG: ...'.
+    A ideia é evitar que esses trechos dominem a similaridade.
+    """
+    if not desc:
+        return ""
+    s = str(desc)
+    # normaliza espaços
+    s = s.replace("\n", " ").replace("\r", " ")
+    # remove blocos rotulados (não-guloso até próximo rótulo ou fim)
+    # Ex.: "MCA: LG MOD: 32LW300C SERIE: 123" => remove tudo que está após cada rótulo
+    try:
+        s = _NOISE_RE.sub(" ", s)
+    except Exception:
+        # se regex falhar por algum motivo, segue com o texto original
+        pass
+    return s
+
+def _desc_attr_set(desc: str) -> set:
+    """Extrai um conjunto de 'atributos' da descrição para comparar semelhança.
+    - Remove blocos MCA/MOD/SERIE/CAP/CAPACIDADE/TAG
+    - Usa tokens com len>=3 ou numéricos com len>=2
+    - Usa prefixo de 3 caracteres para tokens alfabéticos (ex.: 'cadeira' -> 'cad')
+    """
+    if not desc:
+        return set()
+    s = _strip_noise_fields(desc).upper()
+    # mantém letras/números como tokens
+    tokens = _TOKEN_RE.findall(s)
+    out = set()
+    for tok in tokens:
+        if tok in _STOP_LABELS:
+            continue
+        if tok.isdigit():
+            if len(tok) >= 2:
+                out.add(tok)
+            continue
+        if len(tok) >= 3:
+            out.add(tok[:3])  # atributo por prefixo (>=3)
+    return out
+
+
+def desc_attr_frame(ids, descs) -> pd.DataFrame:
+    """Versão vetorizada de _desc_attr_set: formato longo (ID, ATTR), sem duplicatas."""
+    txt = pd.Series(descs, dtype=object).fillna("").astype(str)
+    txt = txt.str.replace("\n", " ", regex=False).str.replace("\r", " ", regex=False)
+    txt = txt.str.replace(_NOISE_RE, " ", regex=True).str.upper()
+    long = (
+        pd.DataFrame({"ID": pd.Series(ids).to_numpy(), "ATTR": txt.str.findall(_TOKEN_RE).to_numpy()})
+        .explode("ATTR")
+        .dropna(subset=["ATTR"])
+    )
+    tok = long["ATTR"].astype(str)
+    is_num = tok.str.isdigit()
+    size = tok.str.len()
+    keep = ~tok.isin(_STOP_LABELS) & ((is_num & (size >= 2)) | (~is_num & (size >= 3)))
+    long = long.loc[keep]
+    # atributo por prefixo (>=3) para tokens alfabéticos; numéricos ficam inteiros
+    long["ATTR"] = tok[keep].where(is_num[keep], tok[keep].str[:3])
+    return long.drop_duplicates(ignore_index=True)
+
+
+def desc_attr_series(descs: pd.Series) -> pd.Series:
+    """Coluna DESC_ATTR: atributos de cada descrição separados por espaço (ordenados)."""
+    descs = pd.Series(descs)
+    long = desc_attr_frame(range(len(descs)), descs)
+    joined = long.groupby("ID")["ATTR"].agg(lambda x: " ".join(sorted(x)))
+    return pd.Series(joined.reindex(range(len(descs)), fill_value="").to_numpy(), index=descs.index)
+
+
+def backfill_desc_attr(con) -> None:
+    """Preenche DESC_ATTR de bancos importados antes da coluna existir (migração v3 do init_db)."""
+    cur = con.cursor()
+    for table in ("fisico", "contabil"):
+        descs = [r[0] for r in cur.execute(
+            f"SELECT DISTINCT COALESCE(NULLIF(DESCRICAO,''), DESC_NORM, '') FROM {table} WHERE DESC_ATTR IS NULL;"
+        ).fetchall()]
+        if not descs:
+            continue
+        attrs = desc_attr_series(pd.Series(descs, dtype=object))
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS _desc_attr_map(d TEXT PRIMARY KEY, a TEXT);")
+        cur.execute("DELETE FROM _desc_attr_map;")
+        cur.executemany("INSERT INTO _desc_attr_map VALUES (?, ?);", list(zip(descs, attrs.tolist())))
+        cur.execute(
+            f"""UPDATE {table} SET DESC_ATTR = (
+                    SELECT m.a FROM _desc_attr_map m
+                    WHERE m.d = COALESCE(NULLIF({table}.DESCRICAO,''), {table}.DESC_NORM, '')
+                ) WHERE DESC_ATTR IS NULL;"""
+        )
+        cur.execute("DELETE FROM _desc_attr_map;")
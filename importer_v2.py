@@ -7,6 +7,7 @@ from typing import Dict, Iterable, List, Tuple, Callable, Optional
 import pandas as pd
 
 from db_utils_v2 import connect, init_db
+from desc_attr_v2 import desc_attr_series
 
 # Mapeamento dos cabeçalhos do Excel (modelo do cliente) -> colunas do SQLite (schema V2)
 MAP_FISICO: Dict[str, str] = {
@@ -106,6 +107,8 @@ def _prepare_fisico(df: pd.DataFrame) -> pd.DataFrame:
     df["SERIE_NORM"] = _norm_text(df["SERIE"]).str.upper()
     df["TAG_NORM"] = _norm_text(df["TAG"]).str.upper()
     df["BEM_ANT_NORM"] = _norm_text(df["BEM_ANTERIOR"]).str.upper()
+    # atributos da descrição (regra 6 do Automático 02), calculados uma vez aqui
+    df["DESC_ATTR"] = desc_attr_series(df["DESCRICAO"].where(df["DESCRICAO"] != "", df["DESC_NORM"]))
 
     return df
 
@@ -131,6 +134,8 @@ def _prepare_contabil(df: pd.DataFrame) -> pd.DataFrame:
     df["SERIE_NORM"] = _norm_text(df["SERIE"]).str.upper()
     df["TAG_NORM"] = _norm_text(df["TAG"]).str.upper()
     df["BEM_ANT_NORM"] = _norm_text(df["BEM_ANTERIOR"]).str.upper()
+    # atributos da descrição (regra 6 do Automático 02), calculados uma vez aqui
+    df["DESC_ATTR"] = desc_attr_series(df["DESCRICAO"].where(df["DESCRICAO"] != "", df["DESC_NORM"]))
 
     return df
 
@@ -214,18 +219,21 @@ def import_to_db(fis_path: str, ctb_path: str, db_path: str, progress_cb: Option
             con.execute("DELETE FROM contabil;")
             con.execute("DELETE FROM conciliados;")
             con.execute("DELETE FROM depara;")
+            if isinstance(con, sqlite3.Connection):
+                # PAR_ID volta a começar em 1 na nova base (saves leem o sqlite_sequence)
+                con.execute("DELETE FROM sqlite_sequence WHERE name='depara';")
 
             fis_cols = [
                 "ID","FILIAL","DESC_FILIAL","CCUSTO","DESCR_CCUSTO","LOCAL","DESCR_LOCAL",
                 "NRBRM","INC","DESCRICAO","MARCA","MODELO","SERIE","DIMENSAO","CAPACIDADE",
                 "TAG","BEM_ANTERIOR","CONDIC","QTD","FRAG",
-                "DESC_NORM","MARCA_NORM","MODELO_NORM","SERIE_NORM","TAG_NORM","BEM_ANT_NORM"
+                "DESC_NORM","MARCA_NORM","MODELO_NORM","SERIE_NORM","TAG_NORM","BEM_ANT_NORM","DESC_ATTR"
             ]
             ctb_cols = [
                 "ID","COD_CONTA","DESC_CONTA","FILIAL","DESC_FILIAL","CCUSTO","DESCR_CCUSTO","LOCAL","DESCR_LOCAL",
                 "NRBRM","INC","DESCRICAO","MARCA","MODELO","SERIE","DIMENSAO","CAPACIDADE",
                 "TAG","BEM_ANTERIOR","QTD","DT_AQUISICAO","VLR_AQUISICAO","DEP_ACUMULADA","VLR_RESIDUAL","FRAG",
-                "DESC_NORM","MARCA_NORM","MODELO_NORM","SERIE_NORM","TAG_NORM","BEM_ANT_NORM"
+                "DESC_NORM","MARCA_NORM","MODELO_NORM","SERIE_NORM","TAG_NORM","BEM_ANT_NORM","DESC_ATTR"
             ]
 
             n_f = _bulk_insert(con, "fisico", df_f, fis_cols, progress_cb=progress_cb, progress_range=(20.0, 55.0), label="Inserindo BsFisico")
@@ -1,18 +1,18 @@
 # interface_inicial_v2_dashboard_fixed.py
 from __future__ import annotations
 
+import collections
 import math
 import os
 import shutil
+import sys
 import threading
 import tempfile
+import time
 import tkinter as tk
 from datetime import datetime
 from tkinter import filedialog, messagebox, ttk
 
-from importer_v2 import import_bases
-from run_auto_v2 import main as run_auto_main
-from exporter_v2 import export_bsdepara
 from manual_v2_FINAL import ManualV2Window
 from dashboard_v2 import DashboardWindow
 from depara_import import DeParaImportWindow
@@ -50,6 +50,9 @@ class TelaInicialV2(tk.Tk):
         self.var_tpl = tk.StringVar(value=os.path.join(samples_dir, "BsDePara.xlsx"))
         self.var_out = tk.StringVar(value=os.path.join(samples_dir, "BsDePara_conciliados.xlsx"))
         self.var_db = tk.StringVar(value=_default_db_path(self.base_dir))
+        # Caminho do banco já "stripado", atualizado a cada escrita em var_db.
+        self._db_path_cached = self.var_db.get().strip()
+        self.var_db.trace_add("write", self._on_db_changed)
 
         # Métricas (mini-dashboard)
         self.mv_fis_total = tk.StringVar(value="0")
@@ -65,7 +68,11 @@ class TelaInicialV2(tk.Tk):
         self.mv_line_conc = tk.StringVar(value="")
         self.mv_line_sobra = tk.StringVar(value="")
         self.logo_image = None
-
+        self._last_status_ts = 0.0
+        self._cleanup_conns: dict = {}
+        # Falhas da limpeza de saída: últimas (caminho, errno) + total, resumidas no stderr ao sair.
+        self._cleanup_errors: collections.deque = collections.deque(maxlen=64)
+        self._cleanup_error_count = 0
 
         self._build()
         self._build_menu()
@@ -262,7 +269,7 @@ class TelaInicialV2(tk.Tk):
 
     def _abrir_descotejar(self) -> None:
         """Abre a tela de DESCOTEJAR (desfazer conciliações) via importação de planilha De-Para."""
-        db_path = self.var_db.get().strip()
+        db_path = self._db_path_cached
         if not db_path:
             messagebox.showwarning(
                 "Descotejar",
@@ -289,7 +296,7 @@ class TelaInicialV2(tk.Tk):
             messagebox.showerror("Descotejar", f"Falha ao abrir a tela de Descotejar:\n{e}")
 
     def _abrir_relatorio_analitico(self) -> None:
-        dbp = self.var_db.get().strip()
+        dbp = self._db_path_cached
         if not dbp:
             messagebox.showerror("Relatório Analítico", "Selecione o banco.")
             return
@@ -564,7 +571,7 @@ class TelaInicialV2(tk.Tk):
 
     # ---------- métricas / mini-dashboard ----------
     def _detect_backend_label(self) -> str:
-        db_path = self.var_db.get().strip()
+        db_path = self._db_path_cached
         if not db_path:
             return "Banco ativo: não configurado"
         try:
@@ -586,7 +593,7 @@ class TelaInicialV2(tk.Tk):
             return False
 
     def _get_metrics(self) -> dict:
-        db = self.var_db.get().strip()
+        db = self._db_path_cached
         if not db:
             return {
                 "fis_total": 0,
@@ -715,11 +722,16 @@ class TelaInicialV2(tk.Tk):
             self.var_db.set(p)
             self._update_dashboard()
 
+    def _on_db_changed(self, *_) -> None:
+        self._db_path_cached = self.var_db.get().strip()
+
     # ---------- actions ----------
     def _cleanup_cache_on_exit(self) -> tuple[int, int]:
         """Limpa caches/artefatos de runtime para reduzir acúmulo e lentidão."""
         removed_dirs = 0
         removed_files = 0
+        self._cleanup_errors.clear()
+        self._cleanup_error_count = 0
         base = os.path.abspath(getattr(self, "base_dir", os.path.dirname(__file__)))
         skip_top = {"dist", "build", ".git", ".idea", ".vscode", ".venv", "venv"}
 
@@ -732,8 +744,8 @@ class TelaInicialV2(tk.Tk):
                 try:
                     shutil.rmtree(p, ignore_errors=False)
                     removed_dirs += 1
-                except Exception:
-                    pass
+                except OSError as e:
+                    self._note_cleanup_error(p, e.errno)
                 dirs.remove("__pycache__")
 
             for f in files:
@@ -743,80 +755,148 @@ class TelaInicialV2(tk.Tk):
                 try:
                     os.remove(p)
                     removed_files += 1
-                except Exception:
-                    pass
+                except OSError as e:
+                    self._note_cleanup_error(p, e.errno)
 
         # 2) Arquivos transitórios do SQLite (WAL/SHM/JOURNAL) dos DBs usados.
-        db_candidates = set()
-        db_var = self.var_db.get().strip() if hasattr(self, "var_db") else ""
-        if db_var:
-            db_candidates.add(db_var)
-        db_candidates.add(os.path.join(base, "conciliador.db"))
-        db_candidates.add(os.path.join(base, "conciliador_v2.db"))
-
-        for db_path in db_candidates:
-            if not db_path:
-                continue
-            db_path = os.path.abspath(db_path)
-            if not os.path.exists(db_path):
-                continue
+        # realpath: o mesmo arquivo escrito de formas diferentes vira um único candidato.
+        def _norm(p: str) -> str:
+            return os.path.realpath(p) if p else ""
+
+        db_var = getattr(self, "_db_path_cached", "")
+        db_candidates = {
+            _norm(db_var),
+            _norm(os.path.join(base, "conciliador.db")),
+            _norm(os.path.join(base, "conciliador_v2.db")),
+        } - {""}
+
+        existing_dbs = [p for p in db_candidates if os.path.exists(p)]
+        # Nada de WAL/SHM/JOURNAL em disco: não há o que checkpointar nem apagar.
+        sidecars = [f"{db_path}{suffix}" for db_path in existing_dbs for suffix in ("-wal", "-shm", "-journal")]
+        if not any(os.path.exists(p) for p in sidecars):
+            existing_dbs = []
+            sidecars = []
 
-            try:
-                con = connect(db_path)
+        try:
+            for db_path in existing_dbs:
                 try:
+                    con = self._cleanup_conn(db_path)
+                    # Saindo do sistema: sem fsync no checkpoint (PRAGMA vale só nesta conexão).
+                    con.execute("PRAGMA synchronous=OFF;")
                     con.execute("PRAGMA wal_checkpoint(TRUNCATE);")
-                finally:
-                    con.close()
-            except Exception:
-                pass
+                except Exception as e:
+                    # Erro de banco (sqlite3/psycopg2) não é OSError; registra sem errno.
+                    self._note_cleanup_error(db_path, getattr(e, "errno", None))
+        finally:
+            # Fecha antes de apagar os sidecars (conexão aberta prende -wal/-shm).
+            self._close_cleanup_conns()
 
-            for suffix in ("-wal", "-shm", "-journal"):
-                side = f"{db_path}{suffix}"
-                if not os.path.exists(side):
-                    continue
-                try:
-                    os.remove(side)
-                    removed_files += 1
-                except Exception:
-                    pass
+        # Sidecars e temporários do Excel são apagados juntos no fim.
+        to_remove = sidecars
 
         # 3) Lixo temporário típico do Excel na pasta temporária do sistema.
+        tmp_dir = ""
         try:
             tmp_dir = tempfile.gettempdir()
-            for name in os.listdir(tmp_dir):
-                if not name.startswith("~$"):
-                    continue
-                p = os.path.join(tmp_dir, name)
-                if not os.path.isfile(p):
-                    continue
-                try:
-                    os.remove(p)
-                    removed_files += 1
-                except Exception:
-                    pass
-        except Exception:
-            pass
+            # scandir: o tipo da entrada vem junto da listagem (sem isfile por arquivo).
+            with os.scandir(tmp_dir) as it:
+                for entry in it:
+                    if entry.name.startswith("~$") and entry.is_file():
+                        to_remove.append(entry.path)
+        except OSError as e:
+            self._note_cleanup_error(tmp_dir, e.errno)
+
+        removed_files += self._remove_files(to_remove)
         return removed_dirs, removed_files
 
+    def _note_cleanup_error(self, path: str, errno_) -> None:
+        self._cleanup_errors.append((path, errno_))
+        self._cleanup_error_count += 1
+
+    def _report_cleanup_errors(self) -> None:
+        """Resumo das falhas da limpeza no stderr (a janela fecha logo em seguida)."""
+        print(f"[EVS] Limpeza de saída: {self._cleanup_error_count} falha(s).", file=sys.stderr)
+        for path, errno_ in list(self._cleanup_errors)[:10]:
+            print(f"[EVS]   {path} (errno {errno_})", file=sys.stderr)
+        if self._cleanup_error_count > 10:
+            print(f"[EVS]   ... e mais {self._cleanup_error_count - 10}.", file=sys.stderr)
+
+    def _remove_files(self, paths: list[str]) -> int:
+        """Apaga arquivos; os que já sumiram não contam."""
+        removed = 0
+        # Remove direto (sem exists antes): evita stat extra e corrida check/remove.
+        for p in paths:
+            try:
+                os.remove(p)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self._note_cleanup_error(p, e.errno)
+        return removed
+
+    def _cleanup_conn(self, db_path: str):
+        """Conexão reaproveitada por DB durante a limpeza (abre uma vez por caminho)."""
+        con = self._cleanup_conns.get(db_path)
+        if con is None:
+            con = connect(db_path)
+            if hasattr(con, "isolation_level"):
+                # Sem BEGIN implícito em volta dos PRAGMAs.
+                con.isolation_level = None
+            self._cleanup_conns[db_path] = con
+        return con
+
+    def _close_cleanup_conns(self) -> None:
+        for con in self._cleanup_conns.values():
+            try:
+                con.close()
+            except Exception:
+                pass
+        self._cleanup_conns.clear()
+
     def _exit_system(self) -> None:
+        # Segundo clique em "Sair"/"X" durante a limpeza: fecha na hora.
+        if getattr(self, "_exiting", False):
+            self.destroy()
+            return
+        self._exiting = True
+        self._set_status("Saindo... limpando cache.")
+        # Limpeza fora da thread do Tkinter para a janela não travar ao fechar.
+        threading.Thread(target=self._do_cleanup_then_destroy, daemon=True).start()
+
+    def _do_cleanup_then_destroy(self) -> None:
         try:
             d, f = self._cleanup_cache_on_exit()
-            self._set_status(f"Saindo... cache limpo ({d} pasta(s), {f} arquivo(s)).")
+            msg = f"Saindo... cache limpo ({d} pasta(s), {f} arquivo(s))."
+            if self._cleanup_error_count:
+                self._report_cleanup_errors()
+            self.after(0, lambda: self._set_status(msg, force=True))
+        except Exception:
+            pass
+        try:
+            self.after(0, self.destroy)
         except Exception:
             pass
-        self.destroy()
 
-    def _set_status(self, msg: str) -> None:
+    def _set_status(self, msg: str, force: bool = False) -> None:
         self.lbl_status.config(text=msg)
-        self.update_idletasks()
+        # Redesenho limitado a ~30 fps; mensagens finais usam force=True.
+        now = time.monotonic()
+        if force or now - self._last_status_ts > 0.033:
+            self.update_idletasks()
+            self._last_status_ts = now
 
 
     def _set_buttons_enabled(self, enabled: bool) -> None:
         # desabilita botões durante tarefas pesadas para evitar duplo clique e travamento
+        if getattr(self, "_buttons_state", None) == enabled:
+            return
+        self._buttons_state = enabled
+        new_state = "normal" if enabled else "disabled"
         for btn in getattr(self, "_action_buttons", []):
             try:
-                btn.config(state=("normal" if enabled else "disabled"))
-            except Exception:
+                btn.config(state=new_state)
+            except tk.TclError:
                 pass
 
     def _run_async(self, start_msg: str, work_fn, ok_title: str, ok_msg: str, end_status: str) -> None:
@@ -830,7 +910,7 @@ class TelaInicialV2(tk.Tk):
                 def on_ok():
                     if ok_msg:
                         messagebox.showinfo(ok_title, ok_msg)
-                    self._set_status(end_status)
+                    self._set_status(end_status, force=True)
                     self._update_dashboard()
                     self._set_buttons_enabled(True)
                 self.after(0, on_ok)
@@ -838,16 +918,17 @@ class TelaInicialV2(tk.Tk):
             except Exception as e:
                 def on_err():
                     messagebox.showerror("Erro", str(e))
-                    self._set_status(f"Erro: {e}")
+                    self._set_status(f"Erro: {e}", force=True)
                     self._set_buttons_enabled(True)
                 self.after(0, on_err)
 
-        threading.Thread(target=runner, daemon=True).start()
+        # daemon: fechar a janela no meio de uma importação/exportação não prende o processo
+        threading.Thread(target=runner, daemon=True, name="evs-bg").start()
 
     def _import_bases(self):
         fis = self.var_fis.get().strip()
         ctb = self.var_ctb.get().strip()
-        dbp = self.var_db.get().strip()
+        dbp = self._db_path_cached
 
         if not os.path.isfile(fis):
             messagebox.showerror("Erro", "Arquivo BsFisico não encontrado.")
@@ -859,29 +940,39 @@ class TelaInicialV2(tk.Tk):
             messagebox.showerror("Erro", "Informe o caminho do banco (.db).")
             return
 
+        def _work():
+            # Import tardio (na thread de trabalho) para não pesar na abertura da tela.
+            from importer_v2 import import_bases
+            return import_bases(fis, ctb, dbp, reset=True)
+
         self._run_async(
             start_msg="Importando bases…",
-            work_fn=lambda: import_bases(fis, ctb, dbp, reset=True),
+            work_fn=_work,
             ok_title="OK",
             ok_msg="Importação concluída.",
             end_status="Importação concluída."
         )
 
     def _processar_auto(self):
-        dbp = self.var_db.get().strip()
+        dbp = self._db_path_cached
         if not dbp:
             messagebox.showerror("Erro", "Selecione o banco (.db).")
             return
+
+        def _work():
+            from run_auto_v2 import main as run_auto_main
+            return run_auto_main(dbp)
+
         self._run_async(
             start_msg="Processando automático…",
-            work_fn=lambda: run_auto_main(dbp),
+            work_fn=_work,
             ok_title="OK",
             ok_msg="Processamento automático finalizado.",
             end_status="Automático finalizado."
         )
 
     def _exportar_bsdepara(self):
-        dbp = self.var_db.get().strip()
+        dbp = self._db_path_cached
         tpl = self.var_tpl.get().strip()
         outp = self.var_out.get().strip()
 
@@ -898,30 +989,34 @@ class TelaInicialV2(tk.Tk):
         # cria pasta se necessário
         os.makedirs(os.path.dirname(outp) or ".", exist_ok=True)
 
+        def _work():
+            from exporter_v2 import export_bsdepara
+            return export_bsdepara(dbp, tpl, outp, ultra_fast=False)
+
         self._run_async(
             start_msg="Exportando BsDePara…",
-            work_fn=lambda: export_bsdepara(dbp, tpl, outp, ultra_fast=False),
+            work_fn=_work,
             ok_title="OK",
             ok_msg=f"Exportação concluída:\n{outp}",
             end_status="Exportação concluída."
         )
 
     def _abrir_manual(self):
-        dbp = self.var_db.get().strip()
+        dbp = self._db_path_cached
         if not dbp:
             messagebox.showerror("Erro", "Selecione o banco (.db).")
             return
         ManualV2Window(self, db_path=dbp)
 
     def _abrir_dashboard(self):
-        dbp = self.var_db.get().strip()
+        dbp = self._db_path_cached
         if not dbp:
             messagebox.showerror("Erro", "Selecione o banco (.db).")
             return
         DashboardWindow(self, db_path=dbp)
 
     def _abrir_dashboard_sintetico(self):
-        dbp = self.var_db.get().strip()
+        dbp = self._db_path_cached
         if not dbp:
             messagebox.showerror("Erro", "Selecione o banco (.db).")
             return
@@ -934,13 +1029,8 @@ class TelaInicialV2(tk.Tk):
 
 
     def _importar_depara(self):
-        dbp = self.var_db.get().strip()
+        dbp = self._db_path_cached
         if not dbp:
             messagebox.showerror("Erro", "Selecione o banco (.db).")
             return
         DeParaImportWindow(self, db_path=dbp)
-
-if __name__ == "__main__":
-    app = TelaInicialV2()
-    app.mainloop()
-# Layout fix: Modo Conciliação moved beside Modo.
@@ -3,11 +3,18 @@ from __future__ import annotations
 import os
 import sys
 
+# Pasta 'app' já resolvida (o _MEIPASS não muda durante o processo).
+_APP_DIR_CACHED: str | None = None
+
 def _add_app_to_syspath() -> None:
     """
     Garante que a pasta 'app' (com seus .py) esteja no sys.path
     tanto em modo normal quanto empacotado pelo PyInstaller.
     """
+    global _APP_DIR_CACHED
+    if _APP_DIR_CACHED is not None:
+        return
+
     # Quando empacotado, _MEIPASS aponta para a pasta temporária do bundle
     base = getattr(sys, "_MEIPASS", os.path.abspath(os.path.dirname(__file__)))
 
@@ -21,6 +28,7 @@ def _add_app_to_syspath() -> None:
 
     if app_dir not in sys.path:
         sys.path.insert(0, app_dir)
+    _APP_DIR_CACHED = app_dir
 
 def main() -> None:
     _add_app_to_syspath()
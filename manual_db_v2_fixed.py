@@ -1,13 +1,17 @@
 # manual_db_v2.py
 from __future__ import annotations
 
+import json
 import sqlite3
-import re
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Optional, Tuple, Dict, Any
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple, Dict, Any
 
 import pandas as pd
-from db_utils_v2 import connect as connect_auto
+from db_utils_v2 import connect_tuned
+from desc_attr_v2 import desc_attr_frame
 
 
 @dataclass(frozen=True)
@@ -17,24 +21,56 @@ class PendingCounts:
 
 
 def connect(db_path: str) -> sqlite3.Connection:
-    con = connect_auto(db_path)
-    try:
-        con.execute("PRAGMA journal_mode=WAL;")
-        con.execute("PRAGMA synchronous=NORMAL;")
-        con.execute("PRAGMA temp_store=MEMORY;")
-    except Exception:
-        pass
-    return con
+    return connect_tuned(db_path)
 
 
+# Tamanho dos lotes de IN (?, ...) — bem abaixo do SQLITE_MAX_VARIABLE_NUMBER.
+_IN_CHUNK = 500
+
 
 # ---------------- Helpers: colunas e listas para filtros ----------------
 
+# Colunas por conexão: id(con) -> (con, {tabela: colunas, chave de _resolve_column: coluna}). Guarda a própria conexão
+# para o id não ser reaproveitado enquanto a entrada existir (sqlite3.Connection não
+# aceita weakref); mantém só as últimas _COL_CACHE_MAX conexões.
+_COL_CACHE: "OrderedDict[int, Tuple[Any, Dict[Any, Any]]]" = OrderedDict()
+_COL_CACHE_MAX = 8
+
+def _col_cache_entry(con) -> Dict[Any, Any]:
+    entry = _COL_CACHE.get(id(con))
+    if entry is None or entry[0] is not con:
+        entry = (con, {})
+        _COL_CACHE[id(con)] = entry
+        while len(_COL_CACHE) > _COL_CACHE_MAX:
+            _COL_CACHE.popitem(last=False)
+    else:
+        _COL_CACHE.move_to_end(id(con))
+    return entry[1]
+
+
 def _list_columns(con: sqlite3.Connection, table: str) -> list[str]:
-    cur = con.execute(f"PRAGMA table_info({table});")
-    return [r[1] for r in cur.fetchall()]
+    cache = _col_cache_entry(con)
+    cols = cache.get(table)
+    if cols is None:
+        cur = con.execute(f"PRAGMA table_info({table});")
+        cols = [r[1] for r in cur.fetchall()]
+        if cols:  # tabela ainda inexistente não entra no cache
+            cache[table] = cols
+    return cols
 
 def _resolve_column(con: sqlite3.Connection, table: str, candidates: list[str], *, contains: str | None = None) -> str | None:
+    # resolução memorizada junto das colunas da conexão (ex.: FRAG a cada undo_pairs)
+    key = ("resolve", table, tuple(candidates), contains)
+    cache = _col_cache_entry(con)
+    if key in cache:
+        return cache[key]
+    col = _resolve_column_uncached(con, table, candidates, contains=contains)
+    if table in cache:  # só memoriza com as colunas da tabela já conhecidas
+        cache[key] = col
+    return col
+
+
+def _resolve_column_uncached(con: sqlite3.Connection, table: str, candidates: list[str], *, contains: str | None = None) -> str | None:
     cols = _list_columns(con, table)
     cols_upper = {c.upper(): c for c in cols}
     for cand in candidates:
@@ -51,7 +87,7 @@ def get_distinct_values(con: sqlite3.Connection, field: str, *, include_fis: boo
     field = (field or "").strip().upper()
 
     def _q_distinct(table: str, col: str) -> str:
-        return f"SELECT DISTINCT TRIM(CAST({col} AS TEXT)) AS v FROM {table} WHERE {col} IS NOT NULL AND TRIM(CAST({col} AS TEXT)) <> ''"
+        return f"SELECT TRIM(CAST({col} AS TEXT)) AS v FROM {table} WHERE {col} IS NOT NULL AND TRIM(CAST({col} AS TEXT)) <> ''"
 
     parts: list[str] = []
 
@@ -77,39 +113,53 @@ def get_distinct_values(con: sqlite3.Connection, field: str, *, include_fis: boo
     elif field == "ANO_CTB":
         col = _resolve_column(con, "contabil", ["DT_AQUISICAO", "DT.AQUISIÇÃO", "DT AQUISICAO", "DT_AQUIS"], contains="AQUIS")
         if col:
-            parts.append(f"SELECT DISTINCT SUBSTR(COALESCE({col},''),1,4) AS v FROM contabil WHERE {col} IS NOT NULL AND TRIM(COALESCE({col},'')) <> ''")
+            parts.append(f"SELECT SUBSTR(COALESCE({col},''),1,4) AS v FROM contabil WHERE {col} IS NOT NULL AND TRIM(COALESCE({col},'')) <> ''")
 
     if not parts:
         return []
 
-    sql = " UNION ".join(parts) + " ORDER BY v LIMIT ?;"
+    # um único agrupamento sobre as partes (em vez de DISTINCT por parte + UNION)
+    sql = "SELECT v FROM (" + " UNION ALL ".join(parts) + ") AS u GROUP BY v ORDER BY v LIMIT ?;"
     cur = con.execute(sql, (int(limit),))
     out: list[str] = []
-    for (v,) in cur.fetchall():
+    for (v,) in cur:
         v = (v or "").strip()
         if v:
             out.append(v)
     return out
 
+def _pending_cond(con, base: str, alias: str, c: str = "c") -> str:
+    """NOT EXISTS de `alias`.ID em conciliados (linha pendente).
+
+    conciliados.ID é TEXT no SQLite: comparado com o ID INTEGER da base, a afinidade numérica
+    deixa o índice (BASE, ID) só com BASE=? e cada linha varre a base inteira em conciliados.
+    Com o ID convertido para texto a busca usa os dois campos.
+    """
+    rhs = f"CAST({alias}.ID AS TEXT)" if isinstance(con, sqlite3.Connection) else f"{alias}.ID"
+    return f"NOT EXISTS (SELECT 1 FROM conciliados {c} WHERE {c}.BASE='{base}' AND {c}.ID={rhs})"
+
+
 def get_counts(con: sqlite3.Connection) -> PendingCounts:
-    q_f = """
+    q_f = f"""
     SELECT COUNT(1)
     FROM fisico f
     WHERE f.ID IS NOT NULL
-      AND NOT EXISTS (SELECT 1 FROM conciliados c WHERE c.BASE='FIS' AND c.ID=f.ID);
+      AND {_pending_cond(con, 'FIS', 'f')};
     """
-    q_c = """
+    q_c = f"""
     SELECT COUNT(1)
     FROM contabil t
     WHERE t.ID IS NOT NULL
-      AND NOT EXISTS (SELECT 1 FROM conciliados c WHERE c.BASE='CTB' AND c.ID=t.ID);
+      AND {_pending_cond(con, 'CTB', 't')};
     """
     fis = int(con.execute(q_f).fetchone()[0])
     ctb = int(con.execute(q_c).fetchone()[0])
     return PendingCounts(fis=fis, ctb=ctb)
 
 
+@lru_cache(maxsize=256)
 def _norm_like(value: str) -> str:
+    # mesmo valor de filtro aparece em vários aliases/telas: normaliza uma vez só
     return " ".join((value or "").upper().split())
 
 
@@ -162,9 +212,15 @@ def _eq_text(field_sql: str, value: str) -> Tuple[str, list]:
 
 
 def _apply_desc_terms(field_sql: str, desc1: str, desc2: str, desc3: str, mode: str) -> Tuple[str, list]:
+    clause, params = _desc_terms_cached(field_sql, desc1 or "", desc2 or "", desc3 or "", mode or "")
+    return clause, list(params)
+
+
+@lru_cache(maxsize=128)
+def _desc_terms_cached(field_sql: str, desc1: str, desc2: str, desc3: str, mode: str) -> Tuple[str, tuple]:
     terms = [t.strip() for t in [desc1, desc2, desc3] if (t or "").strip()]
     if not terms:
-        return "", []
+        return "", ()
     mode = (mode or "E").strip().upper()
     if mode not in ("E", "OU"):
         mode = "E"
@@ -177,7 +233,27 @@ def _apply_desc_terms(field_sql: str, desc1: str, desc2: str, desc3: str, mode:
         params.append(f"%{n}%")
 
     joiner = " AND " if mode == "E" else " OR "
-    return f" AND ({joiner.join(clauses)}) ", params
+    return f" AND ({joiner.join(clauses)}) ", tuple(params)
+
+
+def desc_terms_norm(desc1: str, desc2: str, desc3: str) -> Tuple[str, ...]:
+    """Termos de descrição como o filtro SQL os usa (normalizados, sem vazios)."""
+    return tuple(_norm_like(t) for t in (desc1, desc2, desc3) if (t or "").strip())
+
+
+def filter_desc_terms(df: pd.DataFrame, terms: Iterable[str]) -> pd.DataFrame:
+    """Equivalente em pandas do filtro de descrição modo E (DESC_NORM LIKE %termo% para todos os termos).
+
+    Não trata curingas do LIKE ('%', '_') nos termos: quem chama deve consultar o banco nesses casos.
+    """
+    terms = list(terms)
+    if not terms or df.empty:
+        return df
+    desc = df["DESC_NORM"].astype("string").str.upper() if "DESC_NORM" in df.columns else pd.Series("", index=df.index, dtype="string")
+    mask = pd.Series(True, index=df.index)
+    for t in terms:
+        mask &= desc.str.contains(t, case=True, regex=False, na=False)
+    return df.loc[mask].reset_index(drop=True)
 
 
 def load_pending_manual(
@@ -206,11 +282,11 @@ def load_pending_manual(
         raise ValueError("base inválida")
 
     table = "fisico" if base == "FIS" else "contabil"
-    where = """
+    where = f"""
     WHERE t.ID IS NOT NULL
-      AND NOT EXISTS (SELECT 1 FROM conciliados c WHERE c.BASE=? AND c.ID=t.ID)
+      AND {_pending_cond(con, base, 't')}
     """
-    params: list = [base]
+    params: list = []
 
     extra, p = _apply_desc_terms("t.DESC_NORM", desc1, desc2, desc3, desc_mode)
     where += extra; params += p
@@ -262,50 +338,63 @@ AUTO02_RULES = {
 
 
 
-# --- Regra 6 (Auto02): Similaridade por descrição (>=2 atributos) ---
-_STOP_LABELS = {"MCA", "MOD", "SERIE", "CAP", "CAPACIDADE", "TAG"}
+# Condição de JOIN FIS x CTB de cada regra "contém"/"igual" (1–5).
+_AUTO02_JOIN_COND = {
+    # série física (>=4) contida na descrição contábil
+    "1": "LENGTH(f.SERIE_NORM) >= 4 AND t.DESC_NORM LIKE ('%' || f.SERIE_NORM || '%')",
+    # série contábil (>=4) contida na descrição física
+    "2": "LENGTH(t.SERIE_NORM) >= 4 AND f.DESC_NORM LIKE ('%' || t.SERIE_NORM || '%')",
+    "3": "t.MODELO_NORM <> '' AND f.MODELO_NORM = t.MODELO_NORM",
+    "4": "LENGTH(f.MODELO_NORM) >= 4 AND t.DESC_NORM LIKE ('%' || f.MODELO_NORM || '%')",
+    "5": "LENGTH(f.TAG_NORM) >= 4 AND t.DESC_NORM LIKE ('%' || f.TAG_NORM || '%')",
+}
+
+def _desc_attr_from_column(df: pd.DataFrame) -> pd.DataFrame:
+    """(ID, ATTR) a partir de DESC_ATTR; linhas sem a coluna gravada caem no cálculo da DESC_FOR_ATTR."""
+    stored = df["DESC_ATTR"].notna()
+    long = (
+        pd.DataFrame({"ID": df.loc[stored, "ID"].astype("int64").to_numpy(),
+                      "ATTR": df.loc[stored, "DESC_ATTR"].astype(str).str.split().to_numpy()})
+        .explode("ATTR")
+        .dropna(subset=["ATTR"])
+    )
+    if stored.all():
+        return long.drop_duplicates(ignore_index=True)
+    rest = df.loc[~stored]
+    computed = desc_attr_frame(rest["ID"].astype("int64"), rest["DESC_FOR_ATTR"])
+    return pd.concat([long, computed], ignore_index=True).drop_duplicates(ignore_index=True)
+
+
+# Linhas por bloco nas leituras em streaming (read_sql_query com chunksize).
+_READ_CHUNK = 1000
+
+
+def _desc_attr_chunked(sql: str, con, params: list) -> pd.DataFrame:
+    """(ID, ATTR) do resultado de `sql` (colunas ID, DESC_ATTR, DESC_FOR_ATTR), lido em blocos."""
+    parts = [_desc_attr_from_column(ch) for ch in pd.read_sql_query(sql, con, params=params, chunksize=_READ_CHUNK)]
+    return pd.concat(parts, ignore_index=True).drop_duplicates(ignore_index=True)
+
+
+# Físicos por bloco no merge da regra 6 (limita o tamanho do produto por atributo).
+_ATTR_MATCH_BLOCK = 1000
+
+
+def _attr_hits(attrs_f: pd.DataFrame, attrs_c: pd.DataFrame, min_common: int = 2) -> pd.DataFrame:
+    """Pares (FID, CID, SCORE) com pelo menos `min_common` atributos em comum."""
+    c = attrs_c.rename(columns={"ID": "CID"})
+    fids = attrs_f["ID"].unique()
+    out = []
+    for i in range(0, len(fids), _ATTR_MATCH_BLOCK):
+        block = attrs_f[attrs_f["ID"].isin(fids[i:i + _ATTR_MATCH_BLOCK])].rename(columns={"ID": "FID"})
+        score = block.merge(c, on="ATTR").groupby(["FID", "CID"], sort=False).size()
+        score = score[score >= min_common]
+        if not score.empty:
+            out.append(score.rename("SCORE").reset_index())
+    if not out:
+        return pd.DataFrame(columns=["FID", "CID", "SCORE"])
+    return pd.concat(out, ignore_index=True)
+
 
-def _strip_noise_fields(desc: str) -> str:
-    """Remove segmentos do tipo 'MCA: ...', 'MOD: ...', 'SERIE: ...', 'CAP: ...', 'CAPACIDADE: ...', 'TAG: ...'.
-    A ideia é evitar que esses trechos dominem a similaridade.
-    """
-    if not desc:
-        return ""
-    s = str(desc)
-    # normaliza espaços
-    s = s.replace("\n", " ").replace("\r", " ")
-    # remove blocos rotulados (não-guloso até próximo rótulo ou fim)
-    # Ex.: "MCA: LG MOD: 32LW300C SERIE: 123" => remove tudo que está após cada rótulo
-    pattern = r"\b(MCA|MOD|SERIE|CAP|CAPACIDADE|TAG)\s*[:=]\s*.*?(?=\b(MCA|MOD|SERIE|CAP|CAPACIDADE|TAG)\b\s*[:=]|$)"
-    try:
-        s = re.sub(pattern, " ", s, flags=re.IGNORECASE)
-    except Exception:
-        # se regex falhar por algum motivo, segue com o texto original
-        pass
-    return s
-
-def _desc_attr_set(desc: str) -> set:
-    """Extrai um conjunto de 'atributos' da descrição para comparar semelhança.
-    - Remove blocos MCA/MOD/SERIE/CAP/CAPACIDADE/TAG
-    - Usa tokens com len>=3 ou numéricos com len>=2
-    - Usa prefixo de 3 caracteres para tokens alfabéticos (ex.: 'cadeira' -> 'cad')
-    """
-    if not desc:
-        return set()
-    s = _strip_noise_fields(desc).upper()
-    # mantém letras/números como tokens
-    tokens = re.findall(r"[A-Z0-9]+", s)
-    out = set()
-    for tok in tokens:
-        if tok in _STOP_LABELS:
-            continue
-        if tok.isdigit():
-            if len(tok) >= 2:
-                out.add(tok)
-            continue
-        if len(tok) >= 3:
-            out.add(tok[:3])  # atributo por prefixo (>=3)
-    return out
 def _auto02_base_filters(alias: str, *, desc1: str, desc2: str, desc3: str, desc_mode: str,
                          filial: str, ccusto: str, local: str, condic: str) -> Tuple[str, list]:
     where = ""
@@ -325,6 +414,28 @@ def _auto02_base_filters(alias: str, *, desc1: str, desc2: str, desc3: str, desc
     return where, params
 
 
+def _read_rows_by_ids(con: sqlite3.Connection, table: str, ids: Iterable[int]) -> pd.DataFrame:
+    """Linhas completas de `table` para os IDs informados, na ordem da UI.
+
+    Os IDs vão para uma tabela TEMP e o SELECT é sempre o mesmo texto (JOIN),
+    aproveitando o cache de statements e sem limite de variáveis do IN.
+    """
+    own_tx = not getattr(con, "in_transaction", False)
+    cur = con.cursor()
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS _sel_ids(id INTEGER PRIMARY KEY);")
+    cur.execute("DELETE FROM _sel_ids;")
+    cur.executemany("INSERT INTO _sel_ids VALUES (?);", [(int(x),) for x in dict.fromkeys(ids)])
+    try:
+        return pd.read_sql_query(
+            f"SELECT t.* FROM {table} t JOIN _sel_ids s ON s.id = t.ID ORDER BY COALESCE(t.DESCRICAO,''), t.ID;",
+            con,
+        )
+    finally:
+        cur.execute("DELETE FROM _sel_ids;")
+        if own_tx:
+            con.commit()
+
+
 def load_candidates_auto02(
     con: sqlite3.Connection,
     rule_id: str,
@@ -361,8 +472,8 @@ def load_candidates_auto02(
                                        filial=filial, ccusto=ccusto, local=local, condic="")
 
     # pendentes
-    pend_fis = "NOT EXISTS (SELECT 1 FROM conciliados c WHERE c.BASE='FIS' AND c.ID=f.ID)"
-    pend_ctb = "NOT EXISTS (SELECT 1 FROM conciliados c WHERE c.BASE='CTB' AND c.ID=t.ID)"
+    pend_fis = _pending_cond(con, "FIS", "f")
+    pend_ctb = _pending_cond(con, "CTB", "t")
 
     # data CTB (ano)
     if (data_ctb_ano or "").strip():
@@ -375,111 +486,258 @@ def load_candidates_auto02(
     
     # Regra 6: similaridade por descrição (>=2 atributos)
     if rid == "6":
-        # carrega pendentes (com filtros) e identifica participantes via índice invertido por atributos
-        qf = f"""SELECT * FROM fisico f
+        # carrega só ID + descrição dos pendentes (com filtros); linhas completas apenas dos participantes
+        # DESC_ATTR vem gravado da importação; a descrição só é lida onde ele falta
+        # (banco anterior à v3 ainda sem init_db: a coluna não existe e tudo cai no cálculo)
+        attr_f = "f.DESC_ATTR" if any(c.upper() == "DESC_ATTR" for c in _list_columns(con, "fisico")) else "NULL"
+        attr_c = "t.DESC_ATTR" if any(c.upper() == "DESC_ATTR" for c in _list_columns(con, "contabil")) else "NULL"
+        qf = f"""SELECT f.ID, {attr_f} AS DESC_ATTR,
+                         CASE WHEN {attr_f} IS NULL THEN COALESCE(NULLIF(f.DESCRICAO,''), f.DESC_NORM, '') END AS DESC_FOR_ATTR
+                  FROM fisico f
                   WHERE f.ID IS NOT NULL AND {pend_fis} {w_fis}
                   ORDER BY COALESCE(f.DESCRICAO,''), f.ID LIMIT ?;"""
-        qc = f"""SELECT * FROM contabil t
+        qc = f"""SELECT t.ID, {attr_c} AS DESC_ATTR,
+                         CASE WHEN {attr_c} IS NULL THEN COALESCE(NULLIF(t.DESCRICAO,''), t.DESC_NORM, '') END AS DESC_FOR_ATTR
+                  FROM contabil t
                   WHERE t.ID IS NOT NULL AND {pend_ctb} AND COALESCE(t.INC,0)=0 {w_ctb}
                   ORDER BY COALESCE(t.DESCRICAO,''), t.ID LIMIT ?;"""
-        df_f = pd.read_sql_query(qf, con, params=p_fis + [int(limit_each)])
-        df_c = pd.read_sql_query(qc, con, params=p_ctb + [int(limit_each)])
-
-        if df_f.empty or df_c.empty:
+        # atributos em formato longo, montados por bloco de leitura (sem o DataFrame inteiro)
+        attrs_f = _desc_attr_chunked(qf, con, p_fis + [int(limit_each)])
+        attrs_c = _desc_attr_chunked(qc, con, p_ctb + [int(limit_each)])
+        if attrs_f.empty or attrs_c.empty:
             return pd.DataFrame(), pd.DataFrame()
 
-        # índice invertido: atributo -> lista de IDs contábeis
-        inv: Dict[str, List[int]] = {}
-        c_attrs: Dict[int, set] = {}
-        for _, row in df_c.iterrows():
-            cid = int(row.get("ID"))
-            attrs = _desc_attr_set(row.get("DESCRICAO") or row.get("DESC") or row.get("DESC_NORM") or row.get("DESC_ORIG") or "")
-            c_attrs[cid] = attrs
-            for a in attrs:
-                inv.setdefault(a, []).append(cid)
-
-        fis_keep = set()
-        ctb_keep = set()
-        # varre físicos e marca contábeis com pelo menos 2 atributos em comum
-        for _, row in df_f.iterrows():
-            fid = int(row.get("ID"))
-            fattrs = _desc_attr_set(row.get("DESCRICAO") or row.get("DESC") or row.get("DESC_NORM") or row.get("DESC_ORIG") or "")
-            if not fattrs:
-                continue
-            counts: Dict[int, int] = {}
-            for a in fattrs:
-                for cid in inv.get(a, []):
-                    counts[cid] = counts.get(cid, 0) + 1
-            # participantes
-            hits = [cid for cid, ct in counts.items() if ct >= 2]
-            if hits:
-                fis_keep.add(fid)
-                ctb_keep.update(hits)
-
-        if not fis_keep or not ctb_keep:
+        # merge por atributo: contábeis com pelo menos 2 atributos em comum
+        hits = _attr_hits(attrs_f, attrs_c)
+        if hits.empty:
             return pd.DataFrame(), pd.DataFrame()
 
-        df_f = df_f[df_f["ID"].isin(sorted(fis_keep))].reset_index(drop=True)
-        df_c = df_c[df_c["ID"].isin(sorted(ctb_keep))].reset_index(drop=True)
+        # a ordem da UI vem do ORDER BY da leitura; os IDs vão sem ordenar
+        df_f = _read_rows_by_ids(con, "fisico", hits["FID"].unique())
+        df_c = _read_rows_by_ids(con, "contabil", hits["CID"].unique())
         return df_f, df_c
 
-# Cada regra monta um JOIN e retorna DISTINCT IDs participantes
-    if rid == "1":
-        # série física (>=4) contida na descrição contábil
-        join_cond = "LENGTH(f.SERIE_NORM) >= 4 AND t.DESC_NORM LIKE ('%' || f.SERIE_NORM || '%')"
-    elif rid == "2":
-        # série contábil (>=4) contida na descrição física
-        join_cond = "LENGTH(t.SERIE_NORM) >= 4 AND f.DESC_NORM LIKE ('%' || t.SERIE_NORM || '%')"
-    elif rid == "3":
-        join_cond = "t.MODELO_NORM <> '' AND f.MODELO_NORM = t.MODELO_NORM"
-    elif rid == "4":
-        join_cond = "LENGTH(f.MODELO_NORM) >= 4 AND t.DESC_NORM LIKE ('%' || f.MODELO_NORM || '%')"
-    else:  # rid == "5"
-        join_cond = "LENGTH(f.TAG_NORM) >= 4 AND t.DESC_NORM LIKE ('%' || f.TAG_NORM || '%')"
-
-    # Base de join: só pendentes + filtros + condição
-    base_sql = f"""
-    fisico f
-    JOIN contabil t ON ({join_cond})
-    WHERE f.ID IS NOT NULL AND t.ID IS NOT NULL
-      AND {pend_fis}
-      AND {pend_ctb}
-      AND COALESCE(t.INC,0) = 0
-      {w_fis}
-      {w_ctb}
+    # Regras 1–5: pendentes filtrados de cada lado (CTE) + JOIN pela condição da regra,
+    # devolvendo os IDs participantes dos dois lados numa única consulta.
+    join_cond = _AUTO02_JOIN_COND[rid]
+    q_ids = f"""
+    WITH pend_f AS (
+        SELECT f.ID, f.DESCRICAO, f.DESC_NORM, f.SERIE_NORM, f.MODELO_NORM, f.TAG_NORM
+        FROM fisico f
+        WHERE f.ID IS NOT NULL AND {pend_fis} {w_fis}
+    ),
+    pend_c AS (
+        SELECT t.ID, t.DESCRICAO, t.DESC_NORM, t.SERIE_NORM, t.MODELO_NORM
+        FROM contabil t
+        WHERE t.ID IS NOT NULL AND {pend_ctb} AND COALESCE(t.INC,0) = 0 {w_ctb}
+    ),
+    m AS (
+        SELECT f.ID AS FID, COALESCE(f.DESCRICAO,'') AS FD, t.ID AS CID, COALESCE(t.DESCRICAO,'') AS CD
+        FROM pend_f f
+        JOIN pend_c t ON ({join_cond})
+    )
+    SELECT BASE, ID FROM (
+        SELECT DISTINCT 'FIS' AS BASE, FID AS ID, FD AS D FROM m ORDER BY D, ID LIMIT ?
+    ) AS sf
+    UNION ALL
+    SELECT BASE, ID FROM (
+        SELECT DISTINCT 'CTB' AS BASE, CID AS ID, CD AS D FROM m ORDER BY D, ID LIMIT ?
+    ) AS sc;
     """
-
-    # IDs físicos
-    q_f = f"SELECT DISTINCT f.ID FROM {base_sql} ORDER BY COALESCE(f.DESCRICAO,''), f.ID LIMIT ?;"
-    params_f = ["dummy"]  # placeholder, we'll not use; easier to reuse p lists below
-
-    # Para garantir ordem e params corretos, montamos params em ordem de uso:
-    # pendências não usam params. w_fis params primeiro (p_fis), depois w_ctb params (p_ctb).
-    params_join = p_fis + p_ctb
-
-    ids_f = pd.read_sql_query(q_f, con, params=params_join + [int(limit_each)])
+    ids = pd.read_sql_query(q_ids, con, params=p_fis + p_ctb + [int(limit_each), int(limit_each)])
+    ids_f = ids.loc[ids["BASE"] == "FIS", ["ID"]]
+    ids_c = ids.loc[ids["BASE"] == "CTB", ["ID"]]
     if ids_f.empty:
         return pd.DataFrame(), pd.DataFrame()
 
-    # IDs contábeis
-    q_c = f"SELECT DISTINCT t.ID FROM {base_sql} ORDER BY COALESCE(t.DESCRICAO,''), t.ID LIMIT ?;"
-    ids_c = pd.read_sql_query(q_c, con, params=params_join + [int(limit_each)])
-
     # Carrega linhas completas (para mostrar na UI)
-    df_f = pd.read_sql_query(
-        f"SELECT * FROM fisico WHERE ID IN ({','.join(['?']*len(ids_f))}) ORDER BY COALESCE(DESCRICAO,''), ID LIMIT ?;",
-        con,
-        params=[int(x) for x in ids_f["ID"].tolist()] + [int(limit_each)],
-    )
-    df_c = pd.read_sql_query(
-        f"SELECT * FROM contabil WHERE ID IN ({','.join(['?']*len(ids_c))}) ORDER BY COALESCE(DESCRICAO,''), ID LIMIT ?;",
-        con,
-        params=[int(x) for x in ids_c["ID"].tolist()] + [int(limit_each)],
-    )
+    df_f = _read_rows_by_ids(con, "fisico", ids_f["ID"].tolist())
+    df_c = _read_rows_by_ids(con, "contabil", ids_c["ID"].tolist())
     return df_f, df_c
 
 
 
+# Linhas por executemany nas gravações em lote (mesma transação).
+_INSERT_CHUNK = 500
+
+
+def _executemany_chunked(cur, sql: str, rows: list) -> None:
+    for i in range(0, len(rows), _INSERT_CHUNK):
+        cur.executemany(sql, rows[i:i + _INSERT_CHUNK])
+
+
+def _begin_write(con, cur) -> None:
+    """Abre a transação de escrita; no SQLite já reserva o lock (sem upgrade no meio do save)."""
+    cur.execute("BEGIN IMMEDIATE;" if isinstance(con, sqlite3.Connection) else "BEGIN;")
+
+
+# Acima disso um save dispara checkpoint PASSIVE em segundo plano.
+_CHECKPOINT_AFTER = 500
+
+
+def _checkpoint_passive_async(con) -> None:
+    """PRAGMA wal_checkpoint(PASSIVE) numa thread com conexão própria (não segura o COMMIT)."""
+    if not isinstance(con, sqlite3.Connection):
+        return
+    try:
+        rows = con.execute("PRAGMA database_list;").fetchall()
+        db_file = next((r[2] for r in rows if r[1] == "main"), "")
+    except Exception:
+        return
+    if not db_file:
+        return
+
+    def _run() -> None:
+        try:
+            c = sqlite3.connect(db_file, timeout=1.0)
+            try:
+                c.execute("PRAGMA wal_checkpoint(PASSIVE);")
+            finally:
+                c.close()
+        except Exception:
+            pass
+
+    threading.Thread(target=_run, name="evs-wal-checkpoint", daemon=True).start()
+
+
+# SQL fixo dos loops de gravação (mesmo texto sempre => reaproveita o statement cache do sqlite3).
+_SQL_MAX_PAR_ID = "SELECT COALESCE(MAX(PAR_ID),0) FROM depara;"
+# depara.PAR_ID é AUTOINCREMENT no SQLite: o maior PAR_ID já usado fica em sqlite_sequence
+# (uma linha por tabela), sem descer no índice de depara.
+_SQL_SEQ_PAR_ID = "SELECT seq FROM sqlite_sequence WHERE name='depara';"
+_SQL_INSERT_DEPARA = "INSERT INTO depara (PAR_ID, ST_CONCILIACAO, ID_FISICO, ID_CONTABIL, NRBRM, INC_CONTABIL) VALUES (?,?,?,?,?,?);"
+_SQL_INSERT_CONC = "INSERT OR IGNORE INTO conciliados (BASE, ID, PAR_ID) VALUES (?,?,?);"
+# PAR_IDs a desfazer para os pares em _undo_pairs:
+#  - par completo => o par exato; FIS sozinho => tudo do FIS; CTB sozinho => tudo do CTB
+#  - regra de família: CTB PAI (NRBRM>0, INC=0) leva junto os PAR_IDs do NRBRM
+#    (com par completo, só os do mesmo ID_FISICO âncora)
+# FAM=1 marca os PAR_IDs que vieram da família contábil (NRBRM do pai), cujos IDs não estão nos pares.
+_SQL_UNDO_PAR_IDS = """
+SELECT d.PAR_ID, 0 AS FAM FROM _undo_pairs n JOIN depara d ON d.ID_FISICO = n.fid AND d.ID_CONTABIL = n.cid
+ WHERE n.fid > 0 AND n.cid > 0
+UNION
+SELECT d.PAR_ID, 0 FROM _undo_pairs n JOIN depara d ON d.ID_FISICO = n.fid
+ WHERE n.fid > 0 AND n.cid <= 0
+UNION
+SELECT d.PAR_ID, 0 FROM _undo_pairs n JOIN depara d ON d.ID_CONTABIL = n.cid
+ WHERE n.fid <= 0 AND n.cid > 0
+UNION
+SELECT d.PAR_ID, 1 FROM _undo_pairs n
+  JOIN contabil c ON c.ID = n.cid AND COALESCE(c.NRBRM,0) > 0 AND COALESCE(c.INC,0) = 0
+  JOIN depara d ON d.NRBRM = c.NRBRM AND (n.fid <= 0 OR d.ID_FISICO = n.fid)
+ WHERE n.cid > 0;
+"""
+
+def _next_par_id(con, cur) -> int:
+    """Próximo PAR_ID livre (chamar já dentro da transação de escrita)."""
+    if isinstance(con, sqlite3.Connection):
+        try:
+            row = cur.execute(_SQL_SEQ_PAR_ID).fetchone()
+            if row is not None:
+                return int(row[0] or 0) + 1
+        except sqlite3.OperationalError:
+            pass  # banco sem AUTOINCREMENT (sem sqlite_sequence)
+    row = cur.execute(_SQL_MAX_PAR_ID).fetchone()
+    return int(row[0] or 0) + 1
+
+
+def _fetch_in(cur, sql_tpl: str, ids, params_before: tuple = ()) -> list:
+    """Executa `sql_tpl` (com '{ph}' no lugar da lista do IN) para todos os `ids`.
+
+    No SQLite a lista vai como um único parâmetro JSON (json_each), então o texto do
+    SQL é sempre o mesmo e o statement fica no cache. Nos demais backends usa lotes
+    de _IN_CHUNK placeholders.
+    """
+    ids = list(ids)
+    if not ids:
+        return []
+    if isinstance(cur, sqlite3.Cursor):
+        sql = sql_tpl.format(ph="SELECT value FROM json_each(?)")
+        payload = json.dumps([x if isinstance(x, str) else int(x) for x in ids])
+        return cur.execute(sql, (*params_before, payload)).fetchall()
+    rows: list = []
+    for i in range(0, len(ids), _IN_CHUNK):
+        chunk = ids[i:i + _IN_CHUNK]
+        ph = ",".join(["?"] * len(chunk))
+        rows.extend(cur.execute(sql_tpl.format(ph=ph), (*params_before, *chunk)).fetchall())
+    return rows
+
+
+def _exec_in(cur, sql_tpl: str, ids) -> int:
+    """DELETE/UPDATE com '{ph}' no lugar da lista do IN (mesma estratégia do _fetch_in); devolve linhas afetadas."""
+    ids = list(ids)
+    if not ids:
+        return 0
+    if isinstance(cur, sqlite3.Cursor):
+        payload = json.dumps([x if isinstance(x, str) else int(x) for x in ids])
+        cur.execute(sql_tpl.format(ph="SELECT value FROM json_each(?)"), (payload,))
+        return max(int(cur.rowcount or 0), 0)
+    total = 0
+    for i in range(0, len(ids), _IN_CHUNK):
+        chunk = ids[i:i + _IN_CHUNK]
+        cur.execute(sql_tpl.format(ph=",".join(["?"] * len(chunk))), tuple(chunk))
+        total += max(int(cur.rowcount or 0), 0)
+    return total
+
+
+_SQL_DELETE_CONC_JSON = """
+DELETE FROM conciliados
+ WHERE PAR_ID IN (SELECT value FROM json_each(?))
+    OR (BASE='FIS' AND ID IN (SELECT value FROM json_each(?)))
+    OR (BASE='CTB' AND ID IN (SELECT value FROM json_each(?)));
+"""
+
+
+def _delete_conciliados(cur, par_ids: List[int], fis_ids: List[int], ctb_ids: List[int]) -> int:
+    """Remove de 'conciliados' por PAR_ID e por IDs FIS/CTB; devolve o total de linhas removidas."""
+    fis_txt = [str(x) for x in fis_ids]
+    ctb_txt = [str(x) for x in ctb_ids]
+    if isinstance(cur, sqlite3.Cursor):
+        # um DELETE só: cada linha é contada uma vez, como na soma dos três DELETEs em sequência
+        cur.execute(_SQL_DELETE_CONC_JSON, (
+            json.dumps([int(x) for x in par_ids]), json.dumps(fis_txt), json.dumps(ctb_txt),
+        ))
+        return max(int(cur.rowcount or 0), 0)
+    removed = _exec_in(cur, "DELETE FROM conciliados WHERE PAR_ID IN ({ph});", par_ids)
+    removed += _exec_in(cur, "DELETE FROM conciliados WHERE BASE='FIS' AND ID IN ({ph});", fis_txt)
+    removed += _exec_in(cur, "DELETE FROM conciliados WHERE BASE='CTB' AND ID IN ({ph});", ctb_txt)
+    return removed
+
+
+def _conciliados_ids(cur, base: str, ids) -> set[int]:
+    """IDs de `ids` que já estão em 'conciliados' para a base."""
+    # conciliados.ID é TEXT no SQLite: compara como texto
+    rows = _fetch_in(cur, "SELECT ID FROM conciliados WHERE BASE=? AND ID IN ({ph});", [str(int(x)) for x in ids], (base,))
+    return {int(v) for (v,) in rows}
+
+
+def _ctb_meta(cur, ids) -> Dict[int, Tuple[int, int]]:
+    """ID contábil -> (NRBRM, INC), numa passada só."""
+    rows = _fetch_in(cur, "SELECT ID, COALESCE(NRBRM,0), COALESCE(INC,0) FROM contabil WHERE ID IN ({ph});", ids)
+    return {int(i): (int(n or 0), int(inc or 0)) for i, n, inc in rows}
+
+
+def _fis_nrbrm(cur, ids) -> Dict[int, int]:
+    """ID físico -> NRBRM, numa passada só."""
+    rows = _fetch_in(cur, "SELECT ID, COALESCE(NRBRM,0) FROM fisico WHERE ID IN ({ph});", ids)
+    return {int(i): int(n or 0) for i, n in rows}
+
+
+def _ctb_families(cur, nrbrms) -> Dict[int, List[Tuple[int, int]]]:
+    """NRBRM (> 0) -> [(ID, INC), ...] de todos os contábeis (pai + filhos), ordenado por INC, ID."""
+    rows = _fetch_in(
+        cur,
+        # NRBRM puro no IN (só chegam NRBRM > 0): a busca sai do idx_ctb_nrbrm_inc
+        "SELECT NRBRM, ID, COALESCE(INC,0) FROM contabil WHERE NRBRM IN ({ph}) "
+        "ORDER BY NRBRM, COALESCE(INC,0), ID;",
+        nrbrms,
+    )
+    fams: Dict[int, List[Tuple[int, int]]] = {}
+    for n, i, inc in rows:
+        fams.setdefault(int(n), []).append((int(i), int(inc or 0)))
+    return fams
+
+
 def save_pairs(con: sqlite3.Connection, pairs: List[Tuple[int, int]], st_conciliacao: str = "MANUAL") -> int:
     """
     Grava vários pares em uma transação.
@@ -500,11 +758,10 @@ def save_pairs(con: sqlite3.Connection, pairs: List[Tuple[int, int]], st_concili
     saved = 0
 
     try:
-        cur.execute("BEGIN;")
+        _begin_write(con, cur)
 
         # próximo PAR_ID
-        row = cur.execute("SELECT COALESCE(MAX(PAR_ID),0) FROM depara;").fetchone()
-        next_par_id = int(row[0] or 0) + 1
+        next_par_id = _next_par_id(con, cur)
 
         depara_rows: List[Tuple[int, str, int, int, int, Optional[int]]] = []
         conc_rows: List[Tuple[str, int, int]] = []
@@ -513,6 +770,14 @@ def save_pairs(con: sqlite3.Connection, pairs: List[Tuple[int, int]], st_concili
         pending_ctb_ids: set[int] = set()
         pending_fis_ids: set[int] = set()
 
+        # bloqueio + metadados (NRBRM/INC): resolvidos em lote antes do loop
+        all_fis = {int(f or 0) for f, _ in pairs if int(f or 0) > 0}
+        all_ctb = {int(c or 0) for _, c in pairs if int(c or 0) > 0}
+        blocked_fis = _conciliados_ids(cur, "FIS", all_fis)
+        blocked_ctb = _conciliados_ids(cur, "CTB", all_ctb)
+        ctb_meta = _ctb_meta(cur, all_ctb - blocked_ctb)
+        fis_nrbrm = _fis_nrbrm(cur, {int(f or 0) for f, c in pairs if int(f or 0) > 0 and int(c or 0) <= 0} - blocked_fis)
+
         for fis_id_in, ctb_id_in in pairs:
             fis_id = int(fis_id_in or 0)
             ctb_id = int(ctb_id_in or 0)
@@ -522,63 +787,28 @@ def save_pairs(con: sqlite3.Connection, pairs: List[Tuple[int, int]], st_concili
                 continue
 
             # bloqueio: não repetir conciliados
-            if fis_id > 0:
-                r = cur.execute(
-                    "SELECT 1 FROM conciliados WHERE BASE='FIS' AND ID=? LIMIT 1;",
-                    (fis_id,),
-                ).fetchone()
-                if r:
-                    continue
-
-            if ctb_id > 0:
-                r = cur.execute(
-                    "SELECT 1 FROM conciliados WHERE BASE='CTB' AND ID=? LIMIT 1;",
-                    (ctb_id,),
-                ).fetchone()
-                if r:
-                    continue
+            if fis_id > 0 and fis_id in blocked_fis:
+                continue
+            if ctb_id > 0 and ctb_id in blocked_ctb:
+                continue
 
             # busca NRBRM/INC do CTB quando existir; senão pega NRBRM do FIS
             nrbrm = 0
             inc_ctb: Optional[int] = None
 
             if ctb_id > 0:
-                rowc = cur.execute(
-                    "SELECT COALESCE(NRBRM,0), COALESCE(INC,0) FROM contabil WHERE ID=?;",
-                    (ctb_id,),
-                ).fetchone()
-                if not rowc:
+                meta = ctb_meta.get(ctb_id)
+                if meta is None:
                     # CTB não existe mais / inválido
                     continue
-                nrbrm = int(rowc[0] or 0)
-                inc_ctb = int(rowc[1] or 0)
+                nrbrm, inc_ctb = meta
 
             elif fis_id > 0:
-                rowf = cur.execute(
-                    "SELECT COALESCE(NRBRM,0) FROM fisico WHERE ID=?;",
-                    (fis_id,),
-                ).fetchone()
-                if not rowf:
+                if fis_id not in fis_nrbrm:
                     continue
-                nrbrm = int(rowf[0] or 0)
+                nrbrm = fis_nrbrm[fis_id]
                 inc_ctb = None  # sem contábil
 
-            # bloqueia duplicação: se qualquer lado já estiver conciliado, ignora a linha
-            if fis_id > 0:
-                exists = cur.execute(
-                    "SELECT 1 FROM conciliados WHERE BASE='FIS' AND ID=? LIMIT 1;",
-                    (fis_id,),
-                ).fetchone()
-                if exists:
-                    continue
-            if ctb_id > 0:
-                exists = cur.execute(
-                    "SELECT 1 FROM conciliados WHERE BASE='CTB' AND ID=? LIMIT 1;",
-                    (ctb_id,),
-                ).fetchone()
-                if exists:
-                    continue
-
             # grava depara (IDs sempre inteiros; 0 quando ausente)
             depara_rows.append((next_par_id, st_conciliacao, fis_id, ctb_id, nrbrm, inc_ctb))
 
@@ -593,19 +823,14 @@ def save_pairs(con: sqlite3.Connection, pairs: List[Tuple[int, int]], st_concili
             saved += 1
             next_par_id += 1
 
-        if depara_rows:
-            cur.executemany(
-                "INSERT INTO depara (PAR_ID, ST_CONCILIACAO, ID_FISICO, ID_CONTABIL, NRBRM, INC_CONTABIL) VALUES (?,?,?,?,?,?);",
-                depara_rows,
-            )
-
-        if conc_rows:
-            cur.executemany(
-                "INSERT OR IGNORE INTO conciliados (BASE, ID, PAR_ID) VALUES (?,?,?);",
-                conc_rows,
-            )
+        _executemany_chunked(cur, _SQL_INSERT_DEPARA, depara_rows)
+        # ordenado por (BASE, ID): inserção sequencial no índice de conciliados
+        conc_rows.sort(key=lambda r: (r[0], r[1]))
+        _executemany_chunked(cur, _SQL_INSERT_CONC, conc_rows)
 
         cur.execute("COMMIT;")
+        if saved > _CHECKPOINT_AFTER:
+            _checkpoint_passive_async(con)
         return saved
 
     except Exception:
@@ -645,126 +870,118 @@ def save_pairs_with_family(con: sqlite3.Connection, pairs: List[Tuple[int, int]]
         return 0
 
     cur = con.cursor()
+    try:
+        _begin_write(con, cur)
+        saved = _save_family_rows(con, cur, pairs, st_conciliacao)
+        cur.execute("COMMIT;")
+    except Exception:
+        cur.execute("ROLLBACK;")
+        raise
+    if saved > _CHECKPOINT_AFTER:
+        _checkpoint_passive_async(con)
+    return saved
+
+
+def _save_family_rows(con, cur, pairs: List[Tuple[int, int]], st_conciliacao: str) -> int:
+    """Corpo do save_pairs_with_family, dentro de uma transação já aberta pelo chamador."""
     pending_ctb_ids: set[int] = set()  # valida/propaga filhos sem duplicar CTB no mesmo save
     pending_fis_ids: set[int] = set()  # mantém consistência do lado físico no mesmo save
     saved = 0
     child_status = _child_status_for_origin(st_conciliacao)
 
-    try:
-        cur.execute("BEGIN;")
-
-        row = cur.execute("SELECT COALESCE(MAX(PAR_ID),0) FROM depara;").fetchone()
-        next_par_id = int(row[0] or 0) + 1
-
-        depara_rows: List[Tuple[int, str, int, int, int, Optional[int]]] = []
-        conc_rows: List[Tuple[str, int, int]] = []
-
-        # Guardar NRBRM envolvidos com o fis_id "âncora" (pode ser 0)
-        involved: List[Tuple[int, int]] = []  # (nrbrm, fis_id_anchor)
+    next_par_id = _next_par_id(con, cur)
 
-        for fis_id_in, ctb_id_in in pairs:
-            fis_id = int(fis_id_in or 0)
-            ctb_id = int(ctb_id_in or 0)
+    depara_rows: List[Tuple[int, str, int, int, int, Optional[int]]] = []
+    conc_rows: List[Tuple[str, int, int]] = []
 
-            if fis_id <= 0 and ctb_id <= 0:
-                continue
+    # Guardar NRBRM envolvidos com o fis_id "âncora" (pode ser 0)
+    involved: List[Tuple[int, int]] = []  # (nrbrm, fis_id_anchor)
 
-            # não repetir conciliados (bloqueio)
-            if fis_id > 0:
-                if cur.execute("SELECT 1 FROM conciliados WHERE BASE='FIS' AND ID=? LIMIT 1;", (fis_id,)).fetchone():
-                    continue
-            if ctb_id > 0:
-                if (ctb_id in pending_ctb_ids) or cur.execute("SELECT 1 FROM conciliados WHERE BASE='CTB' AND ID=? LIMIT 1;", (ctb_id,)).fetchone():
-                    continue
+    # bloqueio + metadados (NRBRM/INC): resolvidos em lote antes do loop
+    all_fis = {int(f or 0) for f, _ in pairs if int(f or 0) > 0}
+    all_ctb = {int(c or 0) for _, c in pairs if int(c or 0) > 0}
+    blocked_fis = _conciliados_ids(cur, "FIS", all_fis)
+    blocked_ctb = _conciliados_ids(cur, "CTB", all_ctb)
+    ctb_meta = _ctb_meta(cur, all_ctb - blocked_ctb)
+    fis_nrbrm = _fis_nrbrm(cur, {int(f or 0) for f, c in pairs if int(f or 0) > 0 and int(c or 0) <= 0} - blocked_fis)
 
-            nrbrm = 0
-            inc_ctb: Optional[int] = None
+    for fis_id_in, ctb_id_in in pairs:
+        fis_id = int(fis_id_in or 0)
+        ctb_id = int(ctb_id_in or 0)
 
-            if ctb_id > 0:
-                rowc = cur.execute(
-                    "SELECT COALESCE(NRBRM,0), COALESCE(INC,0) FROM contabil WHERE ID=?;",
-                    (ctb_id,),
-                ).fetchone()
-                if not rowc:
-                    continue
-                nrbrm = int(rowc[0] or 0)
-                inc_ctb = int(rowc[1] or 0)
-                involved.append((nrbrm, fis_id))
-            elif fis_id > 0:
-                rowf = cur.execute(
-                    "SELECT COALESCE(NRBRM,0) FROM fisico WHERE ID=?;",
-                    (fis_id,),
-                ).fetchone()
-                if not rowf:
-                    continue
-                nrbrm = int(rowf[0] or 0)
-                inc_ctb = None
-
-            # Se o CTB informado já for filho (INC!=0), grava com status de filho.
-            st_for_row = st_conciliacao
-            if ctb_id > 0 and int(inc_ctb or 0) != 0:
-                st_for_row = child_status
+        if fis_id <= 0 and ctb_id <= 0:
+            continue
 
-            depara_rows.append((next_par_id, st_for_row, fis_id, ctb_id, nrbrm, inc_ctb))
-            if fis_id > 0:
-                conc_rows.append(("FIS", fis_id, next_par_id))
-                pending_fis_ids.add(fis_id)
-            if ctb_id > 0:
-                conc_rows.append(("CTB", ctb_id, next_par_id))
-                pending_ctb_ids.add(ctb_id)
+        # não repetir conciliados (bloqueio)
+        if fis_id > 0 and fis_id in blocked_fis:
+            continue
+        if ctb_id > 0 and (ctb_id in pending_ctb_ids or ctb_id in blocked_ctb):
+            continue
 
-            saved += 1
-            next_par_id += 1
+        nrbrm = 0
+        inc_ctb: Optional[int] = None
 
-        # Propagação: para cada NRBRM envolvido via CTB, garantir pai + filhos.
-        for nrbrm, fis_anchor in involved:
-            if int(nrbrm or 0) <= 0:
+        if ctb_id > 0:
+            meta = ctb_meta.get(ctb_id)
+            if meta is None:
                 continue
+            nrbrm, inc_ctb = meta
+            involved.append((nrbrm, fis_id))
+        elif fis_id > 0:
+            if fis_id not in fis_nrbrm:
+                continue
+            nrbrm = fis_nrbrm[fis_id]
+            inc_ctb = None
+
+        # Se o CTB informado já for filho (INC!=0), grava com status de filho.
+        st_for_row = st_conciliacao
+        if ctb_id > 0 and int(inc_ctb or 0) != 0:
+            st_for_row = child_status
+
+        depara_rows.append((next_par_id, st_for_row, fis_id, ctb_id, nrbrm, inc_ctb))
+        if fis_id > 0:
+            conc_rows.append(("FIS", fis_id, next_par_id))
+            pending_fis_ids.add(fis_id)
+        if ctb_id > 0:
+            conc_rows.append(("CTB", ctb_id, next_par_id))
+            pending_ctb_ids.add(ctb_id)
+
+        saved += 1
+        next_par_id += 1
+
+    # Propagação: para cada NRBRM envolvido via CTB, garantir pai + filhos.
+    # Todos os CTB de cada NRBRM (inclui pai e filhos), numa consulta só.
+    families = _ctb_families(cur, {n for n, _ in involved if n > 0})
+    blocked_ctb |= _conciliados_ids(
+        cur, "CTB", {cid for fam in families.values() for cid, _ in fam} - blocked_ctb
+    )
 
-            # Todos os CTB desse NRBRM (inclui pai e filhos)
-            fam = cur.execute(
-                "SELECT ID, COALESCE(INC,0) FROM contabil WHERE COALESCE(NRBRM,0)=? ORDER BY COALESCE(INC,0), ID;",
-                (int(nrbrm),),
-            ).fetchall()
-
-            for ctb_id, inc_val in fam:
-                ctb_id = int(ctb_id)
-                inc_val = int(inc_val or 0)
-
-                # já conciliado? pula
-                if (ctb_id in pending_ctb_ids) or cur.execute("SELECT 1 FROM conciliados WHERE BASE='CTB' AND ID=? LIMIT 1;", (ctb_id,)).fetchone():
-                    continue
-
-                st_for_row = child_status if inc_val != 0 else st_conciliacao
-
-                depara_rows.append((next_par_id, st_for_row, int(fis_anchor or 0), ctb_id, int(nrbrm), inc_val))
-                # FIS: mesmo anchor; OR IGNORE evita duplicar
-                if int(fis_anchor or 0) > 0:
-                    conc_rows.append(("FIS", int(fis_anchor), next_par_id))
-                    pending_fis_ids.add(int(fis_anchor))
-                conc_rows.append(("CTB", ctb_id, next_par_id))
-                pending_ctb_ids.add(ctb_id)
+    for nrbrm, fis_anchor in involved:
+        if nrbrm <= 0:
+            continue
+        for ctb_id, inc_val in families.get(nrbrm, []):
+            # já conciliado? pula
+            if ctb_id in pending_ctb_ids or ctb_id in blocked_ctb:
+                continue
 
-                saved += 1
-                next_par_id += 1
+            st_for_row = child_status if inc_val != 0 else st_conciliacao
 
-        if depara_rows:
-            cur.executemany(
-                "INSERT INTO depara (PAR_ID, ST_CONCILIACAO, ID_FISICO, ID_CONTABIL, NRBRM, INC_CONTABIL) VALUES (?,?,?,?,?,?);",
-                depara_rows,
-            )
-        if conc_rows:
-            cur.executemany(
-                "INSERT OR IGNORE INTO conciliados (BASE, ID, PAR_ID) VALUES (?,?,?);",
-                conc_rows,
-            )
+            depara_rows.append((next_par_id, st_for_row, int(fis_anchor or 0), ctb_id, int(nrbrm), inc_val))
+            # FIS: mesmo anchor; OR IGNORE evita duplicar
+            if int(fis_anchor or 0) > 0:
+                conc_rows.append(("FIS", int(fis_anchor), next_par_id))
+                pending_fis_ids.add(int(fis_anchor))
+            conc_rows.append(("CTB", ctb_id, next_par_id))
+            pending_ctb_ids.add(ctb_id)
 
-        cur.execute("COMMIT;")
-        return saved
+            saved += 1
+            next_par_id += 1
 
-    except Exception:
-        cur.execute("ROLLBACK;")
-        raise
+    _executemany_chunked(cur, _SQL_INSERT_DEPARA, depara_rows)
+    # ordenado por (BASE, ID): inserção sequencial no índice de conciliados
+    conc_rows.sort(key=lambda r: (r[0], r[1]))
+    _executemany_chunked(cur, _SQL_INSERT_CONC, conc_rows)
+    return saved
 
 
 def save_manual_pairs(con: sqlite3.Connection, pairs: List[Tuple[int, int]]) -> int:
@@ -825,77 +1042,38 @@ def undo_pairs(con: sqlite3.Connection, pairs: List[Tuple[int, int]]) -> Dict[st
 
     cur = con.cursor()
     try:
-        cur.execute("BEGIN;")
+        _begin_write(con, cur)
 
         # Descobre PAR_IDs a remover
         par_ids: set[int] = set()
-        fis_ids: set[int] = set()
-        ctb_ids: set[int] = set()
+        fis_ids: set[int] = {f for f, _ in norm_pairs if f > 0}
+        ctb_ids: set[int] = {c for _, c in norm_pairs if c > 0}
+
+        # Pares vão para uma tabela TEMP e os PAR_IDs saem de uma consulta só (joins indexados em depara).
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS _undo_pairs(fid INTEGER, cid INTEGER);")
+        cur.execute("DELETE FROM _undo_pairs;")
+        cur.executemany("INSERT INTO _undo_pairs VALUES (?, ?);", norm_pairs)
+        # Releitura dos IDs impactados só é necessária se algum par tem um lado vazio ou se a família
+        # contábil trouxe PAR_IDs; com pares completos (PAR_ID é a chave de depara) os IDs já estão nos sets.
+        needs_rescan = any(f <= 0 or c <= 0 for f, c in norm_pairs)
+        for pid, fam in cur.execute(_SQL_UNDO_PAR_IDS):
+            if pid is None:
+                continue
+            par_ids.add(int(pid))
+            if fam:
+                needs_rescan = True
+        cur.execute("DELETE FROM _undo_pairs;")
 
-        for fis_id, ctb_id in norm_pairs:
-            if fis_id > 0:
-                fis_ids.add(fis_id)
-            if ctb_id > 0:
-                ctb_ids.add(ctb_id)
-
-            if fis_id > 0 and ctb_id > 0:
-                rows = cur.execute(
-                    "SELECT PAR_ID FROM depara WHERE ID_FISICO=? AND ID_CONTABIL=?;",
-                    (fis_id, ctb_id),
-                ).fetchall()
-                # Regra de família: se o CTB informado for PAI (INC=0), remove também filhos (INC!=0)
-                # do mesmo NRBRM (mesmo ID_FISICO âncora).
-                fam = cur.execute(
-                    "SELECT COALESCE(NRBRM,0), COALESCE(INC,0) FROM contabil WHERE ID=?;",
-                    (ctb_id,),
-                ).fetchone()
-                if fam:
-                    nrbrm = int(fam[0] or 0)
-                    inc = int(fam[1] or 0)
-                    if nrbrm > 0 and inc == 0:
-                        fam_rows = cur.execute(
-                            "SELECT PAR_ID FROM depara WHERE COALESCE(NRBRM,0)=? AND ID_FISICO=?;",
-                            (nrbrm, fis_id),
-                        ).fetchall()
-                        rows = list(rows) + list(fam_rows)
-            elif fis_id > 0 and ctb_id <= 0:
-                rows = cur.execute(
-                    "SELECT PAR_ID FROM depara WHERE ID_FISICO=?;",
-                    (fis_id,),
-                ).fetchall()
-            else:  # fis_id <=0 and ctb_id > 0
-                rows = cur.execute(
-                    "SELECT PAR_ID FROM depara WHERE ID_CONTABIL=?;",
-                    (ctb_id,),
-                ).fetchall()
-                # Regra de família para não-chapeável: se CTB é PAI (INC=0), remove família pelo NRBRM.
-                fam = cur.execute(
-                    "SELECT COALESCE(NRBRM,0), COALESCE(INC,0) FROM contabil WHERE ID=?;",
-                    (ctb_id,),
-                ).fetchone()
-                if fam:
-                    nrbrm = int(fam[0] or 0)
-                    inc = int(fam[1] or 0)
-                    if nrbrm > 0 and inc == 0:
-                        fam_rows = cur.execute(
-                            "SELECT PAR_ID FROM depara WHERE COALESCE(NRBRM,0)=?;",
-                            (nrbrm,),
-                        ).fetchall()
-                        rows = list(rows) + list(fam_rows)
-
-            for (pid,) in rows:
-                try:
-                    par_ids.add(int(pid))
-                except Exception:
-                    pass
+        # Listas ordenadas montadas uma vez e reaproveitadas em todos os IN (...)
+        par_ids_list = sorted(par_ids)
 
         # Inclui IDs realmente impactados (do(s) PAR_ID(s) encontrados) para limpar FRAG com consistência.
-        if par_ids:
-            ph = ",".join(["?"] * len(par_ids))
-            impacted = cur.execute(
-                f"SELECT COALESCE(ID_FISICO,0), COALESCE(ID_CONTABIL,0) FROM depara WHERE PAR_ID IN ({ph});",
-                tuple(sorted(par_ids)),
-            ).fetchall()
+        if par_ids_list and needs_rescan:
+            impacted = _fetch_in(
+                cur,
+                "SELECT COALESCE(ID_FISICO,0), COALESCE(ID_CONTABIL,0) FROM depara WHERE PAR_ID IN ({ph});",
+                par_ids_list,
+            )
             for f_id, c_id in impacted:
                 f_id = int(f_id or 0)
                 c_id = int(c_id or 0)
@@ -903,44 +1081,23 @@ def undo_pairs(con: sqlite3.Connection, pairs: List[Tuple[int, int]]) -> Dict[st
                     fis_ids.add(f_id)
                 if c_id > 0:
                     ctb_ids.add(c_id)
+        fis_ids_list = sorted(fis_ids)
+        ctb_ids_list = sorted(ctb_ids)
 
         # Remove depara
-        if par_ids:
-            ph = ",".join(["?"] * len(par_ids))
-            cur.execute(f"DELETE FROM depara WHERE PAR_ID IN ({ph});", tuple(sorted(par_ids)))
-            out["removed_depara"] = int(cur.rowcount if cur.rowcount is not None else 0)
-
-        # Remove bloqueios em 'conciliados' (por PAR_ID e por IDs)
-        removed_conc = 0
-        if par_ids:
-            ph = ",".join(["?"] * len(par_ids))
-            cur.execute(f"DELETE FROM conciliados WHERE PAR_ID IN ({ph});", tuple(sorted(par_ids)))
-            removed_conc += int(cur.rowcount if cur.rowcount is not None else 0)
-
-        if fis_ids:
-            ph = ",".join(["?"] * len(fis_ids))
-            cur.execute(f"DELETE FROM conciliados WHERE BASE='FIS' AND ID IN ({ph});", tuple(sorted(fis_ids)))
-            removed_conc += int(cur.rowcount if cur.rowcount is not None else 0)
-
-        if ctb_ids:
-            ph = ",".join(["?"] * len(ctb_ids))
-            cur.execute(f"DELETE FROM conciliados WHERE BASE='CTB' AND ID IN ({ph});", tuple(sorted(ctb_ids)))
-            removed_conc += int(cur.rowcount if cur.rowcount is not None else 0)
-
-        out["removed_conc"] = removed_conc
+        out["removed_depara"] = _exec_in(cur, "DELETE FROM depara WHERE PAR_ID IN ({ph});", par_ids_list)
+
+        # Remove bloqueios em 'conciliados' (por PAR_ID e por IDs); conciliados.ID é TEXT
+        out["removed_conc"] = _delete_conciliados(cur, par_ids_list, fis_ids_list, ctb_ids_list)
 
         # Limpa FRAG nas tabelas base se existir
         frag_f = _resolve_column(con, "fisico", ["FRAG"], contains="FRAG")
-        if frag_f and fis_ids:
-            ph = ",".join(["?"] * len(fis_ids))
-            cur.execute(f"UPDATE fisico SET {frag_f}=NULL WHERE ID IN ({ph});", tuple(sorted(fis_ids)))
-            out["unmarked_fis"] = int(cur.rowcount if cur.rowcount is not None else 0)
+        if frag_f:
+            out["unmarked_fis"] = _exec_in(cur, f"UPDATE fisico SET {frag_f}=NULL WHERE ID IN ({{ph}});", fis_ids_list)
 
         frag_c = _resolve_column(con, "contabil", ["FRAG"], contains="FRAG")
-        if frag_c and ctb_ids:
-            ph = ",".join(["?"] * len(ctb_ids))
-            cur.execute(f"UPDATE contabil SET {frag_c}=NULL WHERE ID IN ({ph});", tuple(sorted(ctb_ids)))
-            out["unmarked_ctb"] = int(cur.rowcount if cur.rowcount is not None else 0)
+        if frag_c:
+            out["unmarked_ctb"] = _exec_in(cur, f"UPDATE contabil SET {frag_c}=NULL WHERE ID IN ({{ph}});", ctb_ids_list)
 
         cur.execute("COMMIT;")
         return out
@@ -961,19 +1118,88 @@ def find_children_ctb_ids(
     - Exclui o ID do pai já selecionado.
     - Respeita pendência (não existe em conciliados).
     """
-    q = """
+    q = f"""
     SELECT t.ID
     FROM contabil t
     WHERE t.NRBRM = ?
       AND COALESCE(t.INC,0) <> 0
       AND t.ID <> ?
-      AND NOT EXISTS (SELECT 1 FROM conciliados c WHERE c.BASE='CTB' AND c.ID=t.ID)
+      AND {_pending_cond(con, 'CTB', 't')}
     ORDER BY t.ID
     LIMIT ?;
     """
     rows = con.execute(q, (int(nrbrm), int(exclude_ctb_id), int(limit))).fetchall()
     return [int(r[0]) for r in rows]
 
+def find_children_ctb_ids_bulk(con: sqlite3.Connection, nrbrms: Iterable[int]) -> Dict[int, List[int]]:
+    """NRBRM -> IDs contábeis pendentes com INC != 0 (ordenados por ID), numa consulta só.
+
+    Mesmo critério do find_children_ctb_ids, para vários NRBRM de uma vez; o ID do pai
+    é excluído por quem consulta o mapa.
+    """
+    out: Dict[int, List[int]] = {}
+    keys = sorted({int(n) for n in nrbrms if int(n or 0) > 0})
+    if not keys:
+        return out
+    rows = _fetch_in(
+        con.cursor(),
+        """SELECT t.NRBRM, t.ID FROM contabil t
+            WHERE t.NRBRM IN ({ph})
+              AND COALESCE(t.INC,0) <> 0
+              AND """ + _pending_cond(con, "CTB", "t") + """
+            ORDER BY t.NRBRM, t.ID;""",
+        keys,
+    )
+    for nrbrm, cid in rows:
+        out.setdefault(int(nrbrm), []).append(int(cid))
+    return out
+
+
+def _desc_source(df: pd.DataFrame):
+    """Descrição usada na regra 6, por linha: DESCRICAO, senão DESC, senão DESC_NORM (resolvido na coluna toda)."""
+    out = pd.Series("", index=df.index, dtype=object)
+    for col in ("DESC_NORM", "DESC", "DESCRICAO"):  # do menos para o mais prioritário
+        if col in df.columns:
+            v = df[col]
+            out = v.where(v.notna() & (v.astype(str) != ""), out)
+    return out.to_numpy()
+
+
+def _frame_attrs(df: pd.DataFrame) -> pd.DataFrame:
+    """(ID, ATTR) dos candidatos: usa a DESC_ATTR já carregada e só calcula onde ela falta."""
+    if "DESC_ATTR" in df.columns:
+        return _desc_attr_from_column(df.assign(DESC_FOR_ATTR=_desc_source(df)))
+    return desc_attr_frame(df["ID"].astype("int64"), _desc_source(df))
+
+
+def _gather_by_id(df: pd.DataFrame, ids: List[int]) -> pd.DataFrame:
+    """Linhas de `df` na ordem de `ids` (hash join por ID), mantendo a ordem original das colunas.
+
+    ID repetido em `ids` levanta MergeError (os dfs dos pares sairiam desalinhados);
+    ID repetido na base fica com a primeira linha.
+    """
+    order = pd.DataFrame({"ID": pd.Series(ids, dtype=df["ID"].dtype)})
+    out = order.merge(df.drop_duplicates("ID"), on="ID", how="left", validate="one_to_one")
+    return out[df.columns]
+
+
+def _greedy_first_free(cand: Iterable[Tuple[int, int]], limit: int) -> List[Tuple[int, int]]:
+    """Pareamento guloso sobre (FIS, CTB) agrupados por FIS na ordem de preferência:
+    cada FIS fica com o primeiro CTB ainda não usado; para em `limit` pares."""
+    used_ctb: set[int] = set()
+    pairs: List[Tuple[int, int]] = []
+    last_fis = None
+    for fis_id, ctb_id in cand:
+        if fis_id == last_fis or ctb_id in used_ctb:
+            continue
+        used_ctb.add(ctb_id)
+        pairs.append((int(fis_id), int(ctb_id)))
+        last_fis = fis_id
+        if len(pairs) >= limit:
+            break
+    return pairs
+
+
 def load_pairs_auto02(
     con: sqlite3.Connection,
     rule_id: str,
@@ -1013,75 +1239,36 @@ def load_pairs_auto02(
     rid = (rule_id or "").strip()
 
     if rid == "6":
-        # Pareamento guloso por similaridade de descrição (>=2 atributos), usando candidatos já filtrados
-        # monta atributos dos contábeis e índice invertido
-        inv: Dict[str, List[int]] = {}
-        c_attrs: Dict[int, set] = {}
-        for _, row in df_c.iterrows():
-            cid = int(row.get("ID"))
-            attrs = _desc_attr_set(row.get("DESCRICAO") or row.get("DESC") or row.get("DESC_NORM") or "")
-            c_attrs[cid] = attrs
-            for a in attrs:
-                inv.setdefault(a, []).append(cid)
-
-        used_ctb = set()
-        pairs: List[Tuple[int, int]] = []
-        fis_rows = []
-        ctb_rows = []
-
-        for _, row in df_f.iterrows():
-            fid = int(row.get("ID"))
-            fattrs = _desc_attr_set(row.get("DESCRICAO") or row.get("DESC") or row.get("DESC_NORM") or "")
-            if not fattrs:
-                continue
-
-            counts: Dict[int, int] = {}
-            for a in fattrs:
-                for cid in inv.get(a, []):
-                    if cid in used_ctb:
-                        continue
-                    counts[cid] = counts.get(cid, 0) + 1
-
-            # escolhe o melhor match disponível com >=2 atributos
-            best = None
-            best_score = 0
-            for cid, score in counts.items():
-                if score >= 2 and score > best_score:
-                    best = cid
-                    best_score = score
-
-            if best is None:
-                continue
+        # Pareamento guloso por similaridade de descrição (>=2 atributos), usando candidatos já filtrados.
+        # Scores de todos os pares FIS x CTB saem de um merge por atributo (sem laço por linha).
+        attrs_f = _frame_attrs(df_f)
+        attrs_c = _frame_attrs(df_c)
+        hits = _attr_hits(attrs_f, attrs_c)
 
-            used_ctb.add(best)
-            pairs.append((fid, best))
+        pairs: List[Tuple[int, int]] = []
+        if not hits.empty:
+            # ordem do guloso: FIS na ordem dos candidatos; para cada um, maior score e,
+            # no empate, o CTB que vem primeiro
+            f_pos = pd.Series(range(len(df_f)), index=df_f["ID"].astype("int64").to_numpy())
+            c_pos = pd.Series(range(len(df_c)), index=df_c["ID"].astype("int64").to_numpy())
+            f_pos = f_pos[~f_pos.index.duplicated()]
+            c_pos = c_pos[~c_pos.index.duplicated()]
+            hits = hits.assign(FP=hits["FID"].map(f_pos), CP=hits["CID"].map(c_pos), NEG=-hits["SCORE"])
+            hits = hits.sort_values(["FP", "NEG", "CP"], kind="stable")
+
+            pairs = _greedy_first_free(zip(hits["FID"].tolist(), hits["CID"].tolist()), int(limit_pairs))
 
         if not pairs:
             return pd.DataFrame(), pd.DataFrame(), []
 
-        # monta dfs alinhados na ordem de pairs
-        fis_map = df_f.set_index("ID")
-        ctb_map = df_c.set_index("ID")
-        for fid, cid in pairs[: int(limit_pairs)]:
-            if fid in fis_map.index and cid in ctb_map.index:
-                fis_rows.append(fis_map.loc[fid])
-                ctb_rows.append(ctb_map.loc[cid])
-
-        df_f_out = pd.DataFrame(fis_rows).reset_index()
-        df_c_out = pd.DataFrame(ctb_rows).reset_index()
-        return df_f_out, df_c_out, pairs[: int(limit_pairs)]
+        # monta dfs alinhados na ordem de pairs (gather por ID; todos os IDs vêm dos próprios candidatos)
+        pairs = pairs[: int(limit_pairs)]
+        df_f_out = _gather_by_id(df_f, [f for f, _ in pairs])
+        df_c_out = _gather_by_id(df_c, [c for _, c in pairs])
+        return df_f_out, df_c_out, pairs
 
     # Recria a mesma condição de join do auto02
-    if rid == "1":
-        join_cond = "LENGTH(f.SERIE_NORM) >= 4 AND t.DESC_NORM LIKE ('%' || f.SERIE_NORM || '%')"
-    elif rid == "2":
-        join_cond = "LENGTH(t.SERIE_NORM) >= 4 AND f.DESC_NORM LIKE ('%' || t.SERIE_NORM || '%')"
-    elif rid == "3":
-        join_cond = "t.MODELO_NORM <> '' AND f.MODELO_NORM = t.MODELO_NORM"
-    elif rid == "4":
-        join_cond = "LENGTH(f.MODELO_NORM) >= 4 AND t.DESC_NORM LIKE ('%' || f.MODELO_NORM || '%')"
-    else:  # "5"
-        join_cond = "LENGTH(f.TAG_NORM) >= 4 AND t.DESC_NORM LIKE ('%' || f.TAG_NORM || '%')"
+    join_cond = _AUTO02_JOIN_COND[rid]
 
     w_fis, p_fis = _auto02_base_filters("f", desc1=desc1, desc2=desc2, desc3=desc3, desc_mode=desc_mode,
                                        filial=filial, ccusto=ccusto, local=local, condic=condic)
@@ -1095,8 +1282,8 @@ def load_pairs_auto02(
         w_ctb += " AND SUBSTR(COALESCE(t.DT_AQUISICAO,''),1,4) = ? "
         p_ctb.append(ano)
 
-    pend_fis = "NOT EXISTS (SELECT 1 FROM conciliados c WHERE c.BASE='FIS' AND c.ID=f.ID)"
-    pend_ctb = "NOT EXISTS (SELECT 1 FROM conciliados c WHERE c.BASE='CTB' AND c.ID=t.ID)"
+    pend_fis = _pending_cond(con, "FIS", "f")
+    pend_ctb = _pending_cond(con, "CTB", "t")
 
     base_sql = f"""
     fisico f
@@ -1109,24 +1296,32 @@ def load_pairs_auto02(
       {w_ctb}
     """
 
-    q_pairs = f"SELECT f.ID AS FIS_ID, t.ID AS CTB_ID FROM {base_sql} ORDER BY f.ID, t.ID LIMIT ?;"
+    # Candidatos (primeiros candidate_cap pares por f.ID, t.ID), podados sem mudar o guloso:
+    # - cada FIS só pode precisar dos seus primeiros limit_pairs CTBs (antes dele no máximo
+    #   limit_pairs-1 CTBs foram usados);
+    # - cada CTB só pode ficar com um dos seus primeiros limit_pairs FIS (se estava livre, cada
+    #   FIS anterior que o listava saiu com um par, e o guloso para em limit_pairs pares).
+    # DENSE_RANK para linhas repetidas (ID duplicado na base) não contarem duas vezes.
+    q_pairs = f"""
+    WITH cand AS (
+        SELECT f.ID AS FIS_ID, t.ID AS CTB_ID FROM {base_sql} ORDER BY f.ID, t.ID LIMIT ?
+    ),
+    ranked AS (
+        SELECT FIS_ID, CTB_ID,
+               DENSE_RANK() OVER (PARTITION BY FIS_ID ORDER BY CTB_ID) AS RN_F,
+               DENSE_RANK() OVER (PARTITION BY CTB_ID ORDER BY FIS_ID) AS RN_C
+        FROM cand
+    )
+    SELECT FIS_ID, CTB_ID FROM ranked WHERE RN_F <= ? AND RN_C <= ? ORDER BY FIS_ID, CTB_ID;
+    """
     params_join = p_fis + p_ctb
-    cand = pd.read_sql_query(q_pairs, con, params=params_join + [int(candidate_cap)])
-    if cand.empty:
+    cur = con.cursor()
+    cand = cur.execute(q_pairs, params_join + [int(candidate_cap), int(limit_pairs), int(limit_pairs)]).fetchall()
+    if not cand:
         return pd.DataFrame(), pd.DataFrame(), []
 
-    used_ctb: set[int] = set()
-    pairs: List[Tuple[int,int]] = []
-    for fis_id, grp in cand.groupby("FIS_ID", sort=True):
-        for ctb_id in grp["CTB_ID"].tolist():
-            ctb_id = int(ctb_id)
-            if ctb_id in used_ctb:
-                continue
-            used_ctb.add(ctb_id)
-            pairs.append((int(fis_id), ctb_id))
-            break
-        if len(pairs) >= int(limit_pairs):
-            break
+    # guloso: cada FIS pega o primeiro CTB ainda livre (lista já vem ordenada por FIS, CTB)
+    pairs = _greedy_first_free(cand, int(limit_pairs))
 
     if not pairs:
         return pd.DataFrame(), pd.DataFrame(), []
@@ -1134,81 +1329,10 @@ def load_pairs_auto02(
     fis_ids = [p[0] for p in pairs]
     ctb_ids = [p[1] for p in pairs]
 
-    df_f_full = pd.read_sql_query(
-        f"SELECT * FROM fisico WHERE ID IN ({','.join(['?']*len(fis_ids))});",
-        con,
-        params=[int(x) for x in fis_ids],
-    )
-    df_c_full = pd.read_sql_query(
-        f"SELECT * FROM contabil WHERE ID IN ({','.join(['?']*len(ctb_ids))});",
-        con,
-        params=[int(x) for x in ctb_ids],
-    )
+    df_f_full = _read_rows_by_ids(con, "fisico", fis_ids)
+    df_c_full = _read_rows_by_ids(con, "contabil", ctb_ids)
 
-    # Reordena conforme pairs
-    df_f_full["__ord"] = df_f_full["ID"].map({fid:i for i,fid in enumerate(fis_ids)})
-    df_c_full["__ord"] = df_c_full["ID"].map({cid:i for i,cid in enumerate(ctb_ids)})
-    df_f_full = df_f_full.sort_values("__ord").drop(columns=["__ord"]).reset_index(drop=True)
-    df_c_full = df_c_full.sort_values("__ord").drop(columns=["__ord"]).reset_index(drop=True)
+    # Reordena conforme pairs (gather por ID; cada FIS/CTB aparece uma vez em pairs)
+    df_f_full = _gather_by_id(df_f_full, fis_ids)
+    df_c_full = _gather_by_id(df_c_full, ctb_ids)
     return df_f_full, df_c_full, pairs
-
-
-
-
-def generate_pre_depara_direct(con: sqlite3.Connection) -> int:
-    """
-    Gera sugestões de conciliação direta por NRBRM igual (INC livre) e grava em pre_depara como PENDENTE.
-    Ignora IDs já conciliados e pares já sugeridos.
-    Retorna quantidade inserida.
-    """
-    cur = con.cursor()
-    cur.execute("BEGIN;")
-    try:
-        cur.execute("""
-            INSERT OR IGNORE INTO pre_depara (ID_FISICO, ID_CONTABIL, NRBRM, INC_CONTABIL)
-            SELECT f.ID, c.ID, f.NRBRM, c.INC
-            FROM fisico f
-            JOIN contabil c ON c.NRBRM = f.NRBRM
-            LEFT JOIN conciliados cf ON (cf.BASE='FIS' AND cf.ID=f.ID)
-            LEFT JOIN conciliados cc ON (cc.BASE='CTB' AND cc.ID=c.ID)
-            WHERE cf.ID IS NULL
-              AND cc.ID IS NULL
-              AND f.NRBRM IS NOT NULL;
-        """)
-        inserted = cur.rowcount if cur.rowcount is not None else 0
-        cur.execute("COMMIT;")
-        return int(inserted)
-    except Exception:
-        cur.execute("ROLLBACK;")
-        raise
-
-
-def fetch_pre_depara(con: sqlite3.Connection, status: str = "PENDENTE") -> list[tuple]:
-    cur = con.cursor()
-    return cur.execute(
-        "SELECT SUG_ID, ID_FISICO, ID_CONTABIL FROM pre_depara WHERE STATUS=? ORDER BY SUG_ID;",
-        (status,),
-    ).fetchall()
-
-
-def set_pre_depara_status(con: sqlite3.Connection, sug_id: int, status: str) -> None:
-    cur = con.cursor()
-    cur.execute("UPDATE pre_depara SET STATUS=? WHERE SUG_ID=?;", (status, sug_id))
-    con.commit()
-
-
-def commit_pre_depara_aprovados(con: sqlite3.Connection) -> int:
-    cur = con.cursor()
-    rows = cur.execute(
-        "SELECT ID_FISICO, ID_CONTABIL FROM pre_depara WHERE STATUS='APROVADO' ORDER BY SUG_ID;"
-    ).fetchall()
-    saved = save_direct_pairs(con, [(int(a), int(b)) for a, b in rows])
-
-    cur.execute("""
-        DELETE FROM pre_depara
-        WHERE STATUS='APROVADO'
-          AND ID_FISICO IN (SELECT ID FROM conciliados WHERE BASE='FIS')
-          AND ID_CONTABIL IN (SELECT ID FROM conciliados WHERE BASE='CTB');
-    """)
-    con.commit()
-    return saved
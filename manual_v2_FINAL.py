@@ -1,10 +1,18 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import queue
 import re
+import threading
 import tkinter as tk
+from collections import Counter
+from pathlib import Path
 from tkinter import ttk, messagebox
 from tkinter import font as tkfont
 
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
@@ -12,15 +20,22 @@ from manual_db_v2_fixed import (
     connect,
     get_counts,
     load_pending_manual,
+    desc_terms_norm,
+    filter_desc_terms,
     load_pairs_auto02,
     get_distinct_values,
     save_manual_pairs,
     AUTO02_RULES,
-    find_children_ctb_ids,
+    find_children_ctb_ids_bulk,
 )
 
 BG = "#225781"
 MANUAL_MAX_ROWS = 2000  # limite de linhas por lado (Físico/Contábil) na tela Manual
+_NON_DIGITS = re.compile(r"\D")  # ano do filtro de data contábil: só dígitos
+_POPULATE_FIRST = 100  # linhas inseridas de imediato em cada grade (primeira tela + folga)
+_POPULATE_STEP = 250  # linhas por lote no restante da carga
+# staging gravado ao fechar a janela e retomado ao reaplicar o mesmo filtro no mesmo banco
+_STAGING_DIR = Path.home() / ".cache" / "evs_cotej"
 
 
 class ValuePicker(tk.Toplevel):
@@ -32,6 +47,9 @@ class ValuePicker(tk.Toplevel):
         self.target_var = target_var
         self.values_all = values[:] if values else []
         self.values_filtered = self.values_all[:]
+        # minúsculas calculadas uma vez (a busca roda a cada tecla)
+        self._values_lower = [(v or "").lower() for v in self.values_all]
+        self._filter_job = None
 
         frm = tk.Frame(self, bg=BG)
         frm.pack(padx=10, pady=10, fill="both", expand=True)
@@ -40,10 +58,11 @@ class ValuePicker(tk.Toplevel):
         self.var_search = tk.StringVar()
         ent = tk.Entry(frm, textvariable=self.var_search, width=40)
         ent.grid(row=0, column=1, sticky="we", padx=(6,0))
-        ent.bind("<KeyRelease>", lambda e: self._apply_filter())
+        ent.bind("<KeyRelease>", lambda e: self._schedule_filter())
         ent.focus_set()
 
-        self.listbox = tk.Listbox(frm, height=14, width=45)
+        self._lb_var = tk.Variable(self, value=())
+        self.listbox = tk.Listbox(frm, height=14, width=45, listvariable=self._lb_var)
         self.listbox.grid(row=1, column=0, columnspan=2, sticky="nsew", pady=(8,0))
         self.listbox.bind("<Double-Button-1>", lambda e: self._confirm())
 
@@ -68,18 +87,33 @@ class ValuePicker(tk.Toplevel):
         self.transient(master)
         self.grab_set()
 
+    def _schedule_filter(self):
+        # agrupa rajadas de teclas num único filtro
+        if self._filter_job is not None:
+            self.after_cancel(self._filter_job)
+        self._filter_job = self.after(120, self._apply_filter)
+
     def _apply_filter(self):
+        self._filter_job = None
         q = (self.var_search.get() or "").strip().lower()
         if not q:
             self.values_filtered = self.values_all[:]
         else:
-            self.values_filtered = [v for v in self.values_all if q in (v or "").lower()]
+            self.values_filtered = [v for v, vl in zip(self.values_all, self._values_lower) if q in vl]
         self._refresh()
 
     def _refresh(self):
-        self.listbox.delete(0, tk.END)
-        for v in self.values_filtered:
-            self.listbox.insert(tk.END, v)
+        # uma atribuição de lista Tcl em vez de um insert por valor
+        self._lb_var.set(tuple(self.values_filtered))
+
+    def destroy(self):
+        if getattr(self, "_filter_job", None) is not None:
+            try:
+                self.after_cancel(self._filter_job)
+            except Exception:
+                pass
+            self._filter_job = None
+        super().destroy()
 
     def _confirm(self):
         sel = self.listbox.curselection()
@@ -90,15 +124,46 @@ class ValuePicker(tk.Toplevel):
         self.destroy()
 
 
+_NL_TRANS = str.maketrans({"\n": " ", "\r": " "})
+
+
 def _clean_cell(x) -> str:
+    # caso comum (texto) sem passar pelo pd.isna
+    if type(x) is str:
+        return x.translate(_NL_TRANS) if ("\n" in x or "\r" in x) else x
+    if x is None or (type(x) is float and x != x):
+        return ""
     try:
         if pd.isna(x):
             return ""
     except Exception:
         pass
-    if x is None:
-        return ""
-    return str(x).replace("\n", " ").replace("\r", " ")
+    return str(x).translate(_NL_TRANS)
+
+
+# Colunas da base exibidas em cada grade, na ordem das colunas do Treeview (_make_tree).
+_GRID_SOURCE = {
+    "FIS": ("ID", "FILIAL", "CCUSTO", "LOCAL", "CONDIC", "NRBRM", "INC", "DESCRICAO",
+            "MARCA", "MODELO", "SERIE", "DIMENSAO", "CAPACIDADE", "TAG"),
+    "CTB": ("ID", "FILIAL", "CCUSTO", "LOCAL", "NRBRM", "INC", "DESCRICAO", "SERIE", "TAG",
+            "DT_AQUISICAO", "VLR_AQUISICAO", "DEP_ACUMULADA", "VLR_RESIDUAL"),
+}
+
+
+def _int_column(df: pd.DataFrame, *cols: str):
+    """Array int64 da primeira coluna numérica disponível em `cols` (as seguintes cobrem os vazios); 0 onde não houver."""
+    out = pd.Series(float("nan"), index=df.index, dtype="float64")
+    for c in cols:
+        if c in df.columns:
+            out = out.fillna(pd.to_numeric(df[c], errors="coerce"))
+    return out.fillna(0).astype("int64").to_numpy()
+
+
+def _row_by_id(ids) -> dict[int, int]:
+    """ID -> primeira linha da grade (IDs vazios/ inválidos ficam de fora)."""
+    rows = np.flatnonzero(ids > 0)
+    # zip de trás para frente: a primeira ocorrência de um ID repetido é a que fica
+    return dict(zip(ids[rows[::-1]].tolist(), rows[::-1].tolist()))
 
 
 class ManualV2Window(tk.Toplevel):
@@ -147,6 +212,36 @@ class ManualV2Window(tk.Toplevel):
         # dados
         self.df_fis = pd.DataFrame()
         self.df_ctb = pd.DataFrame()
+        self._set_row_arrays()
+
+        # último resultado do Manual (refinos só de descrição são filtrados em memória)
+        self._manual_cache: dict | None = None
+
+        # valores das listas ▾ por campo (vêm das bases inteiras, não mudam ao conciliar)
+        self._picker_cache: dict[str, list[str]] = {}
+
+        # NRBRM -> incorporados contábeis pendentes dos pais da grade (montado a cada filtro)
+        self._ctb_children: dict[int, list[int]] = {}
+
+        # consultas dos filtros em segundo plano (uma por vez; só o último resultado é exibido).
+        # Thread daemon própria: fechar a janela no meio de uma consulta longa não prende o processo.
+        self._filter_queue: queue.Queue = queue.Queue()
+        self._filter_seq = 0
+        threading.Thread(target=self._filter_worker, daemon=True, name="evs-manual").start()
+
+        # conexões abertas uma vez e reaproveitadas (PRAGMAs e cache de colunas ficam quentes);
+        # o worker tem a sua porque a conexão SQLite só pode ser usada na thread que a abriu
+        self._con = None
+        self._worker_con = None
+
+        # arquivo de staging do filtro exibido (ver _save_staging/_restore_staging)
+        self._staging_file: Path | None = None
+
+        # cargas em lotes das grades em andamento: str(tv) (e str(tv)+":autosize") -> id do after()
+        self._populate_jobs: dict[str, str] = {}
+
+        # larguras medidas no autoajuste das colunas: (fonte, texto) -> px
+        self._measure_cache: dict[tuple[str, str], int] = {}
 
         # pendentes com metadados (role = "PAI" | "FILHO")
         # item: {"fis_id":int,"ctb_id":int,"role":str,"fis_row":int,"ctb_row":int}
@@ -156,15 +251,76 @@ class ManualV2Window(tk.Toplevel):
         self._batch_seq: int = 0
 
         # contadores (para remoção/cores corretas quando houver pai + filhos)
-        self._fis_id_count: dict[int, int] = {}
-        self._ctb_id_count: dict[int, int] = {}
-        self._fis_row_count: dict[int, int] = {}
-        self._ctb_row_count: dict[int, int] = {}
+        self._fis_id_count: Counter[int] = Counter()
+        self._ctb_id_count: Counter[int] = Counter()
+        self._fis_row_count: Counter[int] = Counter()
+        self._ctb_row_count: Counter[int] = Counter()
 
         self._build()
         self._refresh_counts_only()
         self._clear_tables()
 
+    def destroy(self):
+        self._save_staging()
+        for tv in (getattr(self, "tv_fis", None), getattr(self, "tv_ctb", None)):
+            if tv is not None:
+                self._cancel_populate(tv)
+        job = getattr(self, "_autopair_job", None)
+        if job is not None:
+            try:
+                self.after_cancel(job)
+            except Exception:
+                pass
+        jobs = getattr(self, "_filter_queue", None)
+        if jobs is not None:
+            # consultas na fila viram obsoletas; o worker fecha a conexão dele e encerra
+            self._filter_seq += 1
+            jobs.put(None)
+        con, self._con = getattr(self, "_con", None), None
+        if con is not None:
+            try:
+                con.close()
+            except Exception:
+                pass
+        super().destroy()
+
+    def _db(self):
+        """Conexão da thread da UI, aberta no primeiro uso e mantida até fechar a janela."""
+        if self._con is None:
+            self._con = connect(self.db_path)
+        return self._con
+
+    def _end_ui_read(self):
+        """Encerra a transação de leitura da conexão da UI (no PostgreSQL ficaria "idle in transaction")."""
+        if self._con is not None:
+            try:
+                self._con.commit()
+            except Exception:
+                pass
+
+    def _filter_worker(self):
+        """Laço do worker dos filtros: executa os jobs da fila em ordem; None encerra."""
+        while True:
+            job = self._filter_queue.get()
+            if job is None:
+                self._close_worker_db()
+                return
+            job()
+
+    def _worker_db(self):
+        """Conexão do worker dos filtros (só chamada dentro do _filter_worker)."""
+        if self._worker_con is None:
+            self._worker_con = connect(self.db_path)
+        return self._worker_con
+
+    def _close_worker_db(self):
+        con, self._worker_con = self._worker_con, None
+        if con is not None:
+            try:
+                con.close()
+            except Exception:
+                pass
+
     # ---------------- UI ----------------
     def _build(self):
         top = tk.Frame(self, bg=BG)
@@ -295,6 +451,8 @@ class ManualV2Window(tk.Toplevel):
         self._sel_f_row = None
         self._sel_c_row = None
         self._suspend_autopair = False
+        # tentativa de pareamento agendada (after_idle): junta os eventos de seleção em rajada
+        self._autopair_job = None
         self.tv_fis.bind("<<TreeviewSelect>>", lambda e: self._on_tree_select("FIS"))
         self.tv_ctb.bind("<<TreeviewSelect>>", lambda e: self._on_tree_select("CTB"))
 
@@ -318,7 +476,10 @@ class ManualV2Window(tk.Toplevel):
         list_wrap.grid_rowconfigure(0, weight=1)
         list_wrap.grid_columnconfigure(0, weight=1)
 
-        self.lb_pending = tk.Listbox(list_wrap, height=6)
+        self._lb_pending_var = tk.Variable(self, value=())
+        self.lb_pending = tk.Listbox(list_wrap, height=6, listvariable=self._lb_pending_var)
+        # quantos itens de pending_pairs já estão na listbox (atualização incremental)
+        self._pending_listbox_len = 0
         self.lb_pending.grid(row=0, column=0, sticky="nsew")
 
         sb_lb = tk.Scrollbar(
@@ -365,8 +526,13 @@ class ManualV2Window(tk.Toplevel):
 
     def _open_picker(self, field: str, target_var: tk.StringVar):
         try:
-            with connect(self.db_path) as _con:
-                values = get_distinct_values(_con, field)
+            values = self._picker_cache.get(field)
+            if values is None:
+                try:
+                    values = get_distinct_values(self._db(), field)
+                finally:
+                    self._end_ui_read()
+                self._picker_cache[field] = values
             if not values:
                 messagebox.showinfo("Lista vazia", f"Não há valores disponíveis para {field}.")
                 return
@@ -459,7 +625,17 @@ class ManualV2Window(tk.Toplevel):
             pass
         return tkfont.nametofont("TkDefaultFont")
 
-    def _autosize_columns(self, tv: ttk.Treeview, sample_limit: int = 250):
+    def _measure(self, font: tkfont.Font, s: str) -> int:
+        # font.measure é uma chamada ao Tk: memoriza por fonte/texto
+        key = (str(font), s)
+        w = self._measure_cache.get(key)
+        if w is None:
+            if len(self._measure_cache) >= 4096:
+                self._measure_cache.clear()
+            w = self._measure_cache[key] = font.measure(s)
+        return w
+
+    def _autosize_columns(self, tv: ttk.Treeview, sample_limit: int = 40, cells=None):
         cols = tv["columns"]
         if not cols:
             return
@@ -482,22 +658,30 @@ class ManualV2Window(tk.Toplevel):
             "ID": 90,
         }
 
-        children = tv.get_children()
-        if len(children) > sample_limit:
-            children = children[:sample_limit]
-
-        for c in cols:
-            w = font.measure(str(c)) + padding
-            limit = max_width.get(c, 400)
-            for iid in children:
+        # amostra = primeira tela; das células já limpas do _populate ou, sem elas,
+        # uma leitura de valores por linha (em vez de tv.set por célula)
+        if cells is not None:
+            rows = cells[:sample_limit]
+        else:
+            rows = []
+            for iid in tv.get_children()[:sample_limit]:
                 try:
-                    cell = tv.set(iid, c)
+                    rows.append(tv.item(iid, "values"))
                 except Exception:
                     continue
-                s = _clean_cell(cell)
-                if not s:
+
+        for j, c in enumerate(cols):
+            w = self._measure(font, str(c)) + padding
+            limit = max_width.get(c, 400)
+            seen: set[str] = set()
+            for vals in rows:
+                if j >= len(vals):
                     continue
-                w = max(w, font.measure(s) + padding)
+                s = vals[j] if cells is not None else _clean_cell(vals[j])
+                if not s or s in seen:
+                    continue
+                seen.add(s)
+                w = max(w, self._measure(font, s) + padding)
                 if w >= limit:
                     w = limit
                     break
@@ -505,8 +689,13 @@ class ManualV2Window(tk.Toplevel):
 
     # ---------- Mode behavior ----------
     def _on_mode_change(self):
-        is_auto = self.var_mode.get() == "Automático (02)"
+        mode = self.var_mode.get()
+        is_auto = mode == "Automático (02)"
         self.cmb_rule.configure(state="readonly" if is_auto else "disabled")
+        if getattr(self, "_last_mode", None) == mode:
+            return  # combobox repetiu a mesma seleção: mantém grades e pendentes
+        self._last_mode = mode
+        self._filter_seq += 1  # descarta consulta em andamento do modo anterior
         if not is_auto:
             self.var_auto02_rule.set("")
         self._clear_tables()
@@ -551,6 +740,13 @@ class ManualV2Window(tk.Toplevel):
             sel = self.tv_ctb.selection()
             self._sel_c_row = int(sel[0]) if sel else None
 
+        # o pareamento roda uma vez só, quando as seleções assentarem
+        if self._autopair_job is None:
+            self._autopair_job = self.after_idle(self._try_autopair)
+
+    def _try_autopair(self):
+        self._autopair_job = None
+
         # cria par quando houver 1 seleção em cada lado
         if self._sel_f_row is None or self._sel_c_row is None:
             return
@@ -580,34 +776,9 @@ class ManualV2Window(tk.Toplevel):
         """
         if self.df_fis.empty or self.df_ctb.empty:
             return False
-        def _pk_from_row(r):
-            # Preferir ID de negócio; usar row_id apenas como fallback de compatibilidade.
-            for k in ("ID", "Id", "id"):
-                v = r.get(k, None)
-                if v is None:
-                    continue
-                s = str(v).strip()
-                if not s or s.lower() == "nan":
-                    continue
-                try:
-                    return int(float(s))
-                except Exception:
-                    pass
-            for k in ("row_id", "ROW_ID", "rowid", "ROWID"):
-                v = r.get(k, None)
-                if v is None:
-                    continue
-                s = str(v).strip()
-                if not s or s.lower() == "nan":
-                    continue
-                try:
-                    return int(float(s))
-                except Exception:
-                    pass
-            return 0
 
-        id_f = _pk_from_row(self.df_fis.iloc[row_f])
-        id_c = _pk_from_row(self.df_ctb.iloc[row_c])
+        id_f = int(self._fis_ids[row_f])
+        id_c = int(self._ctb_ids[row_c])
 
         if not id_f or not id_c:
             if not silent:
@@ -628,37 +799,22 @@ class ManualV2Window(tk.Toplevel):
         batch = self._batch_seq
 
         # adiciona par principal (PAI)
-        self.pending_pairs.append(
+        self._push_pending(
             {"fis_id": id_f, "ctb_id": id_c, "role": "PAI", "fis_row": row_f, "ctb_row": row_c, "batch": batch}
         )
 
-        # incrementa contadores
-        self._fis_id_count[id_f] = self._fis_id_count.get(id_f, 0) + 1
-        self._ctb_id_count[id_c] = self._ctb_id_count.get(id_c, 0) + 1
-        self._fis_row_count[row_f] = self._fis_row_count.get(row_f, 0) + 1
-        self._ctb_row_count[row_c] = self._ctb_row_count.get(row_c, 0) + 1
-
         # pinta linhas
-        self.tv_fis.item(str(row_f), tags=("PENDING",))
-        self.tv_ctb.item(str(row_c), tags=("PENDING",))
+        self._paint_pending(self.tv_fis, row_f)
+        self._paint_pending(self.tv_ctb, row_c)
 
         # regra: se contábil é pai (INC=0), pergunta pelos filhos
-        try:
-            inc_val = int(float(self.df_ctb.iloc[row_c].get("INC", 0) or 0))
-        except Exception:
-            inc_val = 0
-        try:
-            nrbrm = int(float(self.df_ctb.iloc[row_c].get("NRBRM", 0) or 0))
-        except Exception:
-            nrbrm = 0
+        inc_val = int(self._ctb_inc[row_c])
+        nrbrm = int(self._ctb_nrbrm[row_c])
 
         extra_children = 0
         if nrbrm and inc_val == 0:
-            try:
-                with connect(self.db_path) as con:
-                    child_ids = find_children_ctb_ids(con, nrbrm=nrbrm, exclude_ctb_id=id_c, limit=2000)
-            except Exception:
-                child_ids = []
+            # filhos carregados junto com o filtro (_apply_filters), sem ida ao banco por clique
+            child_ids = [c for c in self._ctb_children.get(nrbrm, ()) if c != id_c][:2000]
 
             if child_ids:
                 msg = (
@@ -670,18 +826,31 @@ class ManualV2Window(tk.Toplevel):
                         cid = int(cid)
                         if self._ctb_id_count.get(cid, 0) > 0:
                             continue
-                        self.pending_pairs.append(
+                        self._push_pending(
                             {"fis_id": id_f, "ctb_id": cid, "role": "FILHO", "fis_row": row_f, "ctb_row": row_c, "batch": batch}
                         )
-                        self._fis_id_count[id_f] = self._fis_id_count.get(id_f, 0) + 1
-                        self._ctb_id_count[cid] = self._ctb_id_count.get(cid, 0) + 1
-                        self._fis_row_count[row_f] = self._fis_row_count.get(row_f, 0) + 1
-                        self._ctb_row_count[row_c] = self._ctb_row_count.get(row_c, 0) + 1
                         extra_children += 1
 
-        self._rebuild_pending_listbox()
+        self._sync_pending_listbox()
         self._log(f"➕ Par adicionado: FIS {id_f} ↔ CTB {id_c} (pendentes: {len(self.pending_pairs)})" + (f" +{extra_children} filho(s)" if extra_children else ""))
         return True
+    def _set_row_arrays(self):
+        """IDs (ID, senão row_id), INC e NRBRM por linha das grades, resolvidos uma vez por filtro."""
+        self._fis_ids = _int_column(self.df_fis, "ID", "Id", "id", "row_id", "ROW_ID", "rowid", "ROWID")
+        self._ctb_ids = _int_column(self.df_ctb, "ID", "Id", "id", "row_id", "ROW_ID", "rowid", "ROWID")
+        self._ctb_inc = _int_column(self.df_ctb, "INC")
+        self._ctb_nrbrm = _int_column(self.df_ctb, "NRBRM")
+        # ID -> linha, montados sob demanda (staging do Auto02 / retomada) e descartados a cada filtro
+        self._fis_row_of: dict[int, int] | None = None
+        self._ctb_row_of: dict[int, int] | None = None
+
+    def _row_maps(self) -> tuple[dict[int, int], dict[int, int]]:
+        if self._fis_row_of is None:
+            self._fis_row_of = _row_by_id(self._fis_ids)
+        if self._ctb_row_of is None:
+            self._ctb_row_of = _row_by_id(self._ctb_ids)
+        return self._fis_row_of, self._ctb_row_of
+
     # ---------- Filters ----------
     def _filters_payload(self) -> dict:
         return dict(
@@ -693,7 +862,7 @@ class ManualV2Window(tk.Toplevel):
             ccusto=self.var_ccusto.get(),
             local=self.var_local.get(),
             condic=self.var_condic.get(),
-            data_ctb_ano=re.sub(r"\D", "", self.var_data_ctb.get())[:4],
+            data_ctb_ano=_NON_DIGITS.sub("", self.var_data_ctb.get())[:4],
         )
 
     def _clear_filters(self):
@@ -706,6 +875,7 @@ class ManualV2Window(tk.Toplevel):
         self.var_local.set("")
         self.var_condic.set("")
         self.var_data_ctb.set("")
+        self._manual_cache = None
         self._clear_tables()
         self._clear_pending()
         self._refresh_counts_only()
@@ -713,19 +883,64 @@ class ManualV2Window(tk.Toplevel):
     def _apply_filters(self):
         payload = self._filters_payload()
         mode = self.var_mode.get()
-        auto_pairs: list[tuple[int, int]] = []
+        rid = ""
+        if mode != "Manual":
+            rid = (self.var_auto02_rule.get() or "").split(" - ")[0].strip()
+            if not rid:
+                self._clear_tables()
+                self._clear_pending()
+                self._staging_file = None
+                self._refresh_counts_only()
+                return
 
-        with connect(self.db_path) as con:
+        self._filter_seq += 1
+        seq = self._filter_seq
+        staging_file = self._staging_path(mode, rid, payload)
+
+        if mode == "Manual":
+            refined = self._refine_manual_cache(payload)
+            if refined is not None:
+                # refino só de descrição: pais da grade são um subconjunto dos já carregados
+                self._on_filters_loaded(seq, mode, *refined, [], self._ctb_children, None, staging_file=staging_file)
+                return
+
+        # consulta fora da thread do Tk; a grade é montada de volta na thread da UI (after)
+        self._log("⏳ Carregando...")
+
+        def runner():
+            if seq != self._filter_seq:
+                return  # já existe um filtro mais novo (ou a janela foi fechada)
+            try:
+                result = self._load_filters(payload, mode, rid)
+            except Exception as e:
+                def on_err():
+                    if seq != self._filter_seq:
+                        return
+                    messagebox.showerror("Erro", str(e), parent=self)
+                    self._log(f"❌ Falha ao aplicar filtro: {e}", level="err")
+                self._after_from_worker(on_err)
+                return
+            self._after_from_worker(lambda: self._on_filters_loaded(seq, mode, *result, staging_file=staging_file))
+
+        self._filter_queue.put(runner)
+
+    def _after_from_worker(self, fn) -> None:
+        try:
+            self.after(0, fn)
+        except Exception:
+            pass  # janela fechada enquanto a consulta rodava
+
+    def _load_filters(self, payload: dict, mode: str, rid: str):
+        """(df_f, df_c, auto_pairs, filhos por NRBRM, cache do Manual). Roda no worker: não toca em widgets."""
+        auto_pairs: list[tuple[int, int]] = []
+        manual_cache = None
+        con = self._worker_db()
+        try:
             if mode == "Manual":
                 df_f = load_pending_manual(con, "FIS", limit=MANUAL_MAX_ROWS, **payload)
                 df_c = load_pending_manual(con, "CTB", limit=MANUAL_MAX_ROWS, only_inc0=True, **payload)
+                manual_cache = {"payload": payload, "df_f": df_f, "df_c": df_c}
             else:
-                rid = (self.var_auto02_rule.get() or "").split(" - ")[0].strip()
-                if not rid:
-                    self._clear_tables()
-                    self._clear_pending()
-                    self._refresh_counts_only()
-                    return
                 df_f, df_c, _pairs = load_pairs_auto02(con, rid, limit_pairs=500, **payload)
                 auto_pairs = [(int(a), int(b)) for a, b in _pairs]
 
@@ -736,8 +951,33 @@ class ManualV2Window(tk.Toplevel):
                     except Exception:
                         pass
 
+            # incorporados (INC≠0) dos pais da grade, para o clique de pareamento
+            try:
+                parents = _int_column(df_c, "NRBRM")[_int_column(df_c, "INC") == 0]
+                children = find_children_ctb_ids_bulk(con, parents.tolist())
+            except Exception:
+                children = {}
+        finally:
+            # encerra a transação de leitura (no PostgreSQL ela ficaria aberta entre filtros)
+            try:
+                con.commit()
+            except Exception:
+                pass
+        return df_f, df_c, auto_pairs, children, manual_cache
+
+    def _on_filters_loaded(self, seq: int, mode: str, df_f: pd.DataFrame, df_c: pd.DataFrame,
+                           auto_pairs: list[tuple[int, int]], children: dict, manual_cache: dict | None,
+                           *, staging_file: Path | None = None):
+        if seq != self._filter_seq or not self.winfo_exists():
+            return  # resultado de um filtro já substituído
+        self._staging_file = staging_file
+        if manual_cache is not None:
+            self._manual_cache = manual_cache
+        self._ctb_children = children
+
         self.df_fis = df_f.reset_index(drop=True)
         self.df_ctb = df_c.reset_index(drop=True)
+        self._set_row_arrays()
 
         self._populate(self.tv_fis, self.df_fis, base="FIS")
         self._populate(self.tv_ctb, self.df_ctb, base="CTB")
@@ -745,6 +985,12 @@ class ManualV2Window(tk.Toplevel):
         if mode == "Automático (02)":
             self._stage_auto02_pairs(auto_pairs)
 
+        # staging da sessão anterior com este mesmo filtro (substitui o do Auto02; no Manual só entra se vazio)
+        if mode == "Automático (02)" or not self.pending_pairs:
+            restored = self._restore_staging()
+            if restored:
+                self._log(f"♻️ Staging retomado da sessão anterior: {restored} par(es).")
+
         self._refresh_counts_only()
 
         # LOG: resultado dos filtros
@@ -756,6 +1002,118 @@ class ManualV2Window(tk.Toplevel):
         elif mode == "Automático (02)" and auto_pairs and not self.pending_pairs:
             self._log("⚠️ Auto02 encontrou pares, mas não foi possível preparar o staging.", level="warn")
 
+    def _staging_path(self, mode: str, rid: str, payload: dict) -> Path:
+        key = json.dumps(
+            {"db": os.path.abspath(self.db_path), "mode": mode, "rid": rid, "filtros": payload},
+            sort_keys=True, ensure_ascii=False,
+        )
+        return _STAGING_DIR / f"staging-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.json"
+
+    def _save_staging(self) -> None:
+        """Grava os pendentes do filtro exibido (por ID; as linhas mudam entre sessões). Sem pendentes, apaga o arquivo."""
+        path = getattr(self, "_staging_file", None)
+        if path is None:
+            return
+        try:
+            if not self.pending_pairs:
+                path.unlink(missing_ok=True)
+                return
+            items = [
+                {
+                    "fis_id": int(it["fis_id"]),
+                    "ctb_id": int(it["ctb_id"]),
+                    "role": it.get("role", "PAI"),
+                    "batch": int(it.get("batch", 0) or 0),
+                    # ID da linha contábil do pai (o FILHO não aparece na grade)
+                    "ctb_row_id": self._pending_ctb_row_id(it),
+                }
+                for it in self.pending_pairs
+            ]
+            _STAGING_DIR.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(items), encoding="utf-8")
+        except Exception:
+            pass  # staging em disco é só conveniência
+
+    def _pending_ctb_row_id(self, it: dict) -> int:
+        if it.get("role") != "FILHO":
+            return int(it["ctb_id"])
+        row = int(it.get("ctb_row") or 0)
+        return int(self._ctb_ids[row]) if 0 <= row < len(self._ctb_ids) else 0
+
+    def _restore_staging(self) -> int:
+        """Recarrega (e consome) o staging gravado para o filtro atual; pares fora da grade são descartados."""
+        path = self._staging_file
+        if path is None or not path.is_file():
+            return 0
+        try:
+            items = json.loads(path.read_text(encoding="utf-8"))
+            path.unlink(missing_ok=True)
+        except Exception:
+            return 0
+        if not items or self.df_fis is None or self.df_ctb is None:
+            return 0
+
+        map_f, map_c = self._row_maps()
+        restored: list[dict] = []
+        for it in items:
+            row_f = map_f.get(int(it.get("fis_id") or 0))
+            row_c = map_c.get(int(it.get("ctb_row_id") or 0))
+            if row_f is None or row_c is None:
+                continue
+            restored.append(
+                {
+                    "fis_id": int(it["fis_id"]),
+                    "ctb_id": int(it["ctb_id"]),
+                    "role": it.get("role", "PAI"),
+                    "fis_row": row_f,
+                    "ctb_row": row_c,
+                    "batch": int(it.get("batch") or 0),
+                }
+            )
+        # nada casou com a grade atual: mantém o staging em tela (ex.: Auto02 recém-gerado)
+        if not restored:
+            return 0
+
+        self._clear_pending()
+        base_batch = self._batch_seq
+        for pair in restored:
+            pair["batch"] += base_batch
+            self._batch_seq = max(self._batch_seq, pair["batch"])
+            self._push_pending(pair)
+
+        rows_f = [p["fis_row"] for p in restored]
+        rows_c = [p["ctb_row"] for p in restored]
+        self._tag_pending_rows(self.tv_fis, rows_f, add=True)
+        self._tag_pending_rows(self.tv_ctb, rows_c, add=True)
+        self._rebuild_pending_listbox()
+        return len(self.pending_pairs)
+
+    def _refine_manual_cache(self, payload: dict):
+        """(df_f, df_c) filtrados em memória quando o novo filtro só acrescenta termos de descrição (modo E)
+        ao último consultado e aquele resultado veio completo (abaixo do limite); senão None."""
+        cache = self._manual_cache
+        if cache is None:
+            return None
+        prev = cache["payload"]
+        desc_keys = ("desc1", "desc2", "desc3", "desc_mode")
+        if any(prev[k] != payload[k] for k in prev if k not in desc_keys):
+            return None
+        if len(cache["df_f"]) >= MANUAL_MAX_ROWS or len(cache["df_c"]) >= MANUAL_MAX_ROWS:
+            return None
+
+        def _terms(p: dict):
+            terms = desc_terms_norm(p["desc1"], p["desc2"], p["desc3"])
+            is_and = len(terms) <= 1 or (p["desc_mode"] or "E").strip().upper() != "OU"
+            return terms, is_and
+
+        prev_terms, prev_and = _terms(prev)
+        terms, is_and = _terms(payload)
+        if not (prev_and and is_and) or not set(prev_terms) <= set(terms):
+            return None
+        if any("%" in t or "_" in t for t in terms):
+            return None  # curingas do LIKE: deixa para o SQL
+        return filter_desc_terms(cache["df_f"], terms), filter_desc_terms(cache["df_c"], terms)
+
     def _stage_auto02_pairs(self, pairs: list[tuple[int, int]]) -> None:
         # Recria staging do zero para refletir exatamente o resultado atual do Auto02.
         self._clear_pending()
@@ -764,53 +1122,41 @@ class ManualV2Window(tk.Toplevel):
         if self.df_fis is None or self.df_ctb is None or self.df_fis.empty or self.df_ctb.empty:
             return
 
-        def _id_map(df: pd.DataFrame) -> dict[int, int]:
-            out: dict[int, int] = {}
-            for i, (_, r) in enumerate(df.iterrows()):
-                try:
-                    rid = int(float(r.get("ID", 0) or 0))
-                except Exception:
-                    rid = 0
-                if rid > 0 and rid not in out:
-                    out[rid] = i
-            return out
-
-        map_f = _id_map(self.df_fis)
-        map_c = _id_map(self.df_ctb)
+        map_f, map_c = self._row_maps()
 
         self._batch_seq += 1
         batch = self._batch_seq
         added = 0
+        rows_f: list[int] = []
+        rows_c: list[int] = []
+
+        # mesma contagem do _push_pending, com os contadores em locais (laço de milhares de pares)
+        fis_ids, ctb_ids = self._fis_id_count, self._ctb_id_count
+        fis_rows, ctb_rows = self._fis_row_count, self._ctb_row_count
+        append = self.pending_pairs.append
 
         for fis_id, ctb_id in pairs:
-            row_f = map_f.get(int(fis_id))
-            row_c = map_c.get(int(ctb_id))
-            if row_f is None or row_c is None:
-                continue
-            if self._fis_id_count.get(int(fis_id), 0) > 0:
-                continue
-            if self._ctb_id_count.get(int(ctb_id), 0) > 0:
+            fis_id = int(fis_id)
+            ctb_id = int(ctb_id)
+            row_f = map_f.get(fis_id)
+            row_c = map_c.get(ctb_id)
+            if row_f is None or row_c is None or fis_ids[fis_id] or ctb_ids[ctb_id]:
                 continue
 
-            self.pending_pairs.append(
-                {
-                    "fis_id": int(fis_id),
-                    "ctb_id": int(ctb_id),
-                    "role": "PAI",
-                    "fis_row": int(row_f),
-                    "ctb_row": int(row_c),
-                    "batch": batch,
-                }
-            )
-            self._fis_id_count[int(fis_id)] = self._fis_id_count.get(int(fis_id), 0) + 1
-            self._ctb_id_count[int(ctb_id)] = self._ctb_id_count.get(int(ctb_id), 0) + 1
-            self._fis_row_count[int(row_f)] = self._fis_row_count.get(int(row_f), 0) + 1
-            self._ctb_row_count[int(row_c)] = self._ctb_row_count.get(int(row_c), 0) + 1
+            append({"fis_id": fis_id, "ctb_id": ctb_id, "role": "PAI", "fis_row": row_f, "ctb_row": row_c, "batch": batch})
+            fis_ids[fis_id] += 1
+            ctb_ids[ctb_id] += 1
+            fis_rows[row_f] += 1
+            ctb_rows[row_c] += 1
 
-            self.tv_fis.item(str(row_f), tags=("PENDING",))
-            self.tv_ctb.item(str(row_c), tags=("PENDING",))
+            rows_f.append(row_f)
+            rows_c.append(row_c)
             added += 1
 
+        # pinta tudo de uma vez (um comando Tcl por grade)
+        self._tag_pending_rows(self.tv_fis, rows_f, add=True)
+        self._tag_pending_rows(self.tv_ctb, rows_c, add=True)
+
         self._rebuild_pending_listbox()
         if added:
             self._log(f"🤖 Auto02 preparou {added} par(es) no staging.")
@@ -822,76 +1168,88 @@ class ManualV2Window(tk.Toplevel):
     # ---------- Data ----------
     def _refresh_counts_only(self):
         try:
-            with connect(self.db_path) as con:
-                c = get_counts(con)
+            c = get_counts(self._db())
             self.var_pf.set(str(c.fis))
             self.var_pc.set(str(c.ctb))
         except Exception:
             self.var_pf.set("0")
             self.var_pc.set("0")
+        finally:
+            self._end_ui_read()
 
     def _clear_tables(self):
         for tv in (self.tv_fis, self.tv_ctb):
+            self._cancel_populate(tv)
             tv.delete(*tv.get_children())
 
+    def _cancel_populate(self, tv: ttk.Treeview) -> None:
+        for key in (str(tv), f"{tv}:autosize"):
+            job = self._populate_jobs.pop(key, None)
+            if job is not None:
+                try:
+                    self.after_cancel(job)
+                except Exception:
+                    pass
+
+    @staticmethod
+    def _paint_pending(tv: ttk.Treeview, row: int) -> None:
+        # linha ainda não inserida (carga em lotes) sai pintada pelo próprio _populate_rows
+        if tv.exists(str(row)):
+            tv.item(str(row), tags=("PENDING",))
+
+    @staticmethod
+    def _tag_pending_rows(tv: ttk.Treeview, rows, *, add: bool) -> None:
+        """Liga/desliga a tag PENDING em várias linhas com um único 'tag add/remove' do Treeview."""
+        present = set(tv.get_children())
+        iids = [iid for iid in dict.fromkeys(str(r) for r in rows) if iid in present]
+        if not iids:
+            return
+        try:
+            tv.tk.call(str(tv), "tag", "add" if add else "remove", "PENDING", tuple(iids))
+        except tk.TclError:
+            for iid in iids:  # Tk sem 'tag add/remove' (< 8.6)
+                tv.item(iid, tags=("PENDING",) if add else ())
+
+    def _populate_rows(self, tv: ttk.Treeview, rows, start: int, *, base: str) -> None:
+        """Insere rows[start:start+step] e agenda o próximo lote; a grade responde entre os lotes."""
+        self._populate_jobs.pop(str(tv), None)
+        pending = self._fis_row_count if base == "FIS" else self._ctb_row_count
+        step = _POPULATE_FIRST if start == 0 else _POPULATE_STEP
+        end = min(len(rows), start + step)
+        insert = tv.insert
+        tag_pending = ("PENDING",)
+        for i in range(start, end):
+            insert("", "end", iid=str(i), values=rows[i], tags=tag_pending if i in pending else ())
+        if end < len(rows):
+            self._populate_jobs[str(tv)] = self.after(1, self._populate_rows, tv, rows, end, base=base)
+
     def _populate(self, tv: ttk.Treeview, df: pd.DataFrame, *, base: str):
+        self._cancel_populate(tv)
         tv.delete(*tv.get_children())
         if df is None or df.empty:
             return
 
-        def _val(x):
-            try:
-                if pd.isna(x):
-                    return ""
-            except Exception:
-                pass
-            return "" if x is None else x
-
-        for i, (_, r) in enumerate(df.iterrows()):
-            iid = str(i)
-
-            if base == "FIS":
-                values = (
-                    int(_val(r.get("ID", 0)) or 0),
-                    _val(r.get("FILIAL", "")),
-                    _val(r.get("CCUSTO", "")),
-                    _val(r.get("LOCAL", "")),
-                    _val(r.get("CONDIC", "")),
-                    _val(r.get("NRBRM", "")),
-                    _val(r.get("INC", "")),
-                    _clean_cell(_val(r.get("DESCRICAO", ""))),
-                    _val(r.get("MARCA", "")),
-                    _val(r.get("MODELO", "")),
-                    _val(r.get("SERIE", "")),
-                    _val(r.get("DIMENSAO", "")),
-                    _val(r.get("CAPACIDADE", "")),
-                    _val(r.get("TAG", "")),
-                )
-            else:
-                dt = _val(r.get("DT_AQUISICAO", ""))
-                dt = "" if dt is None else str(dt)
-                if len(dt) > 10:
-                    dt = dt[:10]
-                values = (
-                    int(_val(r.get("ID", 0)) or 0),
-                    _val(r.get("FILIAL", "")),
-                    _val(r.get("CCUSTO", "")),
-                    _val(r.get("LOCAL", "")),
-                    _val(r.get("NRBRM", "")),
-                    _val(r.get("INC", "")),
-                    _clean_cell(_val(r.get("DESCRICAO", ""))),
-                    _val(r.get("SERIE", "")),
-                    _val(r.get("TAG", "")),
-                    dt,
-                    _val(r.get("VLR_AQUISICAO", "")),
-                    _val(r.get("DEP_ACUMULADA", "")),
-                    _val(r.get("VLR_RESIDUAL", "")),
-                )
-
-            tv.insert("", "end", iid=iid, values=values)
-
+        # colunas da base na ordem da grade; ausentes/NaN viram ""
+        view = df.reindex(columns=list(_GRID_SOURCE[base])).astype(object)
+        view = view.where(view.notna(), "")
+        view["ID"] = _int_column(df, "ID")
+        if base != "FIS":
+            view["DT_AQUISICAO"] = view["DT_AQUISICAO"].astype(str).str[:10]
+        # células já como texto limpo (sem quebras de linha), numa passada por coluna:
+        # servem ao insert e ao autoajuste sem _clean_cell por célula; listas Python (str puro),
+        # convertidas uma vez, em vez de tuple(linha numpy) por insert
+        cells = view.astype(str).replace({"\n": " ", "\r": " "}, regex=True).to_numpy().tolist()
+
+        # primeira tela na hora; o restante em lotes pelo after() (sem congelar a janela)
+        self._populate_rows(tv, cells, 0, base=base)
+
+        # larguras depois que as linhas aparecerem (a grade desenha antes de medir)
+        self._populate_jobs[f"{tv}:autosize"] = self.after_idle(self._deferred_autosize, tv, cells)
+
+    def _deferred_autosize(self, tv: ttk.Treeview, cells) -> None:
+        self._populate_jobs.pop(f"{tv}:autosize", None)
         try:
-            self._autosize_columns(tv)
+            self._autosize_columns(tv, cells=cells)
         except Exception:
             pass
 
@@ -904,16 +1262,69 @@ class ManualV2Window(tk.Toplevel):
         return f"FIS {fis_id}  →  CTB {ctb_id}{suf}"
 
     def _rebuild_pending_listbox(self):
-        self.lb_pending.delete(0, tk.END)
-        for it in self.pending_pairs:
-            self.lb_pending.insert(tk.END, self._pending_label(it))
+        # lista inteira numa atribuição só (listvariable) em vez de um insert por par
+        self._lb_pending_var.set(tuple(self._pending_label(it) for it in self.pending_pairs))
+        self._pending_listbox_len = len(self.pending_pairs)
+        self.var_pp.set(str(len(self.pending_pairs)))
+
+    def _sync_pending_listbox(self):
+        """Acrescenta à listbox só os pares novos do fim de pending_pairs."""
+        n = self._pending_listbox_len
+        if n > len(self.pending_pairs):
+            self._rebuild_pending_listbox()
+            return
+        novos = [self._pending_label(it) for it in self.pending_pairs[n:]]
+        if novos:
+            self.lb_pending.insert(tk.END, *novos)
+        self._pending_listbox_len = len(self.pending_pairs)
         self.var_pp.set(str(len(self.pending_pairs)))
 
+    def _delete_pending_lines(self, indices: list[int]):
+        """Apaga da listbox as linhas `indices` (crescentes): um delete por trecho contíguo, do fim para o início."""
+        runs: list[list[int]] = []
+        for i in indices:
+            if runs and i == runs[-1][1] + 1:
+                runs[-1][1] = i
+            else:
+                runs.append([i, i])
+        for first, last in reversed(runs):
+            self.lb_pending.delete(first, last)
+        self._pending_listbox_len = len(self.pending_pairs)
+        self.var_pp.set(str(len(self.pending_pairs)))
+
+    def _push_pending(self, it: dict) -> None:
+        """Adiciona um par pendente e conta seus IDs/linhas (a pintura da linha fica com quem chama)."""
+        # itens já chegam com int Python (ver formato em __init__)
+        self.pending_pairs.append(it)
+        self._fis_id_count[it["fis_id"]] += 1
+        self._ctb_id_count[it["ctb_id"]] += 1
+        self._fis_row_count[it["fis_row"]] += 1
+        self._ctb_row_count[it["ctb_row"]] += 1
+
+    def _release_pending(self, it: dict) -> None:
+        """Desconta um par já retirado de pending_pairs; despinta a linha que não tiver mais pendências."""
+        fid, cid = it.get("fis_id") or 0, it.get("ctb_id") or 0
+        row_f, row_c = it.get("fis_row") or 0, it.get("ctb_row") or 0
+        for counts, key in ((self._fis_id_count, fid), (self._ctb_id_count, cid)):
+            if key and counts.get(key, 0) > 1:
+                counts[key] -= 1
+            else:
+                counts.pop(key, None)
+        for counts, key, tv in (
+            (self._fis_row_count, row_f, self.tv_fis),
+            (self._ctb_row_count, row_c, self.tv_ctb),
+        ):
+            if counts.get(key, 0) > 1:
+                counts[key] -= 1
+                continue
+            counts.pop(key, None)
+            if tv.exists(str(key)):
+                tv.item(str(key), tags=())
+
     def _clear_pending(self):
-        # despinta tudo
-        for tv in (self.tv_fis, self.tv_ctb):
-            for iid in tv.get_children():
-                tv.item(iid, tags=())
+        # despinta só as linhas com pendência
+        for tv, rows in ((self.tv_fis, self._fis_row_count), (self.tv_ctb, self._ctb_row_count)):
+            self._tag_pending_rows(tv, rows, add=False)
 
         self.pending_pairs.clear()
         self._fis_id_count.clear()
@@ -933,59 +1344,33 @@ class ManualV2Window(tk.Toplevel):
 
         # identifica o último lote
         try:
-            last_batch = max(int(it.get("batch", 0) or 0) for it in self.pending_pairs)
+            last_batch = max(it.get("batch") or 0 for it in self.pending_pairs)
         except Exception:
             last_batch = 0
 
+        # linhas removidas, para apagar só elas da listbox
         if last_batch == 0:
             # fallback: remove apenas o último item
-            to_remove = [self.pending_pairs[-1]]
+            removed_idx = [len(self.pending_pairs) - 1]
+            to_remove = [self.pending_pairs.pop()]
         else:
-            to_remove = [it for it in self.pending_pairs if int(it.get("batch", 0) or 0) == last_batch]
-
-        # remove do fim para não bagunçar índices (não dependemos de índice, mas é mais seguro)
-        removed_count = 0
-        for it in list(to_remove):
-            if it not in self.pending_pairs:
-                continue
-            self.pending_pairs.remove(it)
-            removed_count += 1
-
-            fis_id = int(it.get("fis_id") or 0)
-            ctb_id = int(it.get("ctb_id") or 0)
-            fis_row = int(it.get("fis_row") or 0)
-            ctb_row = int(it.get("ctb_row") or 0)
-
-            # decrementa contadores por ID
-            if fis_id:
-                self._fis_id_count[fis_id] = max(0, self._fis_id_count.get(fis_id, 0) - 1)
-                if self._fis_id_count[fis_id] == 0:
-                    self._fis_id_count.pop(fis_id, None)
-            if ctb_id:
-                self._ctb_id_count[ctb_id] = max(0, self._ctb_id_count.get(ctb_id, 0) - 1)
-                if self._ctb_id_count[ctb_id] == 0:
-                    self._ctb_id_count.pop(ctb_id, None)
-
-            # decrementa contadores por ROW (para manter o destaque azul enquanto houver algo pendente)
-            self._fis_row_count[fis_row] = max(0, self._fis_row_count.get(fis_row, 0) - 1)
-            if self._fis_row_count.get(fis_row, 0) == 0:
-                self._fis_row_count.pop(fis_row, None)
-                # despinta a linha do físico
-                try:
-                    self.tv_fis.item(str(fis_row), tags=())
-                except Exception:
-                    pass
-
-            self._ctb_row_count[ctb_row] = max(0, self._ctb_row_count.get(ctb_row, 0) - 1)
-            if self._ctb_row_count.get(ctb_row, 0) == 0:
-                self._ctb_row_count.pop(ctb_row, None)
-                # despinta a linha do contábil
-                try:
-                    self.tv_ctb.item(str(ctb_row), tags=())
-                except Exception:
-                    pass
-
-        self._rebuild_pending_listbox()
+            # uma passada: separa o lote dos demais (sem remove() item a item)
+            keep: list[dict] = []
+            to_remove = []
+            removed_idx = []
+            for i, it in enumerate(self.pending_pairs):
+                if (it.get("batch") or 0) == last_batch:
+                    removed_idx.append(i)
+                    to_remove.append(it)
+                else:
+                    keep.append(it)
+            self.pending_pairs[:] = keep
+
+        for it in to_remove:
+            self._release_pending(it)
+        removed_count = len(to_remove)
+
+        self._delete_pending_lines(removed_idx)
 
         if removed_count <= 0:
             self._log("⚠️ Nenhum par foi desfeito.", level="warn")
@@ -1002,34 +1387,10 @@ class ManualV2Window(tk.Toplevel):
             return
 
         it = self.pending_pairs.pop(idx)
-        fis_id = int(it["fis_id"])
-        ctb_id = int(it["ctb_id"])
-        fis_row = int(it["fis_row"])
-        ctb_row = int(it["ctb_row"])
-
-        # decrementa contadores de IDs
-        self._fis_id_count[fis_id] = max(0, self._fis_id_count.get(fis_id, 0) - 1)
-        if self._fis_id_count[fis_id] == 0:
-            del self._fis_id_count[fis_id]
-
-        self._ctb_id_count[ctb_id] = max(0, self._ctb_id_count.get(ctb_id, 0) - 1)
-        if self._ctb_id_count[ctb_id] == 0:
-            del self._ctb_id_count[ctb_id]
-
-        # decrementa contadores de linhas pintadas
-        self._fis_row_count[fis_row] = max(0, self._fis_row_count.get(fis_row, 0) - 1)
-        if self._fis_row_count.get(fis_row, 0) == 0:
-            self._fis_row_count.pop(fis_row, None)
-            if self.tv_fis.exists(str(fis_row)):
-                self.tv_fis.item(str(fis_row), tags=())
-
-        self._ctb_row_count[ctb_row] = max(0, self._ctb_row_count.get(ctb_row, 0) - 1)
-        if self._ctb_row_count.get(ctb_row, 0) == 0:
-            self._ctb_row_count.pop(ctb_row, None)
-            if self.tv_ctb.exists(str(ctb_row)):
-                self.tv_ctb.item(str(ctb_row), tags=())
+        self._release_pending(it)
 
-        self._rebuild_pending_listbox()
+        # apaga só a linha removida
+        self._delete_pending_lines([idx])
 
     # ---------- Pair actions ----------
     def _create_pair(self):
@@ -1048,9 +1409,14 @@ class ManualV2Window(tk.Toplevel):
             return
 
         try:
-            with connect(self.db_path) as con:
-                pairs_ids = [(int(it["fis_id"]), int(it["ctb_id"])) for it in self.pending_pairs]
+            con = self._db()
+            pairs_ids = [(int(it["fis_id"]), int(it["ctb_id"])) for it in self.pending_pairs]
+            try:
                 saved = save_manual_pairs(con, pairs_ids)
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
         except Exception as e:
             messagebox.showerror("Erro", str(e))
             return
@@ -1060,6 +1426,7 @@ class ManualV2Window(tk.Toplevel):
         self.focus_force()
 
         self._log(f"✅ Conciliação concluída. Pares conciliados: {saved}")
+        self._manual_cache = None  # pendentes mudaram: a próxima aplicação consulta o banco
         self._clear_pending()
         self._apply_filters()
 
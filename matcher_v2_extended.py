@@ -1,12 +1,19 @@
 # matcher_v2_extended.py (PG + SQLite compatível)
 from __future__ import annotations
 
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from functools import lru_cache
+from itertools import chain, repeat
+from typing import Dict, Tuple
 
+import json
+import sqlite3
+
+import numpy as np
 import pandas as pd
 
-from db_utils_v2 import connect, init_db
+from db_utils_v2 import connect_tuned, init_db
 
 
 @dataclass
@@ -17,6 +24,10 @@ class MatchStats:
     conciliados: int
 
 
+# Lote dos UPDATE ... IN (...): abaixo do limite antigo de 999 parâmetros do SQLite.
+_IN_CHUNK = 900
+
+
 # -----------------------------
 # Engine helpers
 # -----------------------------
@@ -24,7 +35,31 @@ def _is_postgres(conn) -> bool:
     return conn.__class__.__module__.startswith("psycopg2")
 
 
-def _table_columns(conn, table: str) -> set[str]:
+# Colunas por tabela, por conexão: id(conn) -> (conn, {tabela: colunas}). A conexão fica na
+# entrada para o id não ser confundido com o de uma conexão já fechada; guarda só as últimas.
+_COLS_CACHE: "OrderedDict[int, Tuple[object, Dict[str, frozenset]]]" = OrderedDict()
+_COLS_CACHE_MAX = 8
+
+
+def _cols_cache_entry(conn) -> Dict[str, frozenset]:
+    entry = _COLS_CACHE.get(id(conn))
+    if entry is None or entry[0] is not conn:
+        entry = (conn, {})
+        _COLS_CACHE[id(conn)] = entry
+        while len(_COLS_CACHE) > _COLS_CACHE_MAX:
+            _COLS_CACHE.popitem(last=False)
+    else:
+        _COLS_CACHE.move_to_end(id(conn))
+    return entry[1]
+
+
+def _table_columns(conn, table: str) -> frozenset:
+    # cada regra chama _col/_table_columns várias vezes; o schema não muda durante a execução
+    # (init_db roda antes da primeira leitura)
+    cache = _cols_cache_entry(conn)
+    cols = cache.get(table)
+    if cols is not None:
+        return cols
     cur = conn.cursor()
     if _is_postgres(conn):
         cur.execute(
@@ -35,10 +70,13 @@ def _table_columns(conn, table: str) -> set[str]:
             """,
             (table.lower(),),
         )
-        return {r[0] for r in cur.fetchall()}
+        cols = frozenset(r[0] for r in cur.fetchall())
     else:
         cur.execute(f"PRAGMA table_info({table});")
-        return {r[1] for r in cur.fetchall()}
+        cols = frozenset(r[1] for r in cur.fetchall())
+    if cols:
+        cache[table] = cols  # tabela ainda inexistente não fica em cache
+    return cols
 
 
 def _col(conn, table: str, preferred: str, fallbacks: Tuple[str, ...]) -> str:
@@ -81,6 +119,13 @@ def _read_pending(conn, table: str, base: str, cols: list[str]) -> pd.DataFrame:
     if has_frag:
         where_frag = f" AND COALESCE(t.{_qident(t_frag)}, '') <> 'Conciliado' "
 
+    # No SQLite conciliados.ID é TEXT: comparado direto com o ID inteiro da base, a afinidade
+    # numérica impede a busca por ID no índice (BASE, ID) e cada linha varre a BASE inteira.
+    # Com o ID já em texto o anti-join vira uma busca indexada por linha.
+    t_id_match = f"t.{_qident(t_id)}"
+    if isinstance(conn, sqlite3.Connection):
+        t_id_match = f"CAST({t_id_match} AS TEXT)"
+
     sql = f"""
     SELECT {select_list}
     FROM {_qident(table)} t
@@ -89,42 +134,138 @@ def _read_pending(conn, table: str, base: str, cols: list[str]) -> pd.DataFrame:
       AND NOT EXISTS (
         SELECT 1 FROM {_qident('conciliados')} c
         WHERE c.{_qident(c_base)} = {p}
-          AND c.{_qident(c_base_id)} = t.{_qident(t_id)}
+          AND c.{_qident(c_base_id)} = {t_id_match}
       )
     """
     df = pd.read_sql_query(sql, conn, params=tuple(params))
-    # normalize ID to int
-    if "ID" in df.columns:
-        df["ID"] = pd.to_numeric(df["ID"], errors="coerce").astype("Int64")
-        df = df.dropna(subset=["ID"])
+    # normalize ID to int: coluna INTEGER já chega int64 (o SQL exclui NULL); só converte o que vier
+    # como texto/float, e em int64 comum (Int64 nulável é mais lento nas chaves dos pareamentos)
+    if "ID" in df.columns and not pd.api.types.is_integer_dtype(df["ID"]):
+        ids = pd.to_numeric(df["ID"], errors="coerce")
+        df = df[ids.notna()].copy()
+        df["ID"] = ids[ids.notna()].astype("int64")
     return df
 
 
+def _strip_key(df: pd.DataFrame, key: str) -> pd.DataFrame:
+    """Chave como texto sem espaços nas pontas, já sem as vazias (um filtro, uma cópia)."""
+    s = df[key]
+    # coluna que já é texto dispensa o astype(str)
+    if not pd.api.types.is_string_dtype(s):
+        s = s.astype(str)
+    s = s.str.strip()
+    keep = s.ne("")
+    return df.loc[keep].assign(**{key: s[keep]})
+
+
 def _pair_1to1_by_value(df_f: pd.DataFrame, df_c: pd.DataFrame, left_key: str, right_key: str) -> pd.DataFrame:
-    df_f = df_f.copy()
-    df_c = df_c.copy()
+    """Pareia 1-para-1 por valor: dentro de cada chave, o n-ésimo FIS (por ID) com o n-ésimo CTB (por ID).
 
-    df_f["_rk"] = df_f.groupby(left_key)["ID"].rank(method="first").astype(int)
-    df_c["_rk"] = df_c.groupby(right_key)["ID"].rank(method="first").astype(int)
+    Ordinais por ordenação + corrida em arrays NumPy (sem groupby/rank/merge); a saída segue
+    a ordem das linhas de df_f, como o merge fazia.
+    """
+    codes, _ = pd.factorize(
+        pd.concat([df_f[left_key], df_c[right_key]], ignore_index=True), use_na_sentinel=False
+    )
+    codes = codes.astype(np.int64)
+    kf, kc = codes[: len(df_f)], codes[len(df_f):]
+
+    def _ranked(keys: np.ndarray, ids: pd.Series):
+        # posições ordenadas por (chave, ID) — estável, como rank(method="first") — e o ordinal na chave
+        order = np.lexsort((ids.to_numpy(dtype=np.float64, na_value=np.nan), keys))
+        k = keys[order]
+        n = len(k)
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]]) if n else np.empty(0, dtype=np.int64)
+        sizes = np.diff(np.r_[starts, n])
+        rank = np.arange(n) - np.repeat(starts, sizes)
+        return order, k, rank
+
+    pos_f, k_f, rank_f = _ranked(kf, df_f["ID"])
+    pos_c, k_c, rank_c = _ranked(kc, df_c["ID"])
+
+    # em cada chave saem min(qtd FIS, qtd CTB) pares: os primeiros de cada lado, na mesma ordem
+    n_codes = int(codes.max()) + 1 if len(codes) else 0
+    cnt_f = np.bincount(k_f, minlength=n_codes)
+    cnt_c = np.bincount(k_c, minlength=n_codes)
+    sel_f = pos_f[rank_f < cnt_c[k_f]]
+    sel_c = pos_c[rank_c < cnt_f[k_c]]
+
+    back = np.argsort(sel_f, kind="stable")
+    sel_f, sel_c = sel_f[back], sel_c[back]
+
+    def _take(df: pd.DataFrame, col: str, rows: np.ndarray) -> pd.Series:
+        return df[col].iloc[rows].reset_index(drop=True)
+
+    if "NRBRM" in df_f.columns:
+        nrbrm = _take(df_f, "NRBRM", sel_f)
+    elif "NRBRM" in df_c.columns:
+        nrbrm = _take(df_c, "NRBRM", sel_c)
+    else:
+        nrbrm = 0
+    if "INC" in df_c.columns:
+        inc = _take(df_c, "INC", sel_c)
+    elif "INC" in df_f.columns:
+        inc = _take(df_f, "INC", sel_f)
+    else:
+        inc = 0
 
-    m = df_f.merge(df_c, left_on=[left_key, "_rk"], right_on=[right_key, "_rk"], suffixes=("_F", "_C"))
     # standard output
     out = pd.DataFrame(
         {
-            "ID_FISICO": m["ID_F"],
-            "ID_CONTABIL": m["ID_C"],
-            "NRBRM": m.get("NRBRM_F", m.get("NRBRM", 0)),
-            "INC_CONTABIL": m.get("INC_C", m.get("INC", 0)),
+            "ID_FISICO": _take(df_f, "ID", sel_f),
+            "ID_CONTABIL": _take(df_c, "ID", sel_c),
+            "NRBRM": nrbrm,
+            "INC_CONTABIL": inc,
         }
     )
     return out
 
 
+@lru_cache(maxsize=8)
+def _pair_sql(cols_depara: frozenset, cols_conc: frozenset, pg: bool) -> Dict[str, str]:
+    """Nomes das colunas de depara/conciliados e os INSERTs do _bulk_insert_pairs.
+
+    Depende só do schema e do banco, então é montado uma vez por schema (e não a cada regra)."""
+    p = "%s" if pg else "?"
+    n = {
+        "par": "par_id" if "par_id" in cols_depara else "PAR_ID",
+        "st": "st_conciliacao" if "st_conciliacao" in cols_depara else "ST_CONCILIACAO",
+        "idf": "id_fisico" if "id_fisico" in cols_depara else "ID_FISICO",
+        "idc": "id_contabil" if "id_contabil" in cols_depara else "ID_CONTABIL",
+        "nr": "nrbrm" if "nrbrm" in cols_depara else "NRBRM",
+        "inc": "inc_contabil" if "inc_contabil" in cols_depara else "INC_CONTABIL",
+        "c_base": "base" if "base" in cols_conc else "BASE",
+        "c_base_id": "base_id" if "base_id" in cols_conc else "ID",
+        "c_par": "par_id" if "par_id" in cols_conc else ("PAR_ID" if "PAR_ID" in cols_conc else "par_id"),
+    }
+    n["ins_depara"] = f"""
+    INSERT INTO {_qident('depara')} ({_qident(n['par'])}, {_qident(n['st'])}, {_qident(n['idf'])}, {_qident(n['idc'])}, {_qident(n['nr'])}, {_qident(n['inc'])})
+    VALUES ({p},{p},{p},{p},{p},{p})
+    """
+    # insert conciliados (evita UNIQUE constraint BASE+ID)
+    conc_cols = f"{_qident(n['c_base'])}, {_qident(n['c_base_id'])}, {_qident(n['c_par'])}"
+    if pg:
+        n["ins_conc"] = f"""
+        INSERT INTO {_qident('conciliados')} ({conc_cols})
+        VALUES ({p},{p},{p})
+        ON CONFLICT ({_qident(n['c_base'])}, {_qident(n['c_base_id'])}) DO NOTHING
+        """
+    else:
+        n["ins_conc"] = f"""
+        INSERT OR IGNORE INTO {_qident('conciliados')} ({conc_cols})
+        VALUES ({p},{p},{p})
+        """
+    return n
+
+
+def _pair_schema(conn) -> Dict[str, str]:
+    return _pair_sql(_table_columns(conn, "depara"), _table_columns(conn, "conciliados"), _is_postgres(conn))
+
+
 def _next_par_id(conn) -> int:
     # SQLite: MAX(PAR_ID)+1; PG: MAX(par_id)+1 (both work with quoting)
     cur = conn.cursor()
-    cols = _table_columns(conn, "depara")
-    par_col = "par_id" if "par_id" in cols else ("PAR_ID" if "PAR_ID" in cols else "par_id")
+    par_col = _pair_schema(conn)["par"]
     cur.execute(f"SELECT COALESCE(MAX({_qident(par_col)}), 0) + 1 FROM {_qident('depara')};")
     return int(cur.fetchone()[0] or 1)
 
@@ -135,19 +276,8 @@ def _bulk_insert_pairs(conn, pairs: pd.DataFrame, st: str) -> int:
 
     init_db(conn)
 
-    cols_depara = _table_columns(conn, "depara")
-    # choose target columns
-    par_col = "par_id" if "par_id" in cols_depara else "PAR_ID"
-    st_col = "st_conciliacao" if "st_conciliacao" in cols_depara else "ST_CONCILIACAO"
-    idf_col = "id_fisico" if "id_fisico" in cols_depara else "ID_FISICO"
-    idc_col = "id_contabil" if "id_contabil" in cols_depara else "ID_CONTABIL"
-    nr_col = "nrbrm" if "nrbrm" in cols_depara else "NRBRM"
-    inc_col = "inc_contabil" if "inc_contabil" in cols_depara else "INC_CONTABIL"
-
-    cols_conc = _table_columns(conn, "conciliados")
-    c_base = "base" if "base" in cols_conc else "BASE"
-    c_base_id = "base_id" if "base_id" in cols_conc else "ID"
-    c_par = "par_id" if "par_id" in cols_conc else ("PAR_ID" if "PAR_ID" in cols_conc else "par_id")
+    # choose target columns (e os INSERTs já montados para este schema)
+    sch = _pair_schema(conn)
 
     start = _next_par_id(conn)
     pstyle = _paramstyle(conn)
@@ -161,35 +291,34 @@ def _bulk_insert_pairs(conn, pairs: pd.DataFrame, st: str) -> int:
     pairs["ID_FISICO"] = pd.to_numeric(pairs["ID_FISICO"], errors="coerce").fillna(0).astype(int)
     pairs["ID_CONTABIL"] = pd.to_numeric(pairs["ID_CONTABIL"], errors="coerce").astype(int)
 
-    depara_rows = []
-    conc_rows = []
-    for i, r in enumerate(pairs.itertuples(index=False)):
-        par = start + i
-        depara_rows.append((par, st, int(r.ID_FISICO), int(r.ID_CONTABIL), int(r.NRBRM), int(r.INC_CONTABIL)))
-        if int(r.ID_FISICO) > 0:
-            conc_rows.append(("FIS", int(r.ID_FISICO), par))
-        conc_rows.append(("CTB", int(r.ID_CONTABIL), par))
+    # linhas montadas por coluna (tolist() devolve int Python, sem int() por célula)
+    idf = pairs["ID_FISICO"].to_numpy(dtype=np.int64)
+    idc = pairs["ID_CONTABIL"].to_numpy(dtype=np.int64)
+    pars = np.arange(start, start + len(idf), dtype=np.int64)
+    has_f = idf > 0
+    pars_l, idf_l, idc_l = pars.tolist(), idf.tolist(), idc.tolist()
+
+    # tuplas geradas sob demanda pelo executemany (sqlite3 e execute_batch aceitam iteráveis),
+    # sem listas intermediárias de linhas
+    depara_rows = zip(
+        pars_l,
+        repeat(st),
+        idf_l,
+        idc_l,
+        pairs["NRBRM"].to_numpy(dtype=np.int64).tolist(),
+        pairs["INC_CONTABIL"].to_numpy(dtype=np.int64).tolist(),
+    )
+    # FIS e CTB em blocos; dentro de cada base a ordem dos pares é a mesma (o INSERT OR IGNORE mantém o 1º)
+    conc_rows = chain(
+        zip(repeat("FIS"), idf[has_f].tolist(), pars[has_f].tolist()),
+        zip(repeat("CTB"), idc_l, pars_l),
+    )
 
     # insert depara
-    ins_depara = f"""
-    INSERT INTO {_qident('depara')} ({_qident(par_col)}, {_qident(st_col)}, {_qident(idf_col)}, {_qident(idc_col)}, {_qident(nr_col)}, {_qident(inc_col)})
-    VALUES ({pstyle},{pstyle},{pstyle},{pstyle},{pstyle},{pstyle})
-    """
-    cur.executemany(ins_depara, depara_rows)
+    cur.executemany(sch["ins_depara"], depara_rows)
 
-        # insert conciliados (evita UNIQUE constraint BASE+ID)
-    if _is_postgres(conn):
-        ins_conc = f"""
-        INSERT INTO {_qident('conciliados')} ({_qident(c_base)}, {_qident(c_base_id)}, {_qident(c_par)})
-        VALUES ({pstyle},{pstyle},{pstyle})
-        ON CONFLICT ({_qident(c_base)}, {_qident(c_base_id)}) DO NOTHING
-        """
-    else:
-        ins_conc = f"""
-        INSERT OR IGNORE INTO {_qident('conciliados')} ({_qident(c_base)}, {_qident(c_base_id)}, {_qident(c_par)})
-        VALUES ({pstyle},{pstyle},{pstyle})
-        """
-    cur.executemany(ins_conc, conc_rows)
+    # insert conciliados (evita UNIQUE constraint BASE+ID)
+    cur.executemany(sch["ins_conc"], conc_rows)
 
     # also mark FRAG when present (helps export/visual)
     for table, base, ids in (("fisico", "FIS", [i for i in pairs["ID_FISICO"].tolist() if int(i) > 0]), ("contabil", "CTB", pairs["ID_CONTABIL"].tolist())):
@@ -197,15 +326,22 @@ def _bulk_insert_pairs(conn, pairs: pd.DataFrame, st: str) -> int:
         frag = "frag" if "frag" in tcols else ("FRAG" if "FRAG" in tcols else None)
         tid = "id" if "id" in tcols else ("ID" if "ID" in tcols else "id")
         if frag:
-            # UPDATE ... WHERE id IN (...)
             if not ids:
                 continue
-            # chunk to avoid huge SQL
-            for k in range(0, len(ids), 5000):
-                chunk = ids[k:k+5000]
-                placeholders = ",".join([pstyle]*len(chunk))
-                sql_upd = f"UPDATE {_qident(table)} SET {_qident(frag)}='Conciliado' WHERE {_qident(tid)} IN ({placeholders});"
-                cur.execute(sql_upd, tuple(chunk))
+            sql_upd = f"UPDATE {_qident(table)} SET {_qident(frag)}='Conciliado' WHERE {_qident(tid)}"
+            ids = [int(i) for i in ids]
+            if isinstance(conn, sqlite3.Connection):
+                # um UPDATE só: a lista vai como um parâmetro JSON
+                cur.execute(f"{sql_upd} IN (SELECT value FROM json_each({pstyle}));", (json.dumps(ids),))
+            elif _is_postgres(conn) or getattr(conn, "_evs_backend", "") == "postgres":
+                # um UPDATE só: a lista vira um array do PostgreSQL
+                cur.execute(f"{sql_upd} = ANY({pstyle});", (ids,))
+            else:
+                # chunk to avoid huge SQL
+                for k in range(0, len(ids), _IN_CHUNK):
+                    chunk = ids[k:k+_IN_CHUNK]
+                    placeholders = ",".join([pstyle]*len(chunk))
+                    cur.execute(f"{sql_upd} IN ({placeholders});", tuple(chunk))
 
     conn.commit()
     return len(pairs)
@@ -216,7 +352,7 @@ def _bulk_insert_pairs(conn, pairs: pd.DataFrame, st: str) -> int:
 # =========================================================
 def run_regra_nrbrm_pai(db_path: str) -> MatchStats:
     st = "NRBEM_FIS=NRBEM_CTB"
-    con = connect(db_path)
+    con = connect_tuned(db_path)
     try:
         init_db(con)
 
@@ -249,7 +385,7 @@ def run_regra_nrbrm_pai(db_path: str) -> MatchStats:
 
 def run_regra_bem_ant_fis_eq_nrbrm_ctb(db_path: str) -> MatchStats:
     st = "BEMANT_FIS=NRBEM_CTB"
-    con = connect(db_path)
+    con = connect_tuned(db_path)
     try:
         init_db(con)
         df_f = _read_pending(con, "fisico", "FIS", ["ID", "BEM_ANTERIOR"])
@@ -279,7 +415,7 @@ def run_regra_bem_ant_fis_eq_nrbrm_ctb(db_path: str) -> MatchStats:
 
 def run_regra_nrbrm_fis_eq_bem_ant_ctb(db_path: str) -> MatchStats:
     st = "NRBRM_FIS=NRBEM_CTB"
-    con = connect(db_path)
+    con = connect_tuned(db_path)
     try:
         init_db(con)
         df_f = _read_pending(con, "fisico", "FIS", ["ID", "NRBRM"])
@@ -307,7 +443,7 @@ def run_regra_nrbrm_fis_eq_bem_ant_ctb(db_path: str) -> MatchStats:
 
 
 def run_regra_exata(db_path: str, key: str, st: str, ctb_inc0_only: bool = False) -> MatchStats:
-    con = connect(db_path)
+    con = connect_tuned(db_path)
     try:
         init_db(con)
         df_f = _read_pending(con, "fisico", "FIS", ["ID", key])
@@ -315,10 +451,8 @@ def run_regra_exata(db_path: str, key: str, st: str, ctb_inc0_only: bool = False
         cand_f, cand_c = len(df_f), len(df_c)
 
         # normalize key (string) and exclude empty
-        df_f[key] = df_f[key].astype(str).str.strip()
-        df_c[key] = df_c[key].astype(str).str.strip()
-        df_f = df_f.loc[df_f[key] != ""].copy()
-        df_c = df_c.loc[df_c[key] != ""].copy()
+        df_f = _strip_key(df_f, key)
+        df_c = _strip_key(df_c, key)
 
         df_c["INC"] = pd.to_numeric(df_c["INC"], errors="coerce").fillna(0).astype(int)
         if ctb_inc0_only:
@@ -338,25 +472,19 @@ def run_regra_exata(db_path: str, key: str, st: str, ctb_inc0_only: bool = False
 
 def run_propagacao_incorporados(db_path: str) -> MatchStats:
     st = "CA - INC"
-    con = connect(db_path)
+    con = connect_tuned(db_path)
     try:
         init_db(con)
-        cols_depara = _table_columns(con, "depara")
-        par_col = "par_id" if "par_id" in cols_depara else "PAR_ID"
-        st_col = "st_conciliacao" if "st_conciliacao" in cols_depara else "ST_CONCILIACAO"
-        idf_col = "id_fisico" if "id_fisico" in cols_depara else "ID_FISICO"
-        idc_col = "id_contabil" if "id_contabil" in cols_depara else "ID_CONTABIL"
-        nr_col = "nrbrm" if "nrbrm" in cols_depara else "NRBRM"
-        inc_col = "inc_contabil" if "inc_contabil" in cols_depara else "INC_CONTABIL"
+        sch = _pair_schema(con)
 
         # pais conciliados (inc_contabil==0) e do automático
         df_pais = pd.read_sql_query(
             f"""
-            SELECT COALESCE({_qident(idf_col)}, 0) AS "ID_FISICO",
-                   {_qident(idc_col)} AS "ID_CONTABIL",
-                   {_qident(nr_col)} AS "NRBRM"
+            SELECT COALESCE({_qident(sch['idf'])}, 0) AS "ID_FISICO",
+                   {_qident(sch['idc'])} AS "ID_CONTABIL",
+                   {_qident(sch['nr'])} AS "NRBRM"
             FROM {_qident('depara')}
-            WHERE COALESCE({_qident(inc_col)}, 0) = 0
+            WHERE COALESCE({_qident(sch['inc'])}, 0) = 0
               """,
             con,
         )
@@ -381,7 +509,13 @@ def run_propagacao_incorporados(db_path: str) -> MatchStats:
         if df_pais.empty or df_filhos.empty:
             return MatchStats(st, cand_f, cand_c, 0)
 
-        m = df_filhos.merge(df_pais[["ID_FISICO", "NRBRM"]], on="NRBRM", how="inner")
+        if df_pais["NRBRM"].is_unique:
+            # um pai por NrBrm (caso comum): busca por hash no índice, sem montar o merge
+            pai_of = pd.Series(df_pais["ID_FISICO"].to_numpy(), index=df_pais["NRBRM"].to_numpy())
+            id_pai = df_filhos["NRBRM"].map(pai_of)
+            m = df_filhos.loc[id_pai.notna()].assign(ID_FISICO=id_pai[id_pai.notna()])
+        else:
+            m = df_filhos.merge(df_pais[["ID_FISICO", "NRBRM"]], on="NRBRM", how="inner")
         if m.empty:
             return MatchStats(st, cand_f, cand_c, 0)
 
@@ -3,7 +3,7 @@
 # Migrate EVS SQLite (conciliador.db) -> PostgreSQL local (evs_conciliador)
 #
 # Usage:
-#   python migrate_sqlite_to_pg.py --sqlite conciliador.db --drop
+#   python migrate_sqlite_to_pg.py --sqlite conciliador.db --drop [--jobs N]
 #
 # Env for PG connection:
 #   EVS_PG_HOST, EVS_PG_PORT, EVS_PG_DB, EVS_PG_USER, EVS_PG_PASSWORD
@@ -11,11 +11,16 @@
 from __future__ import annotations
 
 import argparse
+import io
+import os
 import sqlite3
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from decimal import Decimal
+from typing import List, Optional, Tuple
 
 import psycopg2
 import psycopg2.extras
+from psycopg2 import sql
 
 from db_utils_pg import PgConfig, init_pg, ensure_table_columns, create_indexes
 
@@ -35,18 +40,66 @@ def _sqlite_table_cols(conn: sqlite3.Connection, table: str) -> List[str]:
 def _pg_drop_tables(pg, tables: List[str]) -> None:
     with pg.cursor() as cur:
         for t in tables:
-            cur.execute(f'DROP TABLE IF EXISTS "{t}" CASCADE;')
+            cur.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE;").format(sql.Identifier(t)))
         cur.execute("DROP TABLE IF EXISTS conciliados CASCADE;")
     pg.commit()
 
 
-def _copy_table(sqlite_conn: sqlite3.Connection, pg, table: str, batch_size: int = 5000) -> int:
+# COPY text format: backslash, tab and newlines must be escaped; NULL is \N
+_COPY_ESCAPE = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _float_text(v: float) -> str:
+    # execute_values sent repr(v) as a numeric literal, so TEXT columns got numeric's text form
+    # (no exponent): keep the same output
+    r = repr(v)
+    return format(Decimal(r), "f") if "e" in r else r
+
+
+def _copy_rows(buf: io.StringIO, rows: List[Tuple]) -> bool:
+    """Write rows to buf as COPY text lines. Returns False if a value can't be sent as text (BLOBs)."""
+    buf.seek(0)
+    buf.truncate()
+    write = buf.write
+    for row in rows:
+        fields = []
+        for v in row:
+            if v is None:
+                fields.append("\\N")
+            elif isinstance(v, str):
+                fields.append(v.translate(_COPY_ESCAPE))
+            elif isinstance(v, (bytes, memoryview)):
+                return False
+            else:
+                fields.append(_float_text(v) if isinstance(v, float) else str(v))
+        write("\t".join(fields))
+        write("\n")
+    buf.seek(0)
+    return True
+
+
+# COPY chunk target (~1 MB of text per batch) and the bounds for the derived row count
+_COPY_CHUNK_BYTES = 1_000_000
+_BATCH_MIN, _BATCH_MAX = 500, 50000
+
+
+def _batch_for(rows: List[Tuple]) -> int:
+    """Rows per batch so each COPY chunk is ~_COPY_CHUNK_BYTES, from a sample's average row width."""
+    width = sum(len(str(v)) + 1 for row in rows for v in row if v is not None) / max(1, len(rows))
+    return max(_BATCH_MIN, min(_BATCH_MAX, int(_COPY_CHUNK_BYTES // max(1.0, width))))
+
+
+def _copy_table(sqlite_conn: sqlite3.Connection, pg, table: str, batch_size: Optional[int] = None) -> int:
     cols = _sqlite_table_cols(sqlite_conn, table)
     if not cols:
         return 0
 
+    # identifiers quoted by psycopg2 (embedded quotes included); statements composed once per table
+    ident = sql.Identifier(table)
+    col_list = sql.SQL(", ").join(map(sql.Identifier, cols))
+
     with pg.cursor() as cur:
-        cur.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (__dummy__ TEXT);')
+        cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} (__dummy__ TEXT);").format(ident))
         ensure_table_columns(cur, table, cols)
     pg.commit()
 
@@ -54,23 +107,48 @@ def _copy_table(sqlite_conn: sqlite3.Connection, pg, table: str, batch_size: int
     select_cols = ", ".join([f'"{c}"' for c in cols])
     scur.execute(f'SELECT {select_cols} FROM "{table}"')
 
-    insert_cols = ", ".join([f'"{c}"' for c in cols])
-    insert_sql = f'INSERT INTO "{table}" ({insert_cols}) VALUES %s'
+    insert_sql = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(ident, col_list).as_string(pg)
+    # COPY skips the SQL parser/planner per batch; execute_values stays for batches with BLOBs
+    copy_sql = sql.SQL("COPY {} ({}) FROM STDIN").format(ident, col_list).as_string(pg)
+
+    # no fixed batch: size it from the first rows (wide tables get fewer rows per COPY)
+    rows = scur.fetchmany(batch_size or _BATCH_MIN)
+    if batch_size is None:
+        batch_size = _batch_for(rows)
 
     inserted = 0
+    buf = io.StringIO()
     with pg.cursor() as cur:
-        while True:
-            rows = scur.fetchmany(batch_size)
-            if not rows:
-                break
-            psycopg2.extras.execute_values(cur, insert_sql, rows, page_size=batch_size)
+        while rows:
+            if _copy_rows(buf, rows):
+                cur.copy_expert(copy_sql, buf)
+            else:
+                psycopg2.extras.execute_values(cur, insert_sql, rows, page_size=batch_size)
             inserted += len(rows)
+            rows = scur.fetchmany(batch_size)
     pg.commit()
     return inserted
 
 
-def _migrate_conciliados(sqlite_conn: sqlite3.Connection, pg) -> int:
-    tables = set(_sqlite_tables(sqlite_conn))
+def _copy_table_worker(sqlite_path: str, dsn: str, table: str) -> int:
+    """Copy one table on its own SQLite/PG connections (runs in a worker process)."""
+    sqlite_conn = sqlite3.connect(sqlite_path)
+    pg = psycopg2.connect(dsn)
+    try:
+        with pg.cursor() as cur:
+            # bulk load: no need to wait for the WAL flush on every commit
+            cur.execute("SET synchronous_commit = off;")
+        return _copy_table(sqlite_conn, pg, table)
+    finally:
+        pg.close()
+        sqlite_conn.close()
+
+
+def _migrate_conciliados(sqlite_conn: sqlite3.Connection, pg, tables: Optional[List[str]] = None,
+                         batch_size: int = 50000) -> int:
+    # migrate() passes the table list it already read from sqlite_master
+    if tables is None:
+        tables = _sqlite_tables(sqlite_conn)
     if "conciliados" not in tables:
         return 0
 
@@ -86,8 +164,8 @@ def _migrate_conciliados(sqlite_conn: sqlite3.Connection, pg) -> int:
 
     scur = sqlite_conn.cursor()
     scur.execute(f'SELECT "{base_col}", "{id_col}" FROM "conciliados"')
-    rows = scur.fetchall()
 
+    total = 0
     with pg.cursor() as cur:
         cur.execute('''
             CREATE TABLE IF NOT EXISTS conciliados(
@@ -96,17 +174,48 @@ def _migrate_conciliados(sqlite_conn: sqlite3.Connection, pg) -> int:
                 PRIMARY KEY (BASE, BASE_ID)
             );
         ''')
-        psycopg2.extras.execute_values(
-            cur,
-            "INSERT INTO conciliados(BASE, BASE_ID) VALUES %s ON CONFLICT DO NOTHING",
-            rows,
-            page_size=5000,
+        # COPY can't skip conflicts: stage the rows in a temp table, then one set-based INSERT.
+        # Rows are streamed batch by batch (fetchmany), never all held in Python at once.
+        cur.execute("CREATE TEMP TABLE _conc_stage(BASE TEXT, BASE_ID TEXT) ON COMMIT DROP;")
+        buf = io.StringIO()
+        while True:
+            rows = scur.fetchmany(batch_size)
+            if not rows:
+                break
+            if _copy_rows(buf, rows):
+                cur.copy_expert("COPY _conc_stage(BASE, BASE_ID) FROM STDIN", buf)
+            else:
+                psycopg2.extras.execute_values(
+                    cur,
+                    "INSERT INTO conciliados(BASE, BASE_ID) VALUES %s ON CONFLICT DO NOTHING",
+                    rows,
+                    page_size=5000,
+                )
+            total += len(rows)
+        cur.execute(
+            "INSERT INTO conciliados(BASE, BASE_ID) "
+            "SELECT DISTINCT BASE, BASE_ID FROM _conc_stage ON CONFLICT DO NOTHING"
         )
     pg.commit()
-    return len(rows)
+    return total
 
 
-def migrate(sqlite_path: str, drop_and_recreate: bool = False) -> None:
+def _restore_logged(pg, tables: List[str]) -> None:
+    """SET LOGGED on `tables` in a fresh transaction; raises naming the tables left UNLOGGED."""
+    try:
+        pg.rollback()
+        with pg.cursor() as cur:
+            for t in tables:
+                cur.execute(sql.SQL("ALTER TABLE {} SET LOGGED;").format(sql.Identifier(t)))
+        pg.commit()
+    except Exception as e:
+        raise RuntimeError(
+            f"[EVS] Could not switch tables back to LOGGED: {', '.join(tables)}. "
+            f"Run ALTER TABLE ... SET LOGGED on them manually. ({e})"
+        ) from e
+
+
+def migrate(sqlite_path: str, drop_and_recreate: bool = False, jobs: int = 0) -> None:
     cfg = PgConfig.from_env()
 
     # Ensure schema exists (will raise helpful error if privileges missing)
@@ -115,28 +224,61 @@ def migrate(sqlite_path: str, drop_and_recreate: bool = False) -> None:
     sqlite_conn = sqlite3.connect(sqlite_path)
     with psycopg2.connect(cfg.dsn()) as pg:
         pg.autocommit = False
+        with pg.cursor() as cur:
+            # bulk load: commits don't wait for the WAL flush
+            cur.execute("SET synchronous_commit = off;")
+        pg.commit()
 
+        unlogged: List[str] = []
         if drop_and_recreate:
             _pg_drop_tables(pg, ["BsFisico", "BsContabil", "BsDePara"])
             init_pg(cfg)
-
-        tables = _sqlite_tables(sqlite_conn)
-        order = [t for t in ["BsFisico", "BsContabil", "BsDePara"] if t in tables]
-        others = [t for t in tables if t not in order and not t.startswith("sqlite_") and t != "conciliados"]
-
-        print(f"[EVS] SQLite tables: {len(tables)}. Migrating: {order + others} + conciliados")
-
-        for t in order + others:
-            n = _copy_table(sqlite_conn, pg, t)
-            print(f"[EVS] Migrated {t}: {n}")
-
-        nconc = _migrate_conciliados(sqlite_conn, pg)
-        if nconc:
-            print(f"[EVS] Migrated conciliados: {nconc}")
-
-        with pg.cursor() as cur:
-            create_indexes(cur)
-        pg.commit()
+            # freshly recreated (empty): load them without WAL and switch back to LOGGED at the end
+            unlogged = ["BsFisico", "BsContabil", "BsDePara"]
+            with pg.cursor() as cur:
+                for t in unlogged:
+                    cur.execute(sql.SQL("ALTER TABLE {} SET UNLOGGED;").format(sql.Identifier(t)))
+            pg.commit()
+
+        try:
+            tables = _sqlite_tables(sqlite_conn)
+            order = [t for t in ["BsFisico", "BsContabil", "BsDePara"] if t in tables]
+            others = [t for t in tables if t not in order and not t.startswith("sqlite_") and t != "conciliados"]
+
+            print(f"[EVS] SQLite tables: {len(tables)}. Migrating: {order + others} + conciliados")
+
+            # one process (and one PG connection) per table: the COPY streams run side by side
+            to_copy = order + others
+            workers = min(len(to_copy), jobs or os.cpu_count() or 1)
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futs = {pool.submit(_copy_table_worker, sqlite_path, cfg.dsn(), t): t for t in to_copy}
+                    for fut in as_completed(futs):
+                        print(f"[EVS] Migrated {futs[fut]}: {fut.result()}")
+            else:
+                for t in to_copy:
+                    n = _copy_table(sqlite_conn, pg, t)
+                    print(f"[EVS] Migrated {t}: {n}")
+
+            nconc = _migrate_conciliados(sqlite_conn, pg, tables)
+            if nconc:
+                print(f"[EVS] Migrated conciliados: {nconc}")
+
+            # back to LOGGED before the index builds: SET LOGGED rewrites the heap and every index
+            if unlogged:
+                to_log, unlogged = unlogged, []
+                _restore_logged(pg, to_log)
+
+            # indexes only now, over the loaded heap: more sort memory and parallel workers for the builds
+            with pg.cursor() as cur:
+                cur.execute("SET LOCAL maintenance_work_mem = '1GB';")
+                cur.execute("SET LOCAL max_parallel_maintenance_workers = 4;")
+                create_indexes(cur)
+            pg.commit()
+        finally:
+            # failure before the switch above: an UNLOGGED table is truncated on crash recovery
+            if unlogged:
+                _restore_logged(pg, unlogged)
 
     sqlite_conn.close()
     print("[EVS] Done.")
@@ -146,8 +288,9 @@ def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--sqlite", required=True, help="Path to SQLite file (conciliador.db)")
     ap.add_argument("--drop", action="store_true", help="Drop and recreate EVS tables in Postgres")
+    ap.add_argument("--jobs", type=int, default=0, help="Tables copied in parallel (default: CPU count)")
     args = ap.parse_args()
-    migrate(args.sqlite, drop_and_recreate=args.drop)
+    migrate(args.sqlite, drop_and_recreate=args.drop, jobs=args.jobs)
 
 
 if __name__ == "__main__":
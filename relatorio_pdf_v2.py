@@ -21,44 +21,63 @@ nas tabelas BsContabil / BsFisico / BsDePara.
 
 from __future__ import annotations
 
+import io
 import os
 import sqlite3
 from datetime import datetime
 from typing import Any, Dict, Optional, Tuple, List
 from db_utils_v2 import connect
 
-# PDF
-try:
-    # PDF (opcional — o sistema deve abrir mesmo sem reportlab)
-    from reportlab.lib.pagesizes import A4, landscape
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.utils import ImageReader
-    from reportlab.lib.units import mm
-except Exception:  # pragma: no cover
-    A4 = landscape = canvas = ImageReader = mm = None
+# PDF (opcional — o sistema deve abrir mesmo sem reportlab)
+# reportlab e matplotlib só são importados ao gerar o relatório (import deste módulo fica leve)
+A4 = landscape = canvas = ImageReader = mm = None
 
 def _ensure_reportlab() -> None:
-    if A4 is None or landscape is None or canvas is None or ImageReader is None or mm is None:
+    global A4, landscape, canvas, ImageReader, mm
+    if A4 is not None:
+        return
+    try:
+        from reportlab.lib.pagesizes import A4 as _A4, landscape as _landscape
+        from reportlab.pdfgen import canvas as _canvas
+        from reportlab.lib.utils import ImageReader as _ImageReader
+        from reportlab.lib.units import mm as _mm
+    except Exception:  # pragma: no cover
         raise RuntimeError(
             "Biblioteca 'reportlab' não está instalada.\n\n"
             "Para habilitar o PDF, instale com:\n"
             "  python -m pip install reportlab\n\n"
             "Depois, reabra o sistema."
-        )
+        ) from None
+    landscape, canvas, ImageReader, mm = _landscape, _canvas, _ImageReader, _mm
+    A4 = _A4
 
 # Gráficos (opcional, mas normalmente disponível)
-try:
-    import matplotlib.pyplot as plt
-except Exception:  # pragma: no cover
-    plt = None
+# API orientada a objetos com o canvas Agg: sem pyplot (estado global) e sem trocar o
+# backend do processo, que o dashboard usa com TkAgg
+Figure = FigureCanvasAgg = None
+
+def _load_matplotlib() -> bool:
+    global Figure, FigureCanvasAgg
+    if Figure is None:
+        try:
+            from matplotlib.figure import Figure as _Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg as _FigureCanvasAgg
+        except Exception:  # pragma: no cover
+            return False
+        FigureCanvasAgg = _FigureCanvasAgg
+        Figure = _Figure
+    return True
 
 
 # -----------------------------
 # Helpers de formatação (pt-BR)
 # -----------------------------
+# troca , <-> . numa passada só (sem o coringa "X")
+_BR_TRANS = str.maketrans({",": ".", ".": ","})
+
 def _br_money(v: float) -> str:
     try:
-        s = f"{v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+        s = f"{v:,.2f}".translate(_BR_TRANS)
         return f"R$ {s}"
     except Exception:
         return f"R$ {v}"
@@ -80,34 +99,54 @@ def _br_pct(ratio: float) -> str:
 # SQLite utils
 # -----------------------------
 def _connect(db_path: str) -> sqlite3.Connection:
-    return connect(db_path)
-
-def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    conn = connect(db_path)
+    if isinstance(conn, sqlite3.Connection):
+        # conexão só de leitura do relatório: mmap + cache maior para as varreduras de COUNT/SUM
+        try:
+            conn.execute("PRAGMA query_only=1;")
+            conn.execute("PRAGMA mmap_size=268435456;")
+            conn.execute("PRAGMA cache_size=-262144;")
+            conn.execute("PRAGMA temp_store=MEMORY;")
+        except Exception:
+            pass
+    return conn
+
+def _tables(conn: sqlite3.Connection) -> set:
+    # todas as tabelas numa consulta só (o relatório testa várias)
     cur = conn.cursor()
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
-    return cur.fetchone() is not None
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    return {r[0] for r in cur.fetchall()}
 
 def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
     cur = conn.cursor()
     cur.execute(f"PRAGMA table_info({table})")
     return [r[1] for r in cur.fetchall()]
 
-def _pick_col(cols: List[str], candidates: List[str]) -> Optional[str]:
-    lower = {c.lower(): c for c in cols}
+def _norm_col(s: str) -> str:
+    # normalize removendo espaços, pontos e underscores
+    return "".join(ch for ch in s.lower() if ch.isalnum())
+
+def _col_maps(cols: List[str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Mapas (minúsculo -> coluna, normalizado -> coluna), montados uma vez por tabela."""
+    return {c.lower(): c for c in cols}, {_norm_col(c): c for c in cols}
+
+def _pick_col(maps: Tuple[Dict[str, str], Dict[str, str]], candidates: List[str]) -> Optional[str]:
+    lower, norm_map = maps
     for cand in candidates:
         key = cand.lower()
         if key in lower:
             return lower[key]
-    # tentativa: normalize removendo espaços, pontos e underscores
-    def norm(s: str) -> str:
-        return "".join(ch for ch in s.lower() if ch.isalnum())
-    norm_map = {norm(c): c for c in cols}
+    # tentativa: nomes normalizados
     for cand in candidates:
-        k = norm(cand)
+        k = _norm_col(cand)
         if k in norm_map:
             return norm_map[k]
     return None
 
+def _qcol(col: str) -> str:
+    # nome vindo do schema (pode ter espaço/ponto, ex.: "VLR. RESIDUAL"): sempre entre aspas
+    return '"' + col.replace('"', '""') + '"'
+
 def _safe_float(x: Any) -> float:
     try:
         if x is None:
@@ -117,9 +156,12 @@ def _safe_float(x: Any) -> float:
         return 0.0
 
 def _safe_int(x: Any) -> int:
+    # COUNT(*) já chega como int: devolve direto, sem a volta por float()
+    if type(x) is int:
+        return x
+    if x is None:
+        return 0
     try:
-        if x is None:
-            return 0
         return int(float(x))
     except Exception:
         return 0
@@ -141,38 +183,35 @@ def _fetch_metrics(db_path: str) -> Dict[str, Any]:
     }
 
     with _connect(db_path) as conn:
-        out["has_ctb"] = _table_exists(conn, "BsContabil")
-        out["has_fis"] = _table_exists(conn, "BsFisico")
-        out["has_depara"] = _table_exists(conn, "BsDePara") or _table_exists(conn, "BsDepara") or _table_exists(conn, "BsDePARA")
-        depara_table = "BsDePara" if _table_exists(conn, "BsDePara") else ("BsDepara" if _table_exists(conn, "BsDepara") else ("BsDePARA" if _table_exists(conn, "BsDePARA") else None))
+        tables = _tables(conn)
+        out["has_ctb"] = "BsContabil" in tables
+        out["has_fis"] = "BsFisico" in tables
+        depara_table = next((t for t in ("BsDePara", "BsDepara", "BsDePARA") if t in tables), None)
+        out["has_depara"] = depara_table is not None
 
         # Contábil
         if out["has_ctb"]:
-            cols = _columns(conn, "BsContabil")
+            cols = _col_maps(_columns(conn, "BsContabil"))
             col_cod = _pick_col(cols, ["COD_CONTA", "CONTA", "CODCONTA", "COD CONTA"])
             col_res = _pick_col(cols, ["VLR_RESIDUAL", "VLR. RESIDUAL", "VALOR_RESIDUAL", "RESIDUAL", "VLR RESIDUAL"])
             col_aq  = _pick_col(cols, ["VLR_AQUISICAO", "VLR. AQUISICAO", "VLR AQUISICAO", "AQUISICAO", "VALOR_AQUISICAO", "VLR AQUISIÇÃO", "VLR. AQUISIÇÃO"])
             col_dep = _pick_col(cols, ["DEP_ACUMULADA", "DEP. ACUMULADA", "DEPR_ACUMULADA", "DEPRECIACAO_ACUMULADA", "DEPR. ACUMULADA", "DEP ACUMULADA"])
 
-            # totais
+            # totais (contagem e residual numa leitura só da tabela)
             cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) FROM BsContabil")
-            out["ctb_qtd_total"] = _safe_int(cur.fetchone()[0])
-
-            if col_res:
-                q = f"SELECT COALESCE(SUM(CAST({col_res} AS REAL)),0) FROM BsContabil"
-                cur.execute(q)
-                out["ctb_residual_total"] = _safe_float(cur.fetchone()[0])
-            else:
-                out["ctb_residual_total"] = 0.0
+            res_sum = f"COALESCE(SUM(CAST({_qcol(col_res)} AS REAL)),0)" if col_res else "0"
+            cur.execute(f"SELECT COUNT(*), {res_sum} FROM BsContabil")
+            n, res = cur.fetchone()
+            out["ctb_qtd_total"] = _safe_int(n)
+            out["ctb_residual_total"] = _safe_float(res)
 
             # agregação por conta (top 10 por residual)
             if col_cod and col_res:
                 q = f"""
-                    SELECT {col_cod} AS conta,
-                           COALESCE(SUM(CAST({col_res} AS REAL)),0) AS residual
+                    SELECT {_qcol(col_cod)} AS conta,
+                           COALESCE(SUM(CAST({_qcol(col_res)} AS REAL)),0) AS residual
                     FROM BsContabil
-                    GROUP BY {col_cod}
+                    GROUP BY {_qcol(col_cod)}
                     ORDER BY residual DESC
                     LIMIT 12
                 """
@@ -183,17 +222,16 @@ def _fetch_metrics(db_path: str) -> Dict[str, Any]:
 
         # Físico
         if out["has_fis"]:
-            cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) FROM BsFisico")
-            out["fis_qtd_total"] = _safe_int(cur.fetchone()[0])
-
-            cols = _columns(conn, "BsFisico")
+            cols = _col_maps(_columns(conn, "BsFisico"))
             col_qtd = _pick_col(cols, ["QTD", "QTDE", "QUANTIDADE"])
-            if col_qtd:
-                cur.execute(f"SELECT COALESCE(SUM(CAST({col_qtd} AS REAL)),0) FROM BsFisico")
-                out["fis_qtd_soma"] = _safe_float(cur.fetchone()[0])
-            else:
-                out["fis_qtd_soma"] = float(out.get("fis_qtd_total", 0))
+
+            # contagem e soma de QTD numa leitura só da tabela
+            cur = conn.cursor()
+            qtd_sum = f"COALESCE(SUM(CAST({_qcol(col_qtd)} AS REAL)),0)" if col_qtd else "NULL"
+            cur.execute(f"SELECT COUNT(*), {qtd_sum} FROM BsFisico")
+            n, qtd = cur.fetchone()
+            out["fis_qtd_total"] = _safe_int(n)
+            out["fis_qtd_soma"] = _safe_float(qtd) if col_qtd else float(out["fis_qtd_total"])
 
         # De-Para / Conciliados
         if depara_table:
@@ -212,16 +250,25 @@ def _fetch_metrics(db_path: str) -> Dict[str, Any]:
 # -----------------------------
 # Geração de gráficos (PNG)
 # -----------------------------
-def _make_charts(metrics: Dict[str, Any], workdir: str) -> Dict[str, str]:
+# Os gráficos ocupam ~48% de um card (~190 x 170 pt) no PDF: 96 dpi já sobra para essa área
+# e gera PNGs bem menores que os 160 dpi da figura
+_CHART_DPI = 96
+
+
+def _png_bytes(fig) -> bytes:
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=_CHART_DPI, bbox_inches="tight", facecolor=fig.get_facecolor())
+    return buf.getvalue()
+
+
+def _make_charts(metrics: Dict[str, Any]) -> Dict[str, bytes]:
     """
-    Cria gráficos simples e retorna paths de imagens.
+    Cria gráficos simples e retorna os PNGs em memória (sem arquivos temporários).
     """
-    imgs: Dict[str, str] = {}
-    if plt is None:
+    imgs: Dict[str, bytes] = {}
+    if not _load_matplotlib():
         return imgs
 
-    os.makedirs(workdir, exist_ok=True)
-
     # Donut contábil (residual)
     total_res = float(metrics.get("ctb_residual_total", 0.0))
     # sem acesso ao residual conciliado/sobras com precisão sem coluna FRAG/flag no SQL.
@@ -233,7 +280,8 @@ def _make_charts(metrics: Dict[str, Any], workdir: str) -> Dict[str, str]:
         # se não tem residual, basear total em contagem mesmo
         pass
 
-    fig = plt.figure(figsize=(5.2, 3.2), dpi=160)
+    fig = Figure(figsize=(5.2, 3.2), dpi=160)
+    FigureCanvasAgg(fig)
     ax = fig.add_subplot(111)
     conc = ratio
     sob = max(0.0, 1.0 - conc)
@@ -245,17 +293,15 @@ def _make_charts(metrics: Dict[str, Any], workdir: str) -> Dict[str, str]:
     ax.legend(wedges, labels, loc="lower center", bbox_to_anchor=(0.5, -0.08), ncol=2, frameon=False, fontsize=9)
     ax.set_facecolor("#0f3b3b")
     fig.patch.set_facecolor("#0f3b3b")
-    p1 = os.path.join(workdir, "donut_ctb.png")
-    fig.savefig(p1, bbox_inches="tight", facecolor=fig.get_facecolor())
-    plt.close(fig)
-    imgs["donut_ctb"] = p1
+    imgs["donut_ctb"] = _png_bytes(fig)
 
     # Bar por conta (residual)
     data = metrics.get("ctb_residual_por_conta", [])
     if data:
         contas = [c for c, _ in data][::-1]
         vals = [v for _, v in data][::-1]
-        fig = plt.figure(figsize=(7.0, 3.6), dpi=160)
+        fig = Figure(figsize=(7.0, 3.6), dpi=160)
+        FigureCanvasAgg(fig)
         ax = fig.add_subplot(111)
         ax.barh(range(len(contas)), vals, color="#2aa198")
         ax.set_yticks(range(len(contas)))
@@ -265,10 +311,7 @@ def _make_charts(metrics: Dict[str, Any], workdir: str) -> Dict[str, str]:
         ax.grid(alpha=0.15)
         ax.set_facecolor("#0f3b3b")
         fig.patch.set_facecolor("#0f3b3b")
-        p2 = os.path.join(workdir, "bar_ctb_conta.png")
-        fig.savefig(p2, bbox_inches="tight", facecolor=fig.get_facecolor())
-        plt.close(fig)
-        imgs["bar_ctb_conta"] = p2
+        imgs["bar_ctb_conta"] = _png_bytes(fig)
 
     return imgs
 
@@ -343,9 +386,7 @@ def gerar_relatorio_pdf(db_path: Optional[str] = None,
 
     metrics = _fetch_metrics(db_path)
 
-    # Workdir temporário para imagens
-    workdir = os.path.join(os.path.dirname(output_path), "_tmp_pdf_imgs")
-    imgs = _make_charts(metrics, workdir)
+    imgs = _make_charts(metrics)
 
     _ensure_reportlab()
 
@@ -403,8 +444,8 @@ def gerar_relatorio_pdf(db_path: Optional[str] = None,
     x_right = 18 + card_w + 12
 
     def _draw_img(key: str, x: float, y: float, w: float, h: float):
-        p = imgs.get(key)
-        if not p or not os.path.exists(p):
+        png = imgs.get(key)
+        if not png:
             # placeholder
             c.setFillColorRGB(0.05, 0.21, 0.21)
             c.roundRect(x, y, w, h, 8, fill=1, stroke=0)
@@ -412,7 +453,7 @@ def gerar_relatorio_pdf(db_path: Optional[str] = None,
             c.setFont("Helvetica", 9)
             c.drawString(x + 10, y + h - 18, "Gráfico indisponível")
             return
-        c.drawImage(ImageReader(p), x, y, width=w, height=h, preserveAspectRatio=True, mask='auto')
+        c.drawImage(ImageReader(io.BytesIO(png)), x, y, width=w, height=h, preserveAspectRatio=True, mask='auto')
 
     # Donut contábil (esquerda) + barras por conta (direita)
     _draw_img("donut_ctb", x_left, y_graph, card_w*0.48, 170)
@@ -426,14 +467,4 @@ def gerar_relatorio_pdf(db_path: Optional[str] = None,
     c.showPage()
     c.save()
 
-    # Limpa imagens temporárias (best-effort)
-    try:
-        for p in imgs.values():
-            if os.path.exists(p):
-                os.remove(p)
-        if os.path.isdir(workdir) and not os.listdir(workdir):
-            os.rmdir(workdir)
-    except Exception:
-        pass
-
     return output_path